@@ -1,7 +1,10 @@
 export KAFKA_TOPIC=ohlc_historical
 export KAFKA_CONSUMER_GROUP=ohlc_historical_consumer_group_NEW
 export FEATURE_GROUP_NAME=ohlc_feature_group
-export FEATURE_GROUP_VERSION=3
+# v4: the candles gained volume, notional, vwap, trade_count, buy_volume, sell_volume and is_forward_filled
+export FEATURE_GROUP_VERSION=4
+# the candle resolution written to the feature group, the topic can carry the roll-ups of trade_to_ohlc too
+export OHLC_WINDOW_SECONDS=60
 
 # number of elements we save at once to the Hopsworks feature store
 # This value of 10080 corresponds to saving batches of 1 week of data at once
@@ -1,7 +1,10 @@
 export KAFKA_TOPIC=ohlc
 export KAFKA_CONSUMER_GROUP=ohlc_consumer_group_99
 export FEATURE_GROUP_NAME=ohlc_feature_group
-export FEATURE_GROUP_VERSION=3
+# v4: the candles gained volume, notional, vwap, trade_count, buy_volume, sell_volume and is_forward_filled
+export FEATURE_GROUP_VERSION=4
+# the candle resolution written to the feature group, the topic can carry the roll-ups of trade_to_ohlc too
+export OHLC_WINDOW_SECONDS=60
 
 # number of elements we save at once to the Hopsworks feature store
 # For live data we want to save it to the online store as soon as possible,
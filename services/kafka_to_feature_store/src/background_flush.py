@@ -0,0 +1,254 @@
+# Double-buffered writes to the feature store: the consumer keeps filling a new buffer while the full ones are
+# inserted by background threads
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from sinks import FeatureGroupSink
+from spill_journal import SpillJournal
+
+
+class BackgroundFlusher:
+    """
+    Hands full buffers to background threads that insert them into the feature group, so the polling loop is not
+    blocked for the length of an insert (minutes for a 200k-row historical batch).
+
+    At most max_in_flight_flushes buffers are being inserted at once. When they are all busy, submit() turns the
+    buffer down instead of blocking (backpressure): the consumer pauses its partitions and keeps the buffer, but
+    goes on polling, so it neither piles up buffers in memory nor overruns max.poll.interval.ms. The lag is left
+    in Kafka.
+
+    Delivery is at least once. A buffer is submitted with the Kafka offsets it covers, and committable_offsets()
+    only returns them once the buffer is safe, in the order the buffers were submitted:
+
+        - inserted: the insert is retried up to max_retries times, with an exponential backoff
+        - or spilled: after the last retry, the buffer is written to the on-disk SpillJournal and replayed into the
+          feature group by a background thread once it is back. While the journal is not empty the feature store
+          is known to be down, so new buffers are spilled at once instead of waiting through the retries
+
+    Memory stays bounded during an outage (the buffers in flight, the rest is on disk), and a restart resumes from
+    the committed offsets plus the journal, without replaying the topic with a new consumer group.
+
+    Every insert acknowledged logs the end-to-end lag of its batch, from the candle timestamps (window end) to the
+    acknowledgement.
+    """
+
+    def __init__(
+        self,
+        sink: FeatureGroupSink,
+        online_or_offline: str,
+        journal: SpillJournal,
+        max_in_flight_flushes: Optional[int] = 1,
+        max_retries: Optional[int] = 5,
+        retry_backoff_sec: Optional[float] = 1,
+        retry_max_backoff_sec: Optional[float] = 30,
+        replay_interval_sec: Optional[float] = 30,
+    ) -> None:
+        """
+        Args:
+            sink (FeatureGroupSink): The feature group the buffers are written to (Hopsworks, local, or both)
+            online_or_offline (str): Whether the offline or the online feature group store is used
+            journal (SpillJournal): Where the buffers that could not be inserted are kept
+            max_in_flight_flushes (int): Maximum number of buffers inserted at the same time
+            max_retries (int): Retries of a failed insert before the buffer is spilled
+            retry_backoff_sec (float): Wait before the first retry, doubled at every retry
+            retry_max_backoff_sec (float): Longest wait between two retries
+            replay_interval_sec (float): Seconds between two attempts to replay the journal
+
+        Returns:
+            None
+        """
+        assert max_in_flight_flushes >= 1, f'Invalid value for max_in_flight_flushes: {max_in_flight_flushes}'
+        self.sink = sink
+        self.online_or_offline = online_or_offline
+        self.journal = journal
+        self.max_in_flight_flushes = max_in_flight_flushes
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
+        self.retry_max_backoff_sec = retry_max_backoff_sec
+        self.replay_interval_sec = replay_interval_sec
+
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight_flushes, thread_name_prefix='flush')
+        self._slots = threading.Semaphore(max_in_flight_flushes)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+        # Submitted buffers in order, {seq: [offsets, safe]}, until their offsets are handed out for the commit
+        self._batches: 'OrderedDict[int, list]' = OrderedDict()
+        self._next_seq = 0
+        self._error: Optional[Exception] = None
+
+        # Replays the journal, including the batches spilled before a restart
+        self._stop = threading.Event()
+        self._replay_thread = threading.Thread(target=self._replay_loop, name='replay', daemon=True)
+        self._replay_thread.start()
+
+        # Stats, for the logs
+        self.n_flushes = 0
+        self.n_rows_flushed = 0
+        self.n_spilled = 0
+        self.n_replayed = 0
+        self.backpressure_sec = 0.0
+        self._busy_since: Optional[float] = None # first time a buffer was turned down, while every slot is busy
+        self.last_lag_sec: Optional[float] = None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def submit(self, buffer: pd.DataFrame, offsets: Dict[Tuple[str, int], int]) -> bool:
+        """
+        Hands the buffer to a background insert, if one of the max_in_flight_flushes slots is free. Never blocks.
+        Once taken, the caller must not touch the buffer anymore, it starts a new one.
+
+        Args:
+            buffer (pd.DataFrame): The candles to write (CandleColumns.to_dataframe()), can be empty when all the
+                messages were skipped
+            offsets (Dict[Tuple[str, int], int]): The offset to commit for every (topic, partition) of the buffer,
+                the one after its last message
+
+        Returns:
+            bool: False when every slot is busy and the buffer was not taken, to be submitted again later
+        """
+        self.raise_if_failed()
+        if not self._slots.acquire(blocking=False):
+            if self._busy_since is None:
+                self._busy_since = time.monotonic()
+            return False
+        if self._busy_since is not None:
+            self.backpressure_sec += time.monotonic() - self._busy_since
+            self._busy_since = None
+
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._batches[seq] = [offsets, False]
+            self._in_flight += 1
+        self._executor.submit(self._flush, seq, buffer)
+        return True
+
+    def _insert(self, data: pd.DataFrame) -> None:
+        timing = self.sink.push(data=data, online_or_offline=self.online_or_offline)
+        acked_ms = time.time() * 1000
+
+        # End-to-end lag, from the close of the candles to the acknowledgement of their insert
+        if 'timestamp' in data and len(data):
+            self.last_lag_sec = (acked_ms - data['timestamp'].max()) / 1000
+            logger.info(
+                f'Flushed {len(data)} candles in {timing["total_sec"]:.2f} sec, end-to-end lag '
+                f'{self.last_lag_sec:.1f} sec (oldest candle {(acked_ms - data["timestamp"].min()) / 1000:.1f} sec)'
+            )
+        with self._lock:
+            self.n_flushes += 1
+            self.n_rows_flushed += len(data)
+
+    def _flush(self, seq: int, buffer: pd.DataFrame) -> None:
+        try:
+            if len(buffer):
+                self._insert_or_spill(buffer)
+            with self._lock:
+                self._batches[seq][1] = True
+        except Exception as e:
+            # NOTE: the buffer is neither in the feature store nor on disk: its offsets are never committed and
+            # the consumer stops, so it is read again from Kafka after the restart
+            logger.error(f'Failed to spill {len(buffer)} candles to {self.journal.dir}: {e}')
+            self._error = e
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def _insert_or_spill(self, buffer: pd.DataFrame) -> None:
+        if not len(self.journal):
+            backoff_sec = self.retry_backoff_sec
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self._insert(buffer)
+                    return
+                except Exception as e:
+                    logger.error(f'Failed to push data to the feature store (attempt {attempt + 1}): {e}')
+                if attempt == self.max_retries:
+                    break
+                # Shutting down: spill rather than hold up the exit with the remaining retries
+                if self._stop.wait(backoff_sec):
+                    break
+                backoff_sec = min(backoff_sec * 2, self.retry_max_backoff_sec)
+
+        path = self.journal.append(buffer)
+        with self._lock:
+            self.n_spilled += 1
+        logger.warning(f'Spilled {len(buffer)} candles to {path}, replayed once the feature store is back')
+
+    def _replay_loop(self) -> None:
+        while not self._stop.wait(self.replay_interval_sec):
+            pending = self.journal.pending()
+            if not pending:
+                continue
+            self.journal.log_status()
+            for path in pending:
+                if self._stop.is_set():
+                    return
+                try:
+                    self._insert(self.journal.load(path))
+                except Exception as e:
+                    logger.error(f'Feature store still unavailable, {len(pending)} batches left to replay: {e}')
+                    break
+                self.journal.remove(path)
+                with self._lock:
+                    self.n_replayed += 1
+                logger.info(f'Replayed {path.name} from the spill journal')
+
+    def committable_offsets(self) -> Dict[Tuple[str, int], int]:
+        """
+        Returns:
+            Dict[Tuple[str, int], int]: The offsets of the buffers inserted or spilled since the last call, up to
+                the first one still in flight so nothing is committed ahead of a buffer that may yet be lost
+        """
+        offsets = {}
+        with self._lock:
+            while self._batches:
+                seq, (batch_offsets, safe) = next(iter(self._batches.items()))
+                if not safe:
+                    break
+                offsets.update(batch_offsets)
+                del self._batches[seq]
+        return offsets
+
+    @property
+    def failed(self) -> bool:
+        return self._error is not None
+
+    def raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError('A batch could be neither inserted nor spilled') from self._error
+
+    def wait(self) -> None:
+        """
+        Waits for the flushes in flight to finish. Blocks, so not from the polling loop or a rebalance callback
+        """
+        if self._in_flight:
+            logger.info(f'Waiting for {self._in_flight} flushes in flight')
+        for _ in range(self.max_in_flight_flushes):
+            self._slots.acquire()
+        for _ in range(self.max_in_flight_flushes):
+            self._slots.release()
+
+    def close(self) -> None:
+        """
+        Waits for the flushes in flight to finish and stops the replay of the journal, what is left in it is
+        replayed after the restart
+        """
+        self._stop.set()
+        self.wait()
+        self._executor.shutdown(wait=True)
+        self._replay_thread.join()
+        self.journal.log_status()
+        logger.info(
+            f'{self.n_flushes} flushes, {self.n_rows_flushed} candles written, {self.n_spilled} batches spilled, '
+            f'{self.n_replayed} replayed, {self.backpressure_sec:.1f} sec waiting on the feature store'
+        )
@@ -0,0 +1,108 @@
+# Benchmark of the buffering of candles before an insert: consume() batches decoded with orjson into typed columns
+# (candle_columns.py), against the json.loads list of dicts turned into a dataframe at flush time it replaced.
+# Reports rows/sec and the peak RSS each path adds
+#
+# Usage: poetry run python src/benchmark_buffering.py [--n-candles 200000] [--consume-batch-size 10000]
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import time
+from typing import List, Tuple
+
+import pandas as pd
+from loguru import logger
+from quixstreams.utils.json import loads
+
+from candle_columns import CandleColumns
+
+PRODUCT_IDS = ['BTC/USD', 'ETH/USD', 'ETH/EUR', 'BTC/EUR', 'SOL/USD', 'XRP/USD']
+
+
+def make_messages(n_candles: int) -> List[bytes]:
+    """
+    The candles as trade_to_ohlc writes them to the ohlc topic, serialised
+    """
+    random.seed(0)
+    messages = []
+    for i in range(n_candles):
+        close = 63_500.0 + random.gauss(0, 50)
+        volume = random.expovariate(1)
+        messages.append(json.dumps({
+            'timestamp': 1_717_667_940_000 + (i // len(PRODUCT_IDS)) * 60_000,
+            'product_id': PRODUCT_IDS[i % len(PRODUCT_IDS)],
+            'open': close - 3.5, 'high': close + 10.25, 'low': close - 12.0, 'close': close,
+            'volume': volume, 'notional': volume * close, 'vwap': close - 0.5, 'trade_count': random.randint(1, 500),
+            'buy_volume': volume / 2, 'sell_volume': volume / 2,
+        }).encode())
+    return messages
+
+
+def buffer_dicts(batches: List[List[bytes]], n_candles: int) -> pd.DataFrame:
+    # The path before the typed columns: one dict per candle, converted all at once at flush time
+    buffer = []
+    for batch in batches:
+        for value in batch:
+            buffer.append(json.loads(value.decode('utf-8')))
+    return pd.DataFrame(buffer)
+
+
+def buffer_columns(batches: List[List[bytes]], n_candles: int) -> pd.DataFrame:
+    buffer = CandleColumns(n_candles)
+    for batch in batches:
+        buffer.extend([loads(value) for value in batch])
+    return buffer.to_dataframe()
+
+
+def peak_rss_mb() -> float:
+    # NOTE: ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(path: str, n_candles: int, consume_batch_size: int) -> Tuple[float, float, float]:
+    """
+    Buffers n_candles candles, read in batches of consume_batch_size messages, into a dataframe ready to insert.
+    Runs in its own process, so the peak RSS is the one of this path only.
+
+    Returns:
+        Tuple[float, float, float]: rows/sec, the peak RSS added by buffering in MB, and the time spent in the
+            conversion to a dataframe in sec
+    """
+    messages = make_messages(n_candles)
+    batches = [messages[i:i + consume_batch_size] for i in range(0, n_candles, consume_batch_size)]
+    rss_before_mb = peak_rss_mb()
+
+    started_at = time.perf_counter()
+    df = {'dicts': buffer_dicts, 'columns': buffer_columns}[path](batches, n_candles)
+    elapsed_sec = time.perf_counter() - started_at
+    assert len(df) == n_candles
+
+    return n_candles / elapsed_sec, peak_rss_mb() - rss_before_mb, elapsed_sec
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-candles', type=int, default=200_000)
+    parser.add_argument('--consume-batch-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    # Both paths must give the same dataframe, but for the categorical product_id
+    batches = [make_messages(1_000)]
+    dicts_df, columns_df = buffer_dicts(batches, 1_000), buffer_columns(batches, 1_000)
+    pd.testing.assert_frame_equal(dicts_df, columns_df.astype({'product_id': dicts_df['product_id'].dtype}))
+
+    # NOTE: spawn, so every path starts from a fresh process and its peak RSS is its own
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for path in ('dicts', 'columns'):
+        with context.Pool(1) as pool:
+            results[path] = pool.apply(run, (path, args.n_candles, args.consume_batch_size))
+        rows_per_sec, rss_mb, elapsed_sec = results[path]
+        logger.info(f'{path:<8} {rows_per_sec:>12,.0f} rows/sec {rss_mb:>8.1f} MB peak RSS added {elapsed_sec:>6.2f} sec')
+
+    logger.info(
+        f"columns vs dicts: x{results['columns'][0] / results['dicts'][0]:.2f} rows/sec, "
+        f"{results['dicts'][1] / max(results['columns'][1], 0.1):.1f}x less peak memory"
+    )
@@ -0,0 +1,157 @@
+# Column oriented buffer of the candles read from Kafka, decoded straight into preallocated numpy arrays
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+
+class CandleColumns:
+    """
+    Buffer of up to `capacity` candles, one preallocated numpy array per field instead of one dict per candle:
+
+        timestamp, trade_count (int64), product_id (categorical: int32 codes + the list of products),
+        open, high, low, close, volume, vwap, ... (float64), is_forward_filled (bool)
+
+    The columns and their types are taken from the candles as they come (the first value seen of every field), so
+    the fields added to the candles later on need no change here. A field missing from a candle is NaN, an int or
+    bool column that gets a float or a missing value is turned into a float64 one.
+
+    to_dataframe() hands the filled part of the arrays to pandas without copying them: the buffer must not be
+    appended to afterwards, the next candles go into a new one.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        """
+        Args:
+            capacity (int): Number of candles preallocated, the buffer grows past it if needed
+
+        Returns:
+            None
+        """
+        self.capacity = max(capacity, 1)
+        self.n = 0
+        self._columns: Dict[str, np.ndarray] = {}
+        # Codes of the values of the categorical columns, in the order they were seen
+        self._categories: Dict[str, Dict[str, int]] = {}
+
+    def __len__(self) -> int:
+        return self.n
+
+    def _add_column(self, name: str, value) -> np.ndarray:
+        if isinstance(value, bool):
+            column = np.zeros(self.capacity, dtype=bool)
+        elif isinstance(value, int):
+            column = np.zeros(self.capacity, dtype=np.int64)
+        elif isinstance(value, str):
+            column = np.full(self.capacity, -1, dtype=np.int32)
+            self._categories[name] = {}
+        else:
+            column = np.full(self.capacity, np.nan, dtype=np.float64)
+        # NOTE: the candles before this one did not have the field
+        if self.n and name not in self._categories:
+            column = column.astype(np.float64)
+            column[:self.n] = np.nan
+        self._columns[name] = column
+        return column
+
+    def _to_float(self, name: str) -> np.ndarray:
+        column = self._columns[name].astype(np.float64)
+        self._columns[name] = column
+        return column
+
+    def _grow(self) -> None:
+        self.capacity *= 2
+        for name, column in self._columns.items():
+            grown = np.empty(self.capacity, dtype=column.dtype)
+            grown[:self.n] = column[:self.n]
+            self._columns[name] = grown
+
+    def append(self, candle: dict) -> None:
+        if self.n == self.capacity:
+            self._grow()
+        i = self.n
+        for name, value in candle.items():
+            column = self._columns.get(name)
+            if column is None:
+                column = self._add_column(name, value)
+
+            categories = self._categories.get(name)
+            if categories is not None:
+                code = categories.get(value)
+                if code is None:
+                    code = categories[value] = len(categories)
+                column[i] = code
+            elif value is None:
+                if column.dtype != np.float64:
+                    column = self._to_float(name)
+                column[i] = np.nan
+            else:
+                if column.dtype != np.float64 and isinstance(value, float):
+                    column = self._to_float(name)
+                column[i] = value
+
+        # Fields of the buffer missing from this candle
+        if len(candle) < len(self._columns):
+            for name in self._columns.keys() - candle.keys():
+                if name in self._categories:
+                    self._columns[name][i] = -1
+                else:
+                    self._to_float(name)[i] = np.nan
+        self.n += 1
+
+    def extend(self, candles: List[dict]) -> None:
+        """
+        Appends a batch of candles (a consume() batch) column by column, one numpy conversion per field instead of
+        one assignment per field and candle. Falls back to append() for the batches whose candles do not all have the
+        fields of the buffer, or values numpy cannot type (None)
+        """
+        if not self._columns and candles:
+            # The first candle sets up the columns
+            self.append(candles[0])
+            candles = candles[1:]
+        if not candles:
+            return
+        n_candles = len(candles)
+        keys = self._columns.keys()
+        if any(candle.keys() != keys for candle in candles):
+            for candle in candles:
+                self.append(candle)
+            return
+
+        while self.n + n_candles > self.capacity:
+            self._grow()
+        start, end = self.n, self.n + n_candles
+        for name, column in list(self._columns.items()):
+            values = [candle[name] for candle in candles]
+
+            categories = self._categories.get(name)
+            if categories is not None:
+                for value in set(values) - categories.keys():
+                    categories[value] = len(categories)
+                column[start:end] = [categories[value] for value in values]
+                continue
+
+            array = np.array(values)
+            if array.dtype.kind not in 'bif':
+                # Missing values, or a type change within the field. append() writes the rows again from the start
+                for candle in candles:
+                    self.append(candle)
+                return
+            if column.dtype != np.float64 and array.dtype.kind != column.dtype.kind:
+                column = self._to_float(name)
+            column[start:end] = array
+        self.n = end
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: The candles, the columns are views on the arrays of the buffer
+        """
+        data = {}
+        for name, column in self._columns.items():
+            if name in self._categories:
+                data[name] = pd.Categorical.from_codes(column[:self.n], categories=list(self._categories[name]))
+            else:
+                data[name] = column[:self.n]
+        return pd.DataFrame(data, copy=False)
+
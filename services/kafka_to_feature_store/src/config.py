@@ -37,7 +37,7 @@ class Config(BaseSettings):
     kafka_topic_name: str = 'ohlc_historical'
     kafka_consumer_group: str = 'trade_to_ohlc_historical_group'
     feature_group_name: str = 'ohlc_feature_group_v5' #from v4
-    feature_group_version: int = 1
+    feature_group_version: int = 2 # v2: candles with volume, notional, vwap, trade_count, buy/sell_volume and is_forward_filled
 
     # by default we want our `kafka_to_feature_store` service to run in live mode
     live_or_historical: str = 'historical'
@@ -50,10 +50,33 @@ class Config(BaseSettings):
 
     # whether to create a new consumer group or not
     create_new_consumer_group: bool = False
+
+    # the resolution written to the feature group when the ohlc topic carries several (trade_to_ohlc roll-ups), the base
+    # window by default. A feature group is keyed on (product_id, timestamp), so it can only hold one resolution
+    ohlc_window_seconds: int = 60
+
+    # buffers inserted in the background at the same time, the partitions are paused when they are all busy
+    max_in_flight_flushes: int = 1
+
+    # retries of a failed insert, with an exponential backoff from flush_retry_backoff_sec, before the buffer is spilled to disk
+    flush_max_retries: int = 5
+    flush_retry_backoff_sec: float = 1
+
+    # journal of the buffers the feature store could not take, replayed every replay_interval_sec once it is back
+    spill_dir: str = 'state/spill'
+    replay_interval_sec: float = 30
+
+    # maximum number of messages read from Kafka at once
+    consume_batch_size: int = 10_000
+
+    # where the features are written: 'hopsworks', 'local' (parquet offline store + sqlite online store under local_store_dir,
+    # no network or credentials needed) or 'hopsworks+local' (Hopsworks with a local mirror)
+    feature_store_backend: str = 'hopsworks'
+    local_store_dir: str = 'state/local_feature_store'
     
-    # required to authenticate with Hopsworks API
-    hopsworks_project_name: str = os.getenv('HOPSWORKS_PROJECT_NAME')
-    hopsworks_api_key: str = os.getenv('HOPSWORKS_API_KEY')
+    # required to authenticate with Hopsworks API, not with the local backend
+    hopsworks_project_name: Optional[str] = os.getenv('HOPSWORKS_PROJECT_NAME')
+    hopsworks_api_key: Optional[str] = os.getenv('HOPSWORKS_API_KEY')
 
 
     ######################################################
@@ -92,6 +115,22 @@ class Config(BaseSettings):
         }, f'Invalid value for live_or_historical: {value}'
         return value
 
+    @field_validator('ohlc_window_seconds')
+    @classmethod
+    def validate_ohlc_window_seconds(cls, value):
+        assert value > 0, f'Invalid value for ohlc_window_seconds: {value}'
+        return value
+
+    @field_validator('feature_store_backend')
+    @classmethod
+    def validate_feature_store_backend(cls, value):
+        assert value in {
+            'hopsworks',
+            'local',
+            'hopsworks+local',
+        }, f'Invalid value for feature_store_backend: {value}'
+        return value
+
 
 config_kafka_to_hops = Config()
 
@@ -99,6 +138,8 @@ print("KAFKA_BROKER_ADDRESS:", config_kafka_to_hops.kafka_broker_address)
 print("HOPSWORKS_PROJECT_NAME:", config_kafka_to_hops.hopsworks_project_name)
 print("feature_group_name:", config_kafka_to_hops.feature_group_name)
 print("feature_group_name:", config_kafka_to_hops.live_or_historical)
+print("feature_store_backend:", config_kafka_to_hops.feature_store_backend)
+print("ohlc_window_seconds:", config_kafka_to_hops.ohlc_window_seconds)
 
 
 
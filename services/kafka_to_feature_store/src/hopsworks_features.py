@@ -1,9 +1,188 @@
 # Defining the function that takes int ohlc_candle_sticks dict and writes into hopsworks feature storet tables
 
-from typing import List
+import threading
+import time
+from typing import List, Optional, Union
 import pandas as pd
 import hopsworks
+from loguru import logger
 from config import config_kafka_to_hops
+from sinks import to_feature_frame
+
+
+class HopsworksFeatureGroupSink:
+    """
+    Long-lived writer to one feature group. Logs in to Hopsworks once and keeps the project, feature store and
+    feature group handles between flushes, so a flush only pays for the insert instead of a login, a feature store
+    lookup and a get_or_create_feature_group round-trip every time.
+
+    The handles are (re)created lazily: on the first push, and again when an insert fails because the session
+    expired (HTTP 401/403) or the connection dropped. The insert is then retried once with the fresh handles.
+
+    Every push returns its timing, split into connect (login and handles, zero while they are cached), convert (list
+    of dicts to a dataframe) and insert.
+    """
+
+    def __init__(
+        self,
+        feature_group_name: str,
+        feature_group_version: int,
+        project_name: Optional[str] = None,
+        api_key: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): The version number
+            project_name (str): Hopsworks project, HOPSWORKS_PROJECT_NAME from the config by default
+            api_key (str): Hopsworks API key, HOPSWORKS_API_KEY from the config by default
+
+        Returns:
+            None
+        """
+        self.feature_group_name = feature_group_name
+        self.feature_group_version = feature_group_version
+        self.project_name = project_name or config_kafka_to_hops.hopsworks_project_name
+        self.api_key = api_key or config_kafka_to_hops.hopsworks_api_key
+
+        self._project = None
+        self._feature_store = None
+        self._feature_group = None
+        # NOTE: pushes can run from several flush threads, only one of them logs in
+        self._connect_lock = threading.Lock()
+
+        self.n_connects = 0
+        self.last_flush_timing: Optional[dict] = None
+
+    def _connect(self) -> float:
+        """
+        Logs in and gets the feature group handle if they are not cached
+
+        Returns:
+            float: Seconds spent connecting, 0 when the handles were cached
+        """
+        if self._feature_group is not None:
+            return 0.0
+        with self._connect_lock:
+            if self._feature_group is not None:
+                return 0.0
+            return self._login()
+
+    def _login(self) -> float:
+        started_at = time.perf_counter()
+        self._project = hopsworks.login(
+            project=self.project_name,
+            api_key_value=self.api_key,
+        )
+        self._feature_store = self._project.get_feature_store()
+
+        # Create a new feature group to start inserting feature values.
+        self._feature_group = self._feature_store.get_or_create_feature_group(
+            name=self.feature_group_name,
+            version=self.feature_group_version,
+            description='Open High Low Close candle sticks streamed and transformed from kraken websocketapi',
+            primary_key=["product_id", "timestamp"],
+            event_time='timestamp',
+            online_enabled=True, #for real time predctions, the features are stored in the online store for inference
+        )
+        self.n_connects += 1
+        connect_sec = time.perf_counter() - started_at
+        logger.info(
+            f'Connected to feature group {self.feature_group_name} v{self.feature_group_version} in {connect_sec:.2f} sec'
+        )
+        return connect_sec
+
+    def reset(self) -> None:
+        """
+        Drops the cached handles, the next push logs in again
+        """
+        self._project = None
+        self._feature_store = None
+        self._feature_group = None
+
+    @staticmethod
+    def _is_session_error(error: Exception) -> bool:
+        # NOTE: hopsworks raises RestAPIError with the HTTP response for an expired API session, and requests raises
+        # ConnectionError (an OSError) when the kept-alive connection was closed on the other side
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status_code in (401, 403) or isinstance(error, OSError)
+
+    def push(self, data: Union[List[dict], pd.DataFrame], online_or_offline: str) -> dict:
+        """
+        Writes the data into the feature group
+
+        Args:
+            data (Union[List[dict], pd.DataFrame]) : The ohlc candle sticks, as a List of dicts or already as a dataframe (CandleColumns.to_dataframe())
+            online_or_offline (str) : Whether the offline or the online feature group store is used
+
+        Returns:
+            dict: Timing of the flush, {'rows', 'connect_sec', 'convert_sec', 'insert_sec', 'total_sec'}
+        """
+        connect_sec = self._connect()
+
+        # Transform the data, which is a list of dicts into a dataframe. Hopsworks feature stores don't use dicts, but are compatiable with pandas dataframes
+        started_at = time.perf_counter()
+        df = to_feature_frame(data)
+        convert_sec = time.perf_counter() - started_at
+
+        write_options = {"start_offline_materialization": True if online_or_offline == "offline" else False}
+
+        started_at = time.perf_counter()
+        try:
+            self._feature_group.insert(df, write_options=write_options)
+        except Exception as e:
+            if not self._is_session_error(e):
+                raise
+            logger.warning(f'Feature store session lost ({e}), reconnecting')
+            self.reset()
+            connect_sec += self._connect()
+            started_at = time.perf_counter()
+            self._feature_group.insert(df, write_options=write_options)
+        insert_sec = time.perf_counter() - started_at
+
+        self.last_flush_timing = {
+            'rows': len(df),
+            'connect_sec': connect_sec,
+            'convert_sec': convert_sec,
+            'insert_sec': insert_sec,
+            'total_sec': connect_sec + convert_sec + insert_sec,
+        }
+        logger.info(
+            f'Pushed {len(df)} rows to {self.feature_group_name}: connect {connect_sec * 1000:.0f} ms, '
+            f'convert {convert_sec * 1000:.0f} ms, insert {insert_sec * 1000:.0f} ms'
+        )
+        return self.last_flush_timing
+
+    def read(
+        self,
+        product_ids: Optional[List[str]] = None,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+        online: Optional[bool] = False,
+    ) -> pd.DataFrame:
+        """
+        Reads the rows of the feature group within an event time range
+
+        Args:
+            product_ids (List[str]): The products to read, all of them by default
+            start_ms (int): Start of the event time range, included
+            end_ms (int): End of the event time range, excluded
+            online (bool): Read from the online store rather than the offline one
+
+        Returns:
+            pd.DataFrame: One row per (product_id, timestamp), sorted by product and time
+        """
+        self._connect()
+        feature_group = self._feature_group
+        query = feature_group.select_all()
+        if product_ids is not None:
+            query = query.filter(feature_group.product_id.isin(product_ids))
+        if start_ms is not None:
+            query = query.filter(feature_group.timestamp >= start_ms)
+        if end_ms is not None:
+            query = query.filter(feature_group.timestamp < end_ms)
+        df = query.read(online=online)
+        return df.sort_values(['product_id', 'timestamp']).reset_index(drop=True)
 
 
 def push_data_to_feature_store(
@@ -17,6 +196,8 @@ def push_data_to_feature_store(
     """
     Write the data of the incoming features, which are the ohlc candle sticks, into the feature store tagging them with the corresponding {feature_group_name} and {feature_group_version}
 
+    NOTE: logs in on every call, fine for one-off pushes. Long-running consumers keep a HopsworksFeatureGroupSink instead
+
     Args:
 
     feature_group_name (str) : Name of the featutre group  
@@ -26,44 +207,7 @@ def push_data_to_feature_store(
 
     
     """
-
-    # Instantiate a connection and get the project feature store handler
-    project = hopsworks.login(
-        project = config_kafka_to_hops.hopsworks_project_name,
-
-        api_key_value= config_kafka_to_hops.hopsworks_api_key,
-    )
-
-    feature_store = project.get_feature_store()
-
-    # Create a new feature group to start inserting feature values.
-    ohlc_feature_group = feature_store.get_or_create_feature_group(
-        name= feature_group_name,
-        version = feature_group_version,
-        description = 'Open High Low Close candle sticks streamed and transformed from kraken websocketapi',
-        primary_key = ["product_id","timestamp"],
-        event_time = 'timestamp',
-        online_enabled=True, #for real time predctions, the features are stored in the online store for inference 
-    )
-
-    # breakpoint()
-
-    # Transform the data, which is a list of dicts into a dataframe. Why? Because Hopsworks feature stores don't use dicts, but are compatiable with pandas dataframes. Input data as a list of dictionaries not just dictionary - ValueError otherwise
-    data = pd.DataFrame(data)
-    
-    # Write the data to the feature group
-    ohlc_feature_group.insert(
-        data,
-        write_options=
-        {
-            #"start_offline_materialization": True if online_or_offline == "offline" else False 
-            "start_offline_materialization": True if online_or_offline == "offline" else False 
-        }
-        
-    )
-
-
-
-
-
-    
+    HopsworksFeatureGroupSink(
+        feature_group_name=feature_group_name,
+        feature_group_version=feature_group_version,
+    ).push(data=data, online_or_offline=online_or_offline)
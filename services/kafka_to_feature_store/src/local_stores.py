@@ -0,0 +1,254 @@
+# Local stand-ins for the Hopsworks feature group: partitioned parquet files as the offline store and an embedded
+# sqlite key-value table as the online store. No network or credentials needed
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Union
+from urllib.parse import quote, unquote
+
+import pandas as pd
+from loguru import logger
+from quixstreams.utils.json import dumps, loads
+
+from sinks import to_feature_frame
+
+PRIMARY_KEY = ['product_id', 'timestamp']
+
+
+class ParquetOfflineStore:
+    """
+    The offline store, hive-partitioned by product and by day of the event time:
+
+        {store_dir}/offline/{feature_group_name}_v{version}/product_id=BTC%2FUSD/date=2024-06-06/part-{ns}-{pid}.parquet
+
+    Every push adds files, none is rewritten. A row pushed again with the same (product_id, timestamp) replaces the
+    previous one at read time: the files are read in the order they were written and the last row of a key is kept.
+    A read only opens the partitions of the products and days it asks for. A read without rows still has the columns
+    of the stored rows (the primary key only, when nothing was stored yet).
+    """
+
+    def __init__(self, store_dir: str, feature_group_name: str, feature_group_version: int) -> None:
+        """
+        Args:
+            store_dir (str): Root directory of the local stores
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): The version of the feature group
+
+        Returns:
+            None
+        """
+        self.dir = Path(store_dir) / 'offline' / f'{feature_group_name}_v{feature_group_version}'
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def write(self, df: pd.DataFrame) -> int:
+        """
+        Returns:
+            int: Number of files written
+        """
+        dates = pd.to_datetime(df['timestamp'], unit='ms', utc=True).dt.strftime('%Y-%m-%d')
+        n_files = 0
+        for (product_id, date), partition in df.groupby([df['product_id'], dates], sort=False):
+            partition_dir = self.dir / f'product_id={quote(str(product_id), safe="")}' / f'date={date}'
+            partition_dir.mkdir(parents=True, exist_ok=True)
+            # NOTE: the name orders the files by write time, and the pid keeps the workers of a same store apart
+            partition.to_parquet(partition_dir / f'part-{time.time_ns()}-{os.getpid()}.parquet', index=False)
+            n_files += 1
+        return n_files
+
+    def read(
+        self,
+        product_ids: Optional[List[str]] = None,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+    ) -> pd.DataFrame:
+        start_date = None if start_ms is None else pd.Timestamp(start_ms, unit='ms', tz='UTC').strftime('%Y-%m-%d')
+        end_date = None if end_ms is None else pd.Timestamp(end_ms, unit='ms', tz='UTC').strftime('%Y-%m-%d')
+
+        files = []
+        for product_dir in self.dir.glob('product_id=*'):
+            if product_ids is not None and unquote(product_dir.name.split('=', 1)[1]) not in product_ids:
+                continue
+            for date_dir in product_dir.glob('date=*'):
+                date = date_dir.name.split('=', 1)[1]
+                if (start_date is not None and date < start_date) or (end_date is not None and date > end_date):
+                    continue
+                files.extend(date_dir.glob('part-*.parquet'))
+        if not files:
+            return self._empty_frame()
+
+        # Write order, so the last version of a row wins
+        files.sort(key=lambda path: path.name)
+        df = pd.concat([pd.read_parquet(path) for path in files], ignore_index=True)
+        if start_ms is not None:
+            df = df[df['timestamp'] >= start_ms]
+        if end_ms is not None:
+            df = df[df['timestamp'] < end_ms]
+        df = df.drop_duplicates(subset=PRIMARY_KEY, keep='last')
+        return df.sort_values(PRIMARY_KEY).reset_index(drop=True)
+
+    def _empty_frame(self) -> pd.DataFrame:
+        """
+        No rows, with the columns of any stored file
+        """
+        any_file = next(self.dir.glob('product_id=*/date=*/part-*.parquet'), None)
+        if any_file is None:
+            return pd.DataFrame(columns=PRIMARY_KEY)
+        return pd.read_parquet(any_file).iloc[:0]
+
+
+class SqliteOnlineStore:
+    """
+    The online store, one sqlite table per feature group, keyed on (product_id, timestamp) with the other features
+    of the row as a JSON value:
+
+        {store_dir}/online.db, table {feature_group_name}_v{version}(product_id, timestamp, features)
+
+    A push upserts its rows (INSERT OR REPLACE), and lookups by product and time range go through the primary key.
+    A lookup without rows still has the columns of the stored rows (the primary key only, when nothing was stored yet).
+    """
+
+    def __init__(self, store_dir: str, feature_group_name: str, feature_group_version: int) -> None:
+        """
+        Args:
+            store_dir (str): Root directory of the local stores
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): The version of the feature group
+
+        Returns:
+            None
+        """
+        Path(store_dir).mkdir(parents=True, exist_ok=True)
+        self.path = Path(store_dir) / 'online.db'
+        self.table = f'"{feature_group_name}_v{feature_group_version}"'
+
+        # NOTE: one connection shared by the flush threads, the lock keeps their transactions apart
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            'product_id TEXT NOT NULL, timestamp INTEGER NOT NULL, features TEXT NOT NULL, '
+            'PRIMARY KEY (product_id, timestamp)) WITHOUT ROWID'
+        )
+        self._connection.commit()
+
+    def write(self, df: pd.DataFrame) -> None:
+        features = df.drop(columns=PRIMARY_KEY).to_dict('records')
+        rows = zip(df['product_id'].tolist(), df['timestamp'].tolist(), map(dumps, features))
+        with self._lock, self._connection:
+            self._connection.executemany(
+                f'INSERT OR REPLACE INTO {self.table} (product_id, timestamp, features) VALUES (?, ?, ?)', rows
+            )
+
+    def read(
+        self,
+        product_ids: Optional[List[str]] = None,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+    ) -> pd.DataFrame:
+        conditions, params = [], []
+        if product_ids is not None:
+            conditions.append(f'product_id IN ({", ".join("?" * len(product_ids))})')
+            params.extend(product_ids)
+        if start_ms is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start_ms)
+        if end_ms is not None:
+            conditions.append('timestamp < ?')
+            params.append(end_ms)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+
+        with self._lock:
+            rows = self._connection.execute(
+                f'SELECT product_id, timestamp, features FROM {self.table} {where} ORDER BY product_id, timestamp',
+                params,
+            ).fetchall()
+            if not rows:
+                any_row = self._connection.execute(f'SELECT features FROM {self.table} LIMIT 1').fetchone()
+                return pd.DataFrame(columns=PRIMARY_KEY + (list(loads(any_row[0])) if any_row else []))
+        return pd.DataFrame([
+            {'product_id': product_id, 'timestamp': timestamp, **loads(features)}
+            for product_id, timestamp, features in rows
+        ])
+
+
+class LocalFeatureGroup:
+    """
+    A feature group on local disk, with the primary key (product_id, timestamp) and event time (timestamp) of the
+    Hopsworks one. Like an online enabled Hopsworks feature group, every push goes to both stores: the online one
+    (SqliteOnlineStore) and the offline one (ParquetOfflineStore).
+
+    Has the push() of HopsworksFeatureGroupSink and a read() of either store, so the pipeline runs, and its
+    throughput can be measured, without network access, or as a fast local mirror of Hopsworks (MirroredSink).
+    """
+
+    def __init__(self, store_dir: str, feature_group_name: str, feature_group_version: int) -> None:
+        """
+        Args:
+            store_dir (str): Root directory of the local stores
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): The version of the feature group
+
+        Returns:
+            None
+        """
+        self.feature_group_name = feature_group_name
+        self.offline = ParquetOfflineStore(store_dir, feature_group_name, feature_group_version)
+        self.online = SqliteOnlineStore(store_dir, feature_group_name, feature_group_version)
+        self.last_flush_timing: Optional[dict] = None
+
+    def push(self, data: Union[List[dict], pd.DataFrame], online_or_offline: str) -> dict:
+        """
+        Writes the data into both stores
+
+        Args:
+            data (Union[List[dict], pd.DataFrame]) : The ohlc candle sticks
+            online_or_offline (str) : Kept for the interface of HopsworksFeatureGroupSink, the rows go to both stores
+
+        Returns:
+            dict: Timing of the flush, {'rows', 'connect_sec', 'convert_sec', 'insert_sec', 'total_sec'}
+        """
+        started_at = time.perf_counter()
+        df = to_feature_frame(data)
+        convert_sec = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        self.online.write(df)
+        self.offline.write(df)
+        insert_sec = time.perf_counter() - started_at
+
+        self.last_flush_timing = {
+            'rows': len(df),
+            'connect_sec': 0.0,
+            'convert_sec': convert_sec,
+            'insert_sec': insert_sec,
+            'total_sec': convert_sec + insert_sec,
+        }
+        logger.info(
+            f'Pushed {len(df)} rows to the local {self.feature_group_name}: convert {convert_sec * 1000:.0f} ms, '
+            f'insert {insert_sec * 1000:.0f} ms'
+        )
+        return self.last_flush_timing
+
+    def read(
+        self,
+        product_ids: Optional[List[str]] = None,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+        online: Optional[bool] = False,
+    ) -> pd.DataFrame:
+        """
+        Args:
+            product_ids (List[str]): The products to read, all of them by default
+            start_ms (int): Start of the event time range, included
+            end_ms (int): End of the event time range, excluded
+            online (bool): Read from the online store rather than the offline one
+
+        Returns:
+            pd.DataFrame: One row per (product_id, timestamp), sorted by product and time
+        """
+        store = self.online if online else self.offline
+        return store.read(product_ids=product_ids, start_ms=start_ms, end_ms=end_ms)
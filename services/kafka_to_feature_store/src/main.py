@@ -1,11 +1,16 @@
+from typing import Optional
+
 from quixstreams import Application
+from quixstreams.utils.json import loads
 from loguru import logger 
-import json
-import pandas as pd
-import hopsworks
+from confluent_kafka import TopicPartition
 
 # import hopsworks_features
-from hopsworks_features import push_data_to_feature_store
+# NOTE: hopsworks is only imported by get_feature_group_sink when the backend needs it, the local one runs without it
+from sinks import get_feature_group_sink
+from background_flush import BackgroundFlusher
+from candle_columns import CandleColumns
+from spill_journal import SpillJournal
 from config import config_kafka_to_hops
 
 
@@ -22,8 +27,32 @@ def get_current_utc_sec() -> int:
     from datetime import datetime, timezone
     return int(datetime.now(timezone.utc).timestamp())
 
+def keep_candle(candle: dict, ohlc_window_seconds: Optional[int]) -> bool:
+    """
+    Whether a candle goes to the feature group. Multi-resolution topics (trade_to_ohlc roll-ups) tag every candle with
+    a window_seconds field, and a feature group keyed on (product_id, timestamp) can only hold one resolution: a 1m
+    and a 5m candle closing at the same time would overwrite each other. The field is dropped either way, so it never
+    becomes a column of the feature group.
+
+    Args:
+        candle (dict): The decoded candle, updated in place
+        ohlc_window_seconds (int): The resolution written to the feature group
+
+    Returns:
+        bool: False for the candles of the other resolutions
+    """
+    if 'window_seconds' not in candle:
+        return True
+    window_seconds = candle.pop('window_seconds')
+    if ohlc_window_seconds is None:
+        raise ValueError(
+            f'The topic carries several candle resolutions ({window_seconds}s and others), set OHLC_WINDOW_SECONDS to '
+            'the one written to this feature group'
+        )
+    return window_seconds == ohlc_window_seconds
+
+
 #%% Function that uses the hopsworks_features function above-This needs to be out back into src.hopsworks_features, but testing it here to ensure it runs as I keep getting import errors
-from typing import Optional
 def kafka_to_feature_store(
         kafka_topic: str,
         kafka_broker_address: str,
@@ -33,6 +62,15 @@ def kafka_to_feature_store(
         live_or_historical: Optional[str]='live', 
         save_every_n_sec: Optional[int] = 600,
         create_new_consumer_group: Optional[bool]=False,
+        ohlc_window_seconds: Optional[int]=60,
+        max_in_flight_flushes: Optional[int]=1,
+        flush_max_retries: Optional[int]=5,
+        flush_retry_backoff_sec: Optional[float]=1,
+        spill_dir: Optional[str]='state/spill',
+        replay_interval_sec: Optional[float]=30,
+        consume_batch_size: Optional[int]=10_000,
+        feature_store_backend: Optional[str]='hopsworks',
+        local_store_dir: Optional[str]='state/local_feature_store',
 
 
 ) -> None:
@@ -50,6 +88,15 @@ def kafka_to_feature_store(
     live_or_historical (str): Whether we are saving live data to the Feature or historical data.Livde data goes to the online feature store, whilst historical data goes to the offline feature store
     save_every_n_sec (int): In the event where data streaming is rate limited, this defines the maximum number of seconds to wait before writing the data to the feature store. Additional conditional check along with buffer_size
     create_new_consumer_group (bool): bool for creating a fresh consumer group 
+    ohlc_window_seconds (int): When trade_to_ohlc rolls up several resolutions into the topic, the only one written to this feature group. Required then
+    max_in_flight_flushes (int): Number of buffers inserted in the background at the same time, the partitions are paused when they are all busy
+    flush_max_retries (int): Retries of a failed insert, with an exponential backoff, before the buffer is spilled to disk
+    flush_retry_backoff_sec (float): Wait before the first retry of a failed insert
+    spill_dir (str): Directory of the journal of the buffers that could not be inserted, replayed once the feature store is back
+    replay_interval_sec (float): Seconds between two attempts to replay the spill journal
+    consume_batch_size (int): Maximum number of messages read from Kafka at once
+    feature_store_backend (str): Where the features are written: 'hopsworks', 'local' (parquet offline store + sqlite online store, no network needed) or 'hopsworks+local' (Hopsworks with a local mirror)
+    local_store_dir (str): Root directory of the local stores
 
     Return:
     None
@@ -59,6 +106,8 @@ def kafka_to_feature_store(
     # Below is the logic instatiate a new consumer group, which is useful when the ingestion jobs fail and hence, the transfer to hopsworks from the topic has not been fully succesfull.
     # If ingestions jobs fail, the consumer group might 'see' all the data from the topic, but not be able to pass it to hopsworks
     # So, in this case, need to generate a new kafka consumer group, that takes all the data held in the topics, and writes from the earliest possible trade into hopsworks
+    # NOTE: offsets are now only committed once a buffer is inserted or spilled to disk (see BackgroundFlusher), so a failed ingestion resumes on its own.
+    # A new consumer group is only needed to write the whole topic again, e.g. into a new feature group version
 
     # New consumer group generation logic
     if create_new_consumer_group:
@@ -81,70 +130,130 @@ def kafka_to_feature_store(
     last_saved_to_feature_store_ts = get_current_utc_sec()
     
     
-    buffer = []
+    # NOTE: the candles are decoded straight into typed columns preallocated for a full buffer, no dict per candle is kept
+    buffer = CandleColumns(buffer_size + consume_batch_size)
+
+    # One sink for the life of the service: the Hopsworks one logs in on the first flush and keeps the feature group handle
+    sink = get_feature_group_sink(
+        backend=feature_store_backend,
+        feature_group_name=feature_group_name,
+        feature_group_version=feature_store_version,
+        local_store_dir=local_store_dir,
+    )
 
-    
+    # NOTE: double buffering, full buffers are inserted in the background while polling goes on into a new one.
+    # The ones that cannot be inserted are spilled to a journal on disk and replayed later
+    flusher = BackgroundFlusher(
+        sink=sink,
+        online_or_offline='online' if live_or_historical == 'live' else 'offline',
+        journal=SpillJournal(spill_dir, feature_group_name, feature_store_version),
+        max_in_flight_flushes=max_in_flight_flushes,
+        max_retries=flush_max_retries,
+        retry_backoff_sec=flush_retry_backoff_sec,
+        replay_interval_sec=replay_interval_sec,
+    )
+
+    # The offset after the last message of the buffer, for every partition
+    buffer_offsets = {}
+    # Whether the partitions are paused, while every flush slot is busy and a buffer waits for one
+    paused = False
+
+    def commit(consumer) -> None:
+        # Only the offsets of the buffers inserted or spilled, so a crash never skips candles that are not stored yet
+        offsets = flusher.committable_offsets()
+        if not offsets:
+            return
+        try:
+            consumer.commit(
+                offsets=[TopicPartition(topic_name, partition, offset) for (topic_name, partition), offset in offsets.items()],
+                asynchronous=False,
+            )
+        except Exception as e:
+            # NOTE: the next commit covers these offsets too. Failing that, the candles are written again after a restart
+            logger.error(f'Failed to commit offsets {offsets}: {e}')
+
+    def submit_buffer() -> bool:
+        # Hand the buffer over to the background flush and start a new one. False when every flush slot is busy,
+        # the buffer is then kept (and still filled) until one frees up
+        nonlocal buffer, buffer_offsets, last_saved_to_feature_store_ts
+        if len(buffer) > 0 or len(buffer_offsets) > 0:
+            if not flusher.submit(buffer.to_dataframe(), buffer_offsets):
+                return False
+            buffer = CandleColumns(buffer_size + consume_batch_size)
+            buffer_offsets = {}
+        last_saved_to_feature_store_ts = get_current_utc_sec()
+        return True
+
+    def on_revoke(consumer, partitions) -> None:
+        # Flush and commit what was read from the partitions before they move to another consumer.
+        # NOTE: nothing blocks here, the rebalance must not stall on the feature store. The flushes still in flight
+        # are committed once stored, and whatever the new owner reads again is upserted on the same keys
+        submit_buffer()
+        commit(consumer)
 
     # Write data as a consumer using a polling loop
-    with app.get_consumer() as consumer:
-        consumer.subscribe(topics=[kafka_topic]) # topics are expected in list format so put kafka_topic argumet insdie []
-
-        while True:
-            msg = consumer.poll(1)
-            sec_since_last_saved = ( get_current_utc_sec() - last_saved_to_feature_store_ts)
-
-            # cheeky bug check to see if there is any error
-            if (msg is not None) and msg.error():
-                logger.error('Kafka error', msg.error())
-                continue
-
-            # If there is no error streaming in, but the websocket api is rate limited, but the time since the last message has arrived still hasn't exceeded the customisable save_every_n_sec window....then perhaps no cause for concern and wait it out with a debugger msg
-            elif (msg is None) and (sec_since_last_saved < save_every_n_sec):
-                logger.debug('No new messages streaming in from the input topic of ohlc')
-                logger.debug(f'Latest instance of saving to feature store was as {sec_since_last_saved} seconds ago (limit={save_every_n_sec})')
-                continue
-            
-            # If there isn't an error, and we're streaming messages within the alloted so called buffering time window, then obs write the incoming data in batches
-            else:
-                # below creates the candle sticks objects that is serialised in nature, and is written into a buffer/batch
-                if msg is not None:
-                    ohlc_candle_sticks = json.loads(msg.value().decode('utf-8'))
-                    
-                    # NOTE: Debug and check types as hopsworks is throwing a fit 
-                    # breakpoint()
-
-                    buffer.append(ohlc_candle_sticks)
-                    logger.debug(f'Message {ohlc_candle_sticks} added to buffer. Buffer size={len(buffer)}')
-                # Once the serialised ohlc data, which is appended into the buffer exceeds the buffer size or the customisable time window for no error + no messages as per save_every_n_sec, then push to feature store
-                if (len(buffer) >= buffer_size) or (sec_since_last_saved >= save_every_n_sec):
-                    if len(buffer) > 0:
-                        
-                        try:
-                        
-                            push_data_to_feature_store(
-                                
-                                # logic for writing into offline or online
-                                online_or_offline='online' if live_or_historical == 'live' else 'offline',
-                                
-                                
-                                feature_group_name=feature_group_name,
-                                feature_group_version=feature_store_version,
-                                data=buffer,
-                                
-                            )
-                            
-                            logger.debug('Data pushed to the feature store')
-                        
-                        except Exception as e:
-                            
-                            logger.error(f'Failed to push data to the feature store: {e}')
-                            continue
-
-                        # Clear buffer after writing to feature store
-                        buffer = []
-                        last_saved_to_feature_store_ts = get_current_utc_sec()
-
-            
+    # NOTE: no auto commit, offsets are committed after their candles are stored
+    with app.get_consumer(auto_commit_enable=False) as consumer:
+        consumer.subscribe(topics=[kafka_topic], on_revoke=on_revoke) # topics are expected in list format so put kafka_topic argumet insdie []
+
+        try:
+            while True:
+                # Bulk read, up to consume_batch_size messages or whatever came within a second
+                messages = consumer.consume(num_messages=consume_batch_size, timeout=1)
+                sec_since_last_saved = ( get_current_utc_sec() - last_saved_to_feature_store_ts)
+                flusher.raise_if_failed()
+                commit(consumer)
+
+                # If there is no error streaming in, but the websocket api is rate limited, but the time since the last message has arrived still hasn't exceeded the customisable save_every_n_sec window....then perhaps no cause for concern and wait it out with a debugger msg
+                if (not messages) and (sec_since_last_saved < save_every_n_sec) and not paused:
+                    logger.debug('No new messages streaming in from the input topic of ohlc')
+                    logger.debug(f'Latest instance of saving to feature store was as {sec_since_last_saved} seconds ago (limit={save_every_n_sec})')
+                    continue
+
+                # below decodes the serialised candle sticks (orjson), and writes the whole batch into the columns of the buffer
+                candles = []
+                for msg in messages:
+                    # cheeky bug check to see if there is any error
+                    if msg.error():
+                        logger.error(f'Kafka error {msg.error()}')
+                        continue
+
+                    buffer_offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+                    ohlc_candle_sticks = loads(msg.value())
+
+                    # NOTE: a feature group holds a single resolution of the multi-resolution topics, see keep_candle()
+                    if not keep_candle(ohlc_candle_sticks, ohlc_window_seconds):
+                        continue
+
+                    candles.append(ohlc_candle_sticks)
+                buffer.extend(candles)
+                logger.debug(f'{len(messages)} messages read. Buffer size={len(buffer)}')
+
+                # Once the buffer is full (it can go over buffer_size by one consume batch, whose offsets are submitted together),
+                # or the customisable time window is over, e.g. when messages are rate limited, push to feature store
+                if paused or (len(buffer) >= buffer_size) or (sec_since_last_saved >= save_every_n_sec):
+                    if submit_buffer():
+                        if paused:
+                            consumer.resume(consumer.assignment())
+                            paused = False
+                            logger.info('A flush slot is free again, resumed the partitions')
+                    else:
+                        # NOTE: backpressure without blocking the loop: no more messages are fetched, but polling goes on so
+                        # the consumer stays in the group (max.poll.interval.ms) and serves the rebalances. Paused every time,
+                        # for the partitions assigned meanwhile
+                        consumer.pause(consumer.assignment())
+                        if not paused:
+                            logger.warning(f'{max_in_flight_flushes} flushes in flight, pausing the partitions until one is done')
+                        paused = True
+
+        finally:
+            # Stored or spilled, the remaining candles are committed before exiting
+            if not flusher.failed:
+                flusher.wait()
+                submit_buffer()
+            flusher.close()
+            commit(consumer)
+
 
 if __name__== '__main__':
     
@@ -162,6 +271,15 @@ if __name__== '__main__':
         buffer_size= config_kafka_to_hops.buffer_size,
         save_every_n_sec= config_kafka_to_hops.save_every_n_sec,
         create_new_consumer_group= config_kafka_to_hops.create_new_consumer_group,
+        ohlc_window_seconds= config_kafka_to_hops.ohlc_window_seconds,
+        max_in_flight_flushes= config_kafka_to_hops.max_in_flight_flushes,
+        flush_max_retries= config_kafka_to_hops.flush_max_retries,
+        flush_retry_backoff_sec= config_kafka_to_hops.flush_retry_backoff_sec,
+        spill_dir= config_kafka_to_hops.spill_dir,
+        replay_interval_sec= config_kafka_to_hops.replay_interval_sec,
+        consume_batch_size= config_kafka_to_hops.consume_batch_size,
+        feature_store_backend= config_kafka_to_hops.feature_store_backend,
+        local_store_dir= config_kafka_to_hops.local_store_dir,
     )
     
     except KeyboardInterrupt:
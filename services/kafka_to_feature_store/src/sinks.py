@@ -0,0 +1,122 @@
+# The interface of the feature group writers/readers, and the choice of the backend from the config
+import time
+from typing import List, Optional, Protocol, Union
+
+import pandas as pd
+from loguru import logger
+
+
+class FeatureGroupSink(Protocol):
+    """
+    Anything with the push() interface of HopsworksFeatureGroupSink. Rows are keyed on (product_id, timestamp): a
+    row pushed again with the same key replaces the previous one
+    """
+    def push(self, data: Union[List[dict], pd.DataFrame], online_or_offline: str) -> dict: ...
+
+
+class FeatureGroupSource(Protocol):
+    """
+    Anything with the read() interface of HopsworksFeatureGroupSink: the rows whose event time (timestamp, Unix
+    milliseconds) is within [start_ms, end_ms), one per (product_id, timestamp), sorted by product and time
+    """
+    def read(
+        self,
+        product_ids: Optional[List[str]] = None,
+        start_ms: Optional[int] = None,
+        end_ms: Optional[int] = None,
+        online: Optional[bool] = False,
+    ) -> pd.DataFrame: ...
+
+
+def to_feature_frame(data: Union[List[dict], pd.DataFrame]) -> pd.DataFrame:
+    """
+    The rows as a dataframe in the types of the feature group, without copying the columns that already are
+
+    Args:
+        data (Union[List[dict], pd.DataFrame]): The ohlc candle sticks, as a List of dicts or already as a dataframe (CandleColumns.to_dataframe())
+
+    Returns:
+        pd.DataFrame: The rows
+    """
+    if not isinstance(data, pd.DataFrame):
+        return pd.DataFrame(data)
+
+    # NOTE: product_id is a string feature in the feature group, the categorical columns of the buffer go back to strings
+    categorical = [column for column, dtype in data.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return data
+    return pd.DataFrame(
+        {column: data[column].astype(str) if column in categorical else data[column] for column in data},
+        copy=False,
+    )
+
+
+class MirroredSink:
+    """
+    Writes to a primary feature group and keeps a mirror of it, e.g. Hopsworks and a LocalFeatureGroup next to it.
+    The mirror is best effort: a failed write to it is logged, and the push only fails when the primary does
+    """
+
+    def __init__(self, primary: FeatureGroupSink, mirror: FeatureGroupSink) -> None:
+        self.primary = primary
+        self.mirror = mirror
+
+    def push(self, data: Union[List[dict], pd.DataFrame], online_or_offline: str) -> dict:
+        timing = self.primary.push(data=data, online_or_offline=online_or_offline)
+
+        started_at = time.perf_counter()
+        try:
+            self.mirror.push(data=data, online_or_offline=online_or_offline)
+        except Exception as e:
+            logger.error(f'Failed to write {len(data)} rows to the mirror: {e}')
+        return {**timing, 'mirror_sec': time.perf_counter() - started_at}
+
+    def read(self, *args, **kwargs) -> pd.DataFrame:
+        return self.primary.read(*args, **kwargs)
+
+
+def get_feature_group_sink(
+    backend: str,
+    feature_group_name: str,
+    feature_group_version: int,
+    local_store_dir: Optional[str] = 'state/local_feature_store',
+    hopsworks_project_name: Optional[str] = None,
+    hopsworks_api_key: Optional[str] = None,
+) -> FeatureGroupSink:
+    """
+    Args:
+        backend (str): 'hopsworks', 'local' (partitioned parquet + sqlite, no network needed) or 'hopsworks+local'
+            (Hopsworks with a local mirror)
+        feature_group_name (str): Name of the feature group
+        feature_group_version (int): The version of the feature group
+        local_store_dir (str): Root directory of the local stores
+        hopsworks_project_name (str): Hopsworks project, HOPSWORKS_PROJECT_NAME from the config by default
+        hopsworks_api_key (str): Hopsworks API key, HOPSWORKS_API_KEY from the config by default
+
+    Returns:
+        FeatureGroupSink: The sink, also a FeatureGroupSource
+    """
+    # NOTE: imported here so the local backend runs where hopsworks is not installed
+    if backend in ('hopsworks', 'hopsworks+local'):
+        from hopsworks_features import HopsworksFeatureGroupSink
+        hopsworks_sink = HopsworksFeatureGroupSink(
+            feature_group_name=feature_group_name,
+            feature_group_version=feature_group_version,
+            project_name=hopsworks_project_name,
+            api_key=hopsworks_api_key,
+        )
+    if backend in ('local', 'hopsworks+local'):
+        from local_stores import LocalFeatureGroup
+        local_sink = LocalFeatureGroup(
+            store_dir=local_store_dir,
+            feature_group_name=feature_group_name,
+            feature_group_version=feature_group_version,
+        )
+
+    if backend == 'hopsworks':
+        return hopsworks_sink
+    if backend == 'local':
+        return local_sink
+    if backend == 'hopsworks+local':
+        return MirroredSink(primary=hopsworks_sink, mirror=local_sink)
+    raise ValueError(f'Invalid value for feature_store_backend: {backend}')
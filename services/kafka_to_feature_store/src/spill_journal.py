@@ -0,0 +1,66 @@
+# On-disk journal of the batches that could not be written to the feature store, replayed once it is back
+import os
+import time
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+from loguru import logger
+
+
+class SpillJournal:
+    """
+    One file per spilled batch, named after the time it was spilled so they are replayed oldest first:
+
+        {spill_dir}/{feature_group_name}_v{version}/batch-{spilled_at_ns}.parquet
+
+    The batches are written as parquet, which keeps the column types of the buffer. A file is written to a
+    temporary name, fsynced and renamed, so it is either complete or not there. The Kafka offsets of a batch are
+    committed once its file exists: from then on the journal, not the topic, is where the batch is kept, and it
+    survives restarts.
+    """
+
+    def __init__(self, spill_dir: str, feature_group_name: str, feature_group_version: int) -> None:
+        """
+        Args:
+            spill_dir (str): Root directory of the journals
+            feature_group_name (str): Name of the feature group the batches are for
+            feature_group_version (int): The version of the feature group
+
+        Returns:
+            None
+        """
+        self.dir = Path(spill_dir) / f'{feature_group_name}_v{feature_group_version}'
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def append(self, data: pd.DataFrame) -> Path:
+        path = self.dir / f'batch-{time.time_ns()}.parquet'
+        tmp_path = path.with_suffix('.parquet.tmp')
+        with open(tmp_path, 'wb') as f:
+            data.to_parquet(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+    def pending(self) -> List[Path]:
+        """
+        Returns:
+            List[Path]: The spilled batches, oldest first
+        """
+        return sorted(self.dir.glob('batch-*.parquet'))
+
+    def load(self, path: Path) -> pd.DataFrame:
+        return pd.read_parquet(path)
+
+    def remove(self, path: Path) -> None:
+        path.unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        return len(self.pending())
+
+    def log_status(self) -> None:
+        pending = self.pending()
+        if pending:
+            size_mb = sum(path.stat().st_size for path in pending) / 1e6
+            logger.info(f'{len(pending)} batches ({size_mb:.1f} MB) in the spill journal {self.dir}')
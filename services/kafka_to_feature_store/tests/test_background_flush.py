@@ -0,0 +1,140 @@
+import threading
+import time
+from typing import List
+
+import pandas as pd
+import pytest
+
+from background_flush import BackgroundFlusher
+from spill_journal import SpillJournal
+
+TOPIC = 'ohlc'
+
+
+class FakeSink:
+    """ Records the pushed frames. Every push waits for its gate when one is given, and fails while `down` is set """
+
+    def __init__(self) -> None:
+        self.pushed: List[pd.DataFrame] = []
+        self.gates: List[threading.Event] = []
+        self.down = False
+        self.n_pushes = 0
+
+    def push(self, data: pd.DataFrame, online_or_offline: str) -> dict:
+        self.n_pushes += 1
+        if self.gates:
+            self.gates.pop(0).wait(timeout=10)
+        if self.down:
+            raise ConnectionError('feature store unavailable')
+        self.pushed.append(data)
+        return {'rows': len(data), 'total_sec': 0.0}
+
+
+def buffer(close: float) -> pd.DataFrame:
+    return pd.DataFrame({'product_id': ['BTC/USD'], 'timestamp': [1_717_632_060_000], 'close': [close]})
+
+
+@pytest.fixture
+def sink() -> FakeSink:
+    return FakeSink()
+
+
+def make_flusher(sink: FakeSink, tmp_path, **kwargs) -> BackgroundFlusher:
+    journal = SpillJournal(str(tmp_path), 'ohlc_feature_group', 1)
+    return BackgroundFlusher(sink, 'online', journal, **kwargs)
+
+
+def test_offsets_are_committable_in_submission_order(sink, tmp_path):
+    first_gate, second_gate = threading.Event(), threading.Event()
+    sink.gates = [first_gate, second_gate]
+    flusher = make_flusher(sink, tmp_path, max_in_flight_flushes=2)
+
+    assert flusher.submit(buffer(10.0), {(TOPIC, 0): 100})
+    assert flusher.submit(buffer(11.0), {(TOPIC, 0): 200, (TOPIC, 1): 50})
+
+    # The second insert is done first, its offsets wait for the first one
+    second_gate.set()
+    while flusher.in_flight > 1:
+        time.sleep(0.01)
+    assert flusher.committable_offsets() == {}
+
+    first_gate.set()
+    flusher.wait()
+    assert flusher.committable_offsets() == {(TOPIC, 0): 200, (TOPIC, 1): 50}
+    # Handed out once
+    assert flusher.committable_offsets() == {}
+    flusher.close()
+
+
+def test_submit_turns_the_buffer_down_when_every_slot_is_busy(sink, tmp_path):
+    gate = threading.Event()
+    sink.gates = [gate]
+    flusher = make_flusher(sink, tmp_path, max_in_flight_flushes=1)
+
+    assert flusher.submit(buffer(10.0), {(TOPIC, 0): 100})
+    assert not flusher.submit(buffer(11.0), {(TOPIC, 0): 200})
+
+    gate.set()
+    flusher.wait()
+    assert flusher.submit(buffer(11.0), {(TOPIC, 0): 200})
+    flusher.wait()
+    assert flusher.committable_offsets() == {(TOPIC, 0): 200}
+    assert [df['close'].tolist() for df in sink.pushed] == [[10.0], [11.0]]
+    flusher.close()
+
+
+def test_empty_buffer_only_carries_its_offsets(sink, tmp_path):
+    flusher = make_flusher(sink, tmp_path)
+
+    assert flusher.submit(buffer(10.0).iloc[:0], {(TOPIC, 0): 100})
+    flusher.wait()
+
+    assert flusher.committable_offsets() == {(TOPIC, 0): 100}
+    assert sink.n_pushes == 0
+    flusher.close()
+
+
+def test_failed_insert_is_spilled_and_its_offsets_committed(sink, tmp_path):
+    sink.down = True
+    flusher = make_flusher(sink, tmp_path, max_retries=2, retry_backoff_sec=0, replay_interval_sec=60)
+
+    flusher.submit(buffer(10.0), {(TOPIC, 0): 100})
+    flusher.wait()
+
+    assert sink.n_pushes == 3
+    assert len(flusher.journal) == 1
+    assert flusher.committable_offsets() == {(TOPIC, 0): 100}
+
+    # The journal is not empty, the feature store is down: spilled without the retries
+    flusher.submit(buffer(11.0), {(TOPIC, 0): 200})
+    flusher.wait()
+    assert sink.n_pushes == 3
+    assert len(flusher.journal) == 2
+    assert flusher.n_spilled == 2
+    flusher.close()
+
+
+def test_spilled_batches_are_replayed_oldest_first(sink, tmp_path):
+    journal = SpillJournal(str(tmp_path), 'ohlc_feature_group', 1)
+    # Spilled before a restart
+    journal.append(buffer(10.0))
+    journal.append(buffer(11.0))
+
+    flusher = BackgroundFlusher(sink, 'online', journal, replay_interval_sec=0.01)
+    deadline = time.monotonic() + 10
+    while len(journal) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    flusher.close()
+
+    assert len(journal) == 0
+    assert flusher.n_replayed == 2
+    assert [df['close'].tolist() for df in sink.pushed] == [[10.0], [11.0]]
+
+
+def test_spilled_batch_keeps_its_column_types(tmp_path):
+    journal = SpillJournal(str(tmp_path), 'ohlc_feature_group', 1)
+    df = buffer(10.0).astype({'product_id': 'category'})
+
+    loaded = journal.load(journal.append(df))
+
+    pd.testing.assert_frame_equal(loaded, df)
@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+
+from candle_columns import CandleColumns
+from sinks import to_feature_frame
+
+
+def candle(timestamp: int, close: float, **fields) -> dict:
+    return {
+        'timestamp': timestamp,
+        'product_id': 'BTC/USD',
+        'open': close,
+        'high': close,
+        'low': close,
+        'close': close,
+        'volume': 1.5,
+        'trade_count': 3,
+        'is_forward_filled': False,
+        **fields,
+    }
+
+
+def test_column_types_from_the_first_candle():
+    buffer = CandleColumns(capacity=4)
+    buffer.append(candle(1000, 10.0))
+    df = buffer.to_dataframe()
+
+    assert df['timestamp'].dtype == np.int64
+    assert df['trade_count'].dtype == np.int64
+    assert df['close'].dtype == np.float64
+    assert df['is_forward_filled'].dtype == bool
+    assert isinstance(df['product_id'].dtype, pd.CategoricalDtype)
+
+
+def test_int_column_promoted_to_float():
+    buffer = CandleColumns(capacity=4)
+    buffer.append(candle(1000, 10.0, trade_count=3))
+    buffer.append(candle(2000, 11.0, trade_count=2.5))
+    df = buffer.to_dataframe()
+
+    assert df['trade_count'].dtype == np.float64
+    assert df['trade_count'].tolist() == [3.0, 2.5]
+
+
+def test_missing_values_promote_to_float_nan():
+    buffer = CandleColumns(capacity=4)
+    buffer.append(candle(1000, 10.0))
+    buffer.append(candle(2000, 11.0, trade_count=None))
+    no_flag = candle(3000, 12.0)
+    del no_flag['is_forward_filled']
+    buffer.append(no_flag)
+    df = buffer.to_dataframe()
+
+    assert df['trade_count'].dtype == np.float64
+    assert df['trade_count'].tolist()[0] == 3.0
+    assert np.isnan(df['trade_count'].iloc[1])
+    assert df['is_forward_filled'].dtype == np.float64
+    assert np.isnan(df['is_forward_filled'].iloc[2])
+
+
+def test_field_added_later_is_nan_on_the_earlier_candles():
+    buffer = CandleColumns(capacity=4)
+    buffer.append(candle(1000, 10.0))
+    buffer.append(candle(2000, 11.0, window_seconds=60))
+    df = buffer.to_dataframe()
+
+    assert df['window_seconds'].dtype == np.float64
+    assert np.isnan(df['window_seconds'].iloc[0])
+    assert df['window_seconds'].iloc[1] == 60
+
+
+def test_categorical_column():
+    buffer = CandleColumns(capacity=4)
+    buffer.append(candle(1000, 10.0))
+    buffer.append(candle(1000, 20.0, product_id='ETH/USD'))
+    no_product = candle(2000, 11.0)
+    del no_product['product_id']
+    buffer.append(no_product)
+    df = buffer.to_dataframe()
+
+    assert df['product_id'].tolist()[:2] == ['BTC/USD', 'ETH/USD']
+    assert pd.isna(df['product_id'].iloc[2])
+
+    # Strings again for the feature group
+    product_ids = to_feature_frame(df)['product_id']
+    assert not isinstance(product_ids.dtype, pd.CategoricalDtype)
+    assert product_ids.tolist()[:2] == ['BTC/USD', 'ETH/USD']
+
+
+def test_extend_matches_append_and_grows_past_capacity():
+    candles = [candle(1000 * i, 10.0 + i, product_id=('BTC/USD', 'ETH/USD')[i % 2]) for i in range(10)]
+    candles[7]['trade_count'] = 1.5 # a type change within a batch
+
+    appended = CandleColumns(capacity=2)
+    for c in candles:
+        appended.append(c)
+    extended = CandleColumns(capacity=2)
+    extended.extend(candles[:5])
+    extended.extend(candles[5:])
+
+    assert len(extended) == 10
+    pd.testing.assert_frame_equal(extended.to_dataframe(), appended.to_dataframe())
+    assert extended.to_dataframe()['trade_count'].dtype == np.float64
+
+
+def test_extend_with_missing_values_falls_back_to_append():
+    buffer = CandleColumns(capacity=8)
+    buffer.extend([candle(1000, 10.0), candle(2000, 11.0)])
+    buffer.extend([candle(3000, 12.0, volume=None), candle(4000, 13.0)])
+    df = buffer.to_dataframe()
+
+    assert len(df) == 4
+    assert df['volume'].isna().tolist() == [False, False, True, False]
+    assert df['timestamp'].tolist() == [1000, 2000, 3000, 4000]
@@ -0,0 +1,92 @@
+import pandas as pd
+import pytest
+
+from candle_columns import CandleColumns
+from local_stores import LocalFeatureGroup
+
+DAY_0 = 1_717_632_000_000 # 2024-06-06 00:00:00 UTC
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def candles(close: float, timestamps, product_id: str = 'BTC/USD') -> list:
+    return [
+        {'product_id': product_id, 'timestamp': timestamp, 'open': close, 'high': close, 'low': close,
+         'close': close, 'volume': 1.0}
+        for timestamp in timestamps
+    ]
+
+
+@pytest.fixture
+def feature_group(tmp_path) -> LocalFeatureGroup:
+    return LocalFeatureGroup(str(tmp_path), 'ohlc_feature_group', 1)
+
+
+@pytest.mark.parametrize('online', [False, True])
+def test_push_again_replaces_the_rows_of_the_same_key(feature_group, online):
+    feature_group.push(candles(10.0, [DAY_0 + 60_000, DAY_0 + 120_000]), online_or_offline='online')
+    # Overlaps the first push on DAY_0 + 120_000
+    feature_group.push(candles(20.0, [DAY_0 + 120_000, DAY_0 + 180_000]), online_or_offline='online')
+
+    df = feature_group.read(online=online)
+
+    assert df['timestamp'].tolist() == [DAY_0 + 60_000, DAY_0 + 120_000, DAY_0 + 180_000]
+    assert df['close'].tolist() == [10.0, 20.0, 20.0]
+
+
+@pytest.mark.parametrize('online', [False, True])
+def test_read_filters_products_and_time_range(feature_group, online):
+    feature_group.push(
+        candles(10.0, [DAY_0, DAY_0 + DAY_MS, DAY_0 + 2 * DAY_MS]) + candles(1.0, [DAY_0 + DAY_MS], 'ETH/USD'),
+        online_or_offline='offline',
+    )
+
+    df = feature_group.read(product_ids=['BTC/USD'], start_ms=DAY_0 + 1, end_ms=DAY_0 + 2 * DAY_MS, online=online)
+
+    assert df['product_id'].tolist() == ['BTC/USD']
+    assert df['timestamp'].tolist() == [DAY_0 + DAY_MS]
+
+    # [start_ms, end_ms): the end is excluded
+    df = feature_group.read(start_ms=DAY_0 + DAY_MS, end_ms=DAY_0 + DAY_MS + 1, online=online)
+    assert df['product_id'].tolist() == ['BTC/USD', 'ETH/USD']
+
+
+def test_offline_store_is_partitioned_by_product_and_day(feature_group):
+    feature_group.push(candles(10.0, [DAY_0, DAY_0 + DAY_MS]), online_or_offline='offline')
+
+    partitions = sorted(path.parent.relative_to(feature_group.offline.dir).as_posix() for path in feature_group.offline.dir.rglob('*.parquet'))
+    assert partitions == ['product_id=BTC%2FUSD/date=2024-06-06', 'product_id=BTC%2FUSD/date=2024-06-07']
+
+
+def test_push_a_candle_columns_buffer(feature_group):
+    buffer = CandleColumns(capacity=4)
+    buffer.extend(candles(10.0, [DAY_0 + 60_000]) + candles(1.0, [DAY_0 + 60_000], 'ETH/USD'))
+
+    timing = feature_group.push(buffer.to_dataframe(), online_or_offline='online')
+
+    assert timing['rows'] == 2
+    offline = feature_group.read()
+    online = feature_group.read(online=True)
+    assert offline['product_id'].tolist() == online['product_id'].tolist() == ['BTC/USD', 'ETH/USD']
+    pd.testing.assert_frame_equal(offline, online, check_dtype=False)
+
+
+def test_reopened_store_keeps_the_rows(tmp_path):
+    LocalFeatureGroup(str(tmp_path), 'ohlc_feature_group', 1).push(candles(10.0, [DAY_0]), online_or_offline='online')
+
+    reopened = LocalFeatureGroup(str(tmp_path), 'ohlc_feature_group', 1)
+
+    assert len(reopened.read()) == len(reopened.read(online=True)) == 1
+    # Another version is another feature group
+    assert len(LocalFeatureGroup(str(tmp_path), 'ohlc_feature_group', 2).read(online=True)) == 0
+
+
+@pytest.mark.parametrize('online', [False, True])
+def test_read_without_rows_keeps_the_columns(feature_group, online):
+    # Nothing stored yet: the primary key only
+    assert list(feature_group.read(online=online).columns) == ['product_id', 'timestamp']
+
+    feature_group.push(candles(10.0, [DAY_0]), online_or_offline='online')
+    df = feature_group.read(product_ids=['ETH/USD'], online=online)
+
+    assert len(df) == 0
+    assert list(df.columns) == ['product_id', 'timestamp', 'open', 'high', 'low', 'close', 'volume']
@@ -0,0 +1,27 @@
+import pytest
+
+from main import keep_candle
+
+
+def candle(**fields) -> dict:
+    return {'product_id': 'BTC/USD', 'timestamp': 1_717_632_300_000, 'close': 10.0, **fields}
+
+
+def test_single_resolution_candles_are_kept():
+    c = candle()
+    assert keep_candle(c, 60)
+    assert c == candle()
+
+
+def test_only_the_configured_resolution_is_kept():
+    base, rolled_up = candle(window_seconds=60), candle(window_seconds=300)
+
+    assert keep_candle(base, 60)
+    assert not keep_candle(rolled_up, 60)
+    # The field never reaches the feature group schema
+    assert 'window_seconds' not in base
+
+
+def test_multi_resolution_topic_requires_a_resolution():
+    with pytest.raises(ValueError):
+        keep_candle(candle(window_seconds=60), None)
@@ -0,0 +1,6 @@
+# these are the environment variables that are used in the
+# ohlc_to_features service when running with live data
+export KAFKA_INPUT_TOPIC_NAME=ohlc
+export KAFKA_OUTPUT_TOPIC_NAME=ohlc_features
+export KAFKA_CONSUMER_GROUP=ohlc_to_features_consumer_group
+export OHLC_WINDOW_SECONDS=60
@@ -0,0 +1,87 @@
+# Feature rows from the closed candles of trade_to_ohlc, one per candle, with the indicator state kept per product
+from typing import List, Optional
+
+from loguru import logger
+
+from indicators import StreamingIndicators
+
+# The candle fields that are zero when a window had no trades
+FLOW_FIELDS = ['volume', 'notional', 'buy_volume', 'sell_volume']
+
+
+class CandlesToFeatures:
+    """
+    Turns the candles of a product into feature rows, as they come in. Made to be used as
+    `sdf.apply(candles_to_features.update, stateful=True, expand=True)`: the state of the indicators lives in the Quix
+    State of the message key (the product), so it survives restarts and partitions moving between workers.
+
+    Every resolution of the candle topic (the `window_seconds` field of the roll-ups) has its own indicators.
+    """
+
+    def __init__(
+        self,
+        indicators: StreamingIndicators,
+        ohlc_window_seconds: int,
+        fill_missing_candles: Optional[bool] = True,
+    ) -> None:
+        """
+        Args:
+            indicators (StreamingIndicators): The indicators, with the parameters of the FeatureEngineeringPipeline
+            ohlc_window_seconds (int): Window size of the candles without a `window_seconds` field
+            fill_missing_candles (bool): Forward fill the windows without a candle, like the predictor does before
+                running talib, so the indicators see the same series. The filled rows have is_forward_filled=True
+
+        Returns:
+            None
+        """
+        self.indicators = indicators
+        self.ohlc_window_seconds = ohlc_window_seconds
+        self.fill_missing_candles = fill_missing_candles
+
+    def update(self, candle: dict, state) -> List[dict]:
+        """
+        Folds a closed candle into the indicators of its product and returns its feature row, preceded by the rows
+        of the forward-filled candles missing before it.
+
+        Args:
+            candle (dict): A closed candle, with its window end as timestamp
+            state: The Quix State of the product
+
+        Returns:
+            List[dict]: The candles with their features
+        """
+        window_seconds = candle.get('window_seconds', self.ohlc_window_seconds)
+        key = f'indicators_{window_seconds}'
+        product_state = state.get(key, None)
+        if product_state is None:
+            product_state = {'timestamp': None, 'close': None, 'indicators': self.indicators.init_state()}
+
+        # NOTE: trade_to_ohlc delivers at least once, a candle can come again after a restart or a rebalance
+        last_timestamp = product_state['timestamp']
+        if last_timestamp is not None and candle['timestamp'] <= last_timestamp:
+            logger.debug(f"Skipping candle {candle['product_id']} {candle['timestamp']}, already processed")
+            return []
+
+        rows = []
+        if self.fill_missing_candles and last_timestamp is not None:
+            window_ms = window_seconds * 1000
+            close = product_state['close']
+            for timestamp in range(last_timestamp + window_ms, candle['timestamp'], window_ms):
+                # Flat candle at the last close, no volume, as the forward filling of trade_to_ohlc
+                filled = {
+                    **candle,
+                    'timestamp': timestamp, 'open': close, 'high': close, 'low': close, 'close': close,
+                    **{field: 0.0 for field in FLOW_FIELDS if field in candle},
+                    **({'vwap': close} if 'vwap' in candle else {}),
+                    **({'trade_count': 0} if 'trade_count' in candle else {}),
+                    'is_forward_filled': True,
+                }
+                rows.append({**filled, **self.indicators.update(product_state['indicators'], filled)})
+
+        if self.fill_missing_candles:
+            candle = {'is_forward_filled': False, **candle}
+        rows.append({**candle, **self.indicators.update(product_state['indicators'], candle)})
+        product_state['timestamp'] = candle['timestamp']
+        product_state['close'] = candle['close']
+        state.set(key, product_state)
+        return rows
@@ -0,0 +1,56 @@
+from typing import Optional
+from pydantic_settings import BaseSettings
+
+class Config(BaseSettings):
+    """
+    Configuration settings for the ohlc_to_features service
+
+    Attributes:
+        kafka_broker_address (str): The address of the Kafka broker.
+        kafka_input_topic_name (str): The Kafka topic of the candles of trade_to_ohlc.
+        kafka_output_topic_name (str): The Kafka topic the feature rows are written to.
+        kafka_consumer_group (str): The consumer group reading the candles
+        ohlc_window_seconds (int): Window size of the candles without a `window_seconds` field, to spot missing ones
+        fill_missing_candles (bool): Forward fill the candles missing between two candles of a product, like
+            interpolate_missing_candles() in the predictor, so the indicators see the same series as in training
+        state_dir (str): Local state of the indicators
+        n_candles_into_future (int): pct_change period of the last_observed_target feature
+        RSI_timeperiod ... ATR_timeperiod: The parameters of the predictor's FeatureEngineeringPipeline
+    """
+    kafka_broker_address: Optional[str] = 'localhost:19092'
+    kafka_input_topic_name: str = 'ohlc'
+    kafka_output_topic_name: str = 'ohlc_features'
+    kafka_consumer_group: str = 'ohlc_to_features_live'
+    ohlc_window_seconds: int = 60
+    fill_missing_candles: bool = True
+    state_dir: str = 'state'
+
+# Same names and defaults as FeatureEngineeringPipeline
+    n_candles_into_future: int = 1
+    RSI_timeperiod: int = 14
+    MOM_timeperiod: int = 10
+    MACD_fastperiod: int = 12
+    MACD_slowperiod: int = 26
+    MACD_signalperiod: int = 9
+    MFI_timeperiod: int = 14
+    ADX_timeperiod: int = 14
+    ROC_timeperiod: int = 10
+    STOCH_fastk_period: int = 5
+    STOCH_slowk_period: int = 3
+    STOCH_slowk_matype: int = 0
+    STOCH_slowd_period: int = 3
+    STOCH_slowd_matype: int = 0
+    ULTOSC_timeperiod1: int = 7
+    ULTOSC_timeperiod2: int = 14
+    ULTOSC_timeperiod3: int = 28
+    STDDEV_timeperiod: int = 5
+    STDDEV_nbdev: int = 1
+    ATR_timeperiod: int = 14
+
+config_ohlc_to_features = Config()
+print("\n--- Final Configuration ---")
+print(f"Kafka Broker Address: {config_ohlc_to_features.kafka_broker_address}")
+print(f"Kafka Input Topic: {config_ohlc_to_features.kafka_input_topic_name}")
+print(f"Kafka Output Topic: {config_ohlc_to_features.kafka_output_topic_name}")
+print(f"Kafka Consumer Group: {config_ohlc_to_features.kafka_consumer_group}")
+print(f"Fill Missing Candles: {config_ohlc_to_features.fill_missing_candles} ({config_ohlc_to_features.ohlc_window_seconds}s windows)")
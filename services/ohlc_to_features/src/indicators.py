@@ -0,0 +1,468 @@
+# Incremental (one candle at a time) versions of the talib indicators of the predictor's FeatureEngineeringPipeline
+#
+# Every indicator keeps a small JSON-serialisable state dict, updated in place, so the state of a product can live in
+# the Quix state store. An update costs the same whatever the history length: recursive averages (EMA, Wilder) are
+# O(1), windowed ones only keep their last `timeperiod` values.
+#
+# The warm-up and seeding follow talib (default compatibility, no unstable period), so once warm the values match
+# talib run over the whole history, up to floating point rounding. Until then the indicators return None, where
+# talib has NaN.
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+
+def is_zero(value: float) -> bool:
+    # Same as TA_IS_ZERO in talib
+    return -1e-8 < value < 1e-8
+
+
+def true_range(high: float, low: float, prev_close: float) -> float:
+    return max(high - low, abs(prev_close - high), abs(prev_close - low))
+
+
+def push(window: List[float], value: float, size: int) -> List[float]:
+    # Appends to a window of the last `size` values. NOTE: a list, not a deque, so the state stays JSON-serialisable
+    window.append(value)
+    if len(window) > size:
+        del window[0]
+    return window
+
+
+class RSI:
+    """ talib.RSI: Wilder averages of the gains and losses, seeded with their plain average over timeperiod """
+
+    def __init__(self, timeperiod: int = 14) -> None:
+        self.timeperiod = timeperiod
+
+    def init_state(self) -> dict:
+        return {'prev_close': None, 'n': 0, 'gain': 0.0, 'loss': 0.0}
+
+    def update(self, state: dict, close: float) -> Optional[float]:
+        if state['prev_close'] is None:
+            state['prev_close'] = close
+            return None
+        diff = close - state['prev_close']
+        state['prev_close'] = close
+        state['n'] += 1
+
+        n = self.timeperiod
+        if state['n'] <= n:
+            if diff < 0:
+                state['loss'] -= diff
+            else:
+                state['gain'] += diff
+            if state['n'] < n:
+                return None
+            state['gain'] /= n
+            state['loss'] /= n
+        else:
+            state['gain'] *= n - 1
+            state['loss'] *= n - 1
+            if diff < 0:
+                state['loss'] -= diff
+            else:
+                state['gain'] += diff
+            state['gain'] /= n
+            state['loss'] /= n
+
+        total = state['gain'] + state['loss']
+        return 100.0 * (state['gain'] / total) if not is_zero(total) else 0.0
+
+
+class MOM:
+    """ talib.MOM: close - close timeperiod candles ago """
+
+    def __init__(self, timeperiod: int = 10) -> None:
+        self.timeperiod = timeperiod
+
+    def init_state(self) -> dict:
+        return {'closes': []}
+
+    def update(self, state: dict, close: float) -> Optional[float]:
+        closes = push(state['closes'], close, self.timeperiod + 1)
+        return close - closes[0] if len(closes) > self.timeperiod else None
+
+
+class ROC:
+    """ talib.ROC: ((close / close timeperiod candles ago) - 1) * 100 """
+
+    def __init__(self, timeperiod: int = 10) -> None:
+        self.timeperiod = timeperiod
+
+    def init_state(self) -> dict:
+        return {'closes': []}
+
+    def update(self, state: dict, close: float) -> Optional[float]:
+        closes = push(state['closes'], close, self.timeperiod + 1)
+        if len(closes) <= self.timeperiod:
+            return None
+        return ((close / closes[0]) - 1.0) * 100.0 if closes[0] != 0.0 else 0.0
+
+
+class MACD:
+    """
+    talib.MACD: EMA(fastperiod) - EMA(slowperiod) and its EMA(signalperiod), with k = 2 / (period + 1).
+    As in talib, both EMAs start on the same candle, the slowperiod-th: the slow one is seeded with the average of the
+    slowperiod first closes, the fast one with the average of the last fastperiod of them. The signal is seeded with
+    the average of the first signalperiod MACD values, and nothing is returned before it exists.
+    """
+
+    def __init__(self, fastperiod: int = 12, slowperiod: int = 26, signalperiod: int = 9) -> None:
+        # NOTE: talib swaps the periods when they come the other way around
+        self.fastperiod, self.slowperiod = sorted((fastperiod, slowperiod))
+        self.signalperiod = signalperiod
+
+    def init_state(self) -> dict:
+        return {'closes': [], 'fast': None, 'slow': None, 'macds': [], 'signal': None}
+
+    def update(self, state: dict, close: float) -> Optional[Tuple[float, float]]:
+        if state['slow'] is None:
+            closes = push(state['closes'], close, self.slowperiod)
+            if len(closes) < self.slowperiod:
+                return None
+            state['slow'] = sum(closes) / self.slowperiod
+            state['fast'] = sum(closes[-self.fastperiod:]) / self.fastperiod
+            state['closes'] = []
+        else:
+            k_fast = 2.0 / (self.fastperiod + 1)
+            k_slow = 2.0 / (self.slowperiod + 1)
+            state['fast'] = (close - state['fast']) * k_fast + state['fast']
+            state['slow'] = (close - state['slow']) * k_slow + state['slow']
+
+        macd = state['fast'] - state['slow']
+        if state['signal'] is None:
+            macds = push(state['macds'], macd, self.signalperiod)
+            if len(macds) < self.signalperiod:
+                return None
+            state['signal'] = sum(macds) / self.signalperiod
+            state['macds'] = []
+        else:
+            k_signal = 2.0 / (self.signalperiod + 1)
+            state['signal'] = (macd - state['signal']) * k_signal + state['signal']
+        return macd, state['signal']
+
+
+class MFI:
+    """ talib.MFI: share of the money flow (typical price * volume) of the up candles over timeperiod """
+
+    def __init__(self, timeperiod: int = 14) -> None:
+        self.timeperiod = timeperiod
+
+    def init_state(self) -> dict:
+        return {'prev_typical_price': None, 'positive': [], 'negative': []}
+
+    def update(self, state: dict, high: float, low: float, close: float, volume: float) -> Optional[float]:
+        typical_price = (high + low + close) / 3.0
+        if state['prev_typical_price'] is None:
+            state['prev_typical_price'] = typical_price
+            return None
+        money_flow = typical_price * volume
+        up = typical_price > state['prev_typical_price']
+        down = typical_price < state['prev_typical_price']
+        state['prev_typical_price'] = typical_price
+        positive = push(state['positive'], money_flow if up else 0.0, self.timeperiod)
+        negative = push(state['negative'], money_flow if down else 0.0, self.timeperiod)
+        if len(positive) < self.timeperiod:
+            return None
+
+        total = sum(positive) + sum(negative)
+        # NOTE: talib's threshold, not a zero check
+        return 100.0 * (sum(positive) / total) if total >= 1.0 else 0.0
+
+
+class ATR:
+    """ talib.ATR: Wilder average of the true range, seeded with its plain average over timeperiod """
+
+    def __init__(self, timeperiod: int = 14) -> None:
+        self.timeperiod = timeperiod
+
+    def init_state(self) -> dict:
+        return {'prev_close': None, 'n': 0, 'atr': 0.0}
+
+    def update(self, state: dict, high: float, low: float, close: float) -> Optional[float]:
+        if state['prev_close'] is None:
+            state['prev_close'] = close
+            return None
+        tr = true_range(high, low, state['prev_close'])
+        state['prev_close'] = close
+        state['n'] += 1
+
+        n = self.timeperiod
+        if state['n'] <= n:
+            state['atr'] += tr
+            if state['n'] < n:
+                return None
+            state['atr'] /= n
+        else:
+            state['atr'] = (state['atr'] * (n - 1) + tr) / n
+        return state['atr']
+
+
+class ADX:
+    """
+    talib.ADX: Wilder average of the DX. The directional movements and the true range are summed over the first
+    timeperiod - 1 candles, then Wilder-smoothed, and the first ADX is the plain average of the timeperiod DX after
+    that, so the first value comes on candle 2 * timeperiod.
+    """
+
+    def __init__(self, timeperiod: int = 14) -> None:
+        self.timeperiod = timeperiod
+
+    def init_state(self) -> dict:
+        return {
+            'prev': None, 'n': 0, 'plus_dm': 0.0, 'minus_dm': 0.0, 'tr': 0.0, 'sum_dx': 0.0, 'adx': None,
+        }
+
+    def update(self, state: dict, high: float, low: float, close: float) -> Optional[float]:
+        if state['prev'] is None:
+            state['prev'] = [high, low, close]
+            return None
+        prev_high, prev_low, prev_close = state['prev']
+        state['prev'] = [high, low, close]
+        state['n'] += 1
+
+        diff_plus = high - prev_high
+        diff_minus = prev_low - low
+        plus_dm = diff_plus if diff_plus > 0 and diff_plus > diff_minus else 0.0
+        minus_dm = diff_minus if diff_minus > 0 and diff_plus < diff_minus else 0.0
+        tr = true_range(high, low, prev_close)
+
+        n = self.timeperiod
+        if state['n'] < n:
+            state['plus_dm'] += plus_dm
+            state['minus_dm'] += minus_dm
+            state['tr'] += tr
+            return None
+
+        state['plus_dm'] = state['plus_dm'] - state['plus_dm'] / n + plus_dm
+        state['minus_dm'] = state['minus_dm'] - state['minus_dm'] / n + minus_dm
+        state['tr'] = state['tr'] - state['tr'] / n + tr
+
+        dx = None
+        if not is_zero(state['tr']):
+            plus_di = 100.0 * (state['plus_dm'] / state['tr'])
+            minus_di = 100.0 * (state['minus_dm'] / state['tr'])
+            di_sum = plus_di + minus_di
+            if not is_zero(di_sum):
+                dx = 100.0 * (abs(minus_di - plus_di) / di_sum)
+
+        if state['n'] < 2 * n - 1:
+            state['sum_dx'] += dx or 0.0
+            return None
+        if state['n'] == 2 * n - 1:
+            state['adx'] = (state['sum_dx'] + (dx or 0.0)) / n
+        elif dx is not None:
+            state['adx'] = (state['adx'] * (n - 1) + dx) / n
+        return state['adx']
+
+
+class STOCH:
+    """
+    talib.STOCH with simple moving averages (matype 0): fast %K over fastk_period, slow %K its SMA over
+    slowk_period, slow %D the SMA of slow %K over slowd_period. Both are returned once slow %D exists.
+    """
+
+    def __init__(
+        self,
+        fastk_period: int = 5,
+        slowk_period: int = 3,
+        slowk_matype: int = 0,
+        slowd_period: int = 3,
+        slowd_matype: int = 0,
+    ) -> None:
+        assert slowk_matype == 0 and slowd_matype == 0, 'Only simple moving averages (matype 0) are implemented'
+        self.fastk_period = fastk_period
+        self.slowk_period = slowk_period
+        self.slowd_period = slowd_period
+
+    def init_state(self) -> dict:
+        return {'highs': [], 'lows': [], 'fastk': [], 'slowk': []}
+
+    def update(self, state: dict, high: float, low: float, close: float) -> Optional[Tuple[float, float]]:
+        highs = push(state['highs'], high, self.fastk_period)
+        lows = push(state['lows'], low, self.fastk_period)
+        if len(highs) < self.fastk_period:
+            return None
+
+        highest = max(highs)
+        lowest = min(lows)
+        diff = (highest - lowest) / 100.0
+        fastk = push(state['fastk'], (close - lowest) / diff if diff != 0.0 else 0.0, self.slowk_period)
+        if len(fastk) < self.slowk_period:
+            return None
+
+        slowk = push(state['slowk'], sum(fastk) / self.slowk_period, self.slowd_period)
+        if len(slowk) < self.slowd_period:
+            return None
+        return slowk[-1], sum(slowk) / self.slowd_period
+
+
+class ULTOSC:
+    """
+    talib.ULTOSC: weighted average (4, 2, 1, shortest period first) of the buying pressure / true range ratios over
+    the three periods
+    """
+
+    def __init__(self, timeperiod1: int = 7, timeperiod2: int = 14, timeperiod3: int = 28) -> None:
+        # NOTE: talib sorts the periods, the weight 4 always goes to the shortest
+        self.timeperiods = sorted((timeperiod1, timeperiod2, timeperiod3))
+
+    def init_state(self) -> dict:
+        return {'prev_close': None, 'buying_pressures': [], 'true_ranges': []}
+
+    def update(self, state: dict, high: float, low: float, close: float) -> Optional[float]:
+        if state['prev_close'] is None:
+            state['prev_close'] = close
+            return None
+        true_low = min(low, state['prev_close'])
+        tr = true_range(high, low, state['prev_close'])
+        state['prev_close'] = close
+
+        longest = self.timeperiods[-1]
+        buying_pressures = push(state['buying_pressures'], close - true_low, longest)
+        true_ranges = push(state['true_ranges'], tr, longest)
+        if len(buying_pressures) < longest:
+            return None
+
+        output = 0.0
+        for weight, timeperiod in zip((4.0, 2.0, 1.0), self.timeperiods):
+            tr_total = sum(true_ranges[-timeperiod:])
+            if not is_zero(tr_total):
+                output += weight * (sum(buying_pressures[-timeperiod:]) / tr_total)
+        return 100.0 * (output / 7.0)
+
+
+class STDDEV:
+    """ talib.STDDEV: population standard deviation of the last timeperiod closes, times nbdev """
+
+    def __init__(self, timeperiod: int = 5, nbdev: float = 1) -> None:
+        self.timeperiod = timeperiod
+        self.nbdev = nbdev
+
+    def init_state(self) -> dict:
+        return {'closes': []}
+
+    def update(self, state: dict, close: float) -> Optional[float]:
+        closes = push(state['closes'], close, self.timeperiod)
+        if len(closes) < self.timeperiod:
+            return None
+        # NOTE: two passes over the window instead of talib's running sums of x and x^2, which at crypto prices
+        # (x^2 ~ 1e9) leave rounding residue, e.g. a small non-zero deviation on a flat stretch
+        mean = sum(closes) / self.timeperiod
+        variance = sum((value - mean) ** 2 for value in closes) / self.timeperiod
+        # Same zero threshold as talib (TA_IS_ZERO_OR_NEG)
+        return variance ** 0.5 * self.nbdev if variance >= 1e-8 else 0.0
+
+
+class PctChange:
+    """ pandas pct_change(periods), the last_observed_target feature """
+
+    def __init__(self, periods: int = 1) -> None:
+        self.periods = periods
+
+    def init_state(self) -> dict:
+        return {'closes': []}
+
+    def update(self, state: dict, close: float) -> Optional[float]:
+        closes = push(state['closes'], close, self.periods + 1)
+        if len(closes) <= self.periods:
+            return None
+        return close / closes[0] - 1.0 if closes[0] != 0.0 else None
+
+
+class StreamingIndicators:
+    """
+    The features of FeatureEngineeringPipeline.transform(), one candle at a time.
+
+    Takes the same parameters, so a trained pipeline configures the stream with
+    `StreamingIndicators(**pipeline.get_params())`.
+    """
+
+    def __init__(
+        self,
+        n_candles_into_future: int,
+        # momentum indicators
+        RSI_timeperiod: Optional[int] = 14,
+        MOM_timeperiod: Optional[int] = 10,
+        MACD_fastperiod: Optional[int] = 12,
+        MACD_slowperiod: Optional[int] = 26,
+        MACD_signalperiod: Optional[int] = 9,
+        MFI_timeperiod: Optional[int] = 14,
+        ADX_timeperiod: Optional[int] = 14,
+        ROC_timeperiod: Optional[int] = 10,
+        STOCH_fastk_period: Optional[int] = 5,
+        STOCH_slowk_period: Optional[int] = 3,
+        STOCH_slowk_matype: Optional[int] = 0,
+        STOCH_slowd_period: Optional[int] = 3,
+        STOCH_slowd_matype: Optional[int] = 0,
+        ULTOSC_timeperiod1: Optional[int] = 7,
+        ULTOSC_timeperiod2: Optional[int] = 14,
+        ULTOSC_timeperiod3: Optional[int] = 28,
+        # statistic indicators
+        STDDEV_timeperiod: Optional[int] = 5,
+        STDDEV_nbdev: Optional[int] = 1,
+        # volatility indicators
+        ATR_timeperiod: Optional[int] = 14,
+    ) -> None:
+        self.indicators = {
+            'RSI': RSI(RSI_timeperiod),
+            'MOM': MOM(MOM_timeperiod),
+            'MACD': MACD(MACD_fastperiod, MACD_slowperiod, MACD_signalperiod),
+            'MFI': MFI(MFI_timeperiod),
+            'ADX': ADX(ADX_timeperiod),
+            'ROC': ROC(ROC_timeperiod),
+            'STOCH': STOCH(
+                STOCH_fastk_period, STOCH_slowk_period, STOCH_slowk_matype, STOCH_slowd_period, STOCH_slowd_matype,
+            ),
+            'ULTOSC': ULTOSC(ULTOSC_timeperiod1, ULTOSC_timeperiod2, ULTOSC_timeperiod3),
+            'STDDEV': STDDEV(STDDEV_timeperiod, STDDEV_nbdev),
+            'ATR': ATR(ATR_timeperiod),
+            'last_observed_target': PctChange(n_candles_into_future),
+        }
+
+    def init_state(self) -> dict:
+        return {name: indicator.init_state() for name, indicator in self.indicators.items()}
+
+    def update(self, state: dict, candle: dict) -> dict:
+        """
+        Folds the next candle of a product into its state and returns its features.
+
+        Args:
+            state (dict): The state of the product, from init_state(), updated in place
+            candle (dict): The next candle, with timestamp (window end, ms), open, high, low, close and
+                optionally volume
+
+        Returns:
+            dict: The features of FeatureEngineeringPipeline.final_features, None while an indicator warms up
+        """
+        high, low, close = candle['high'], candle['low'], candle['close']
+        indicators = self.indicators
+
+        macd = indicators['MACD'].update(state['MACD'], close)
+        stoch = indicators['STOCH'].update(state['STOCH'], high, low, close)
+        features = {
+            'RSI': indicators['RSI'].update(state['RSI'], close),
+            'MOM': indicators['MOM'].update(state['MOM'], close),
+            'MACD': macd[0] if macd else None,
+            'MACD_signal': macd[1] if macd else None,
+        }
+        # NOTE: as in add_features(), MFI only when the candles carry volume
+        if 'volume' in candle:
+            features['MFI'] = indicators['MFI'].update(state['MFI'], high, low, close, candle['volume'])
+        features.update({
+            'ADX': indicators['ADX'].update(state['ADX'], high, low, close),
+            'ROC': indicators['ROC'].update(state['ROC'], close),
+            'STOCH_slowk': stoch[0] if stoch else None,
+            'STOCH_slowd': stoch[1] if stoch else None,
+            'ULTOSC': indicators['ULTOSC'].update(state['ULTOSC'], high, low, close),
+            'STDDEV': indicators['STDDEV'].update(state['STDDEV'], close),
+            'ATR': indicators['ATR'].update(state['ATR'], high, low, close),
+            'last_observed_target': indicators['last_observed_target'].update(state['last_observed_target'], close),
+        })
+
+        # Temporal features, from the window end in UTC like pd.to_datetime(timestamp, unit='ms')
+        dt = datetime.fromtimestamp(candle['timestamp'] / 1000, tz=timezone.utc)
+        features['day_of_week'] = dt.weekday()
+        features['hour_of_day'] = dt.hour
+        features['minute_of_hour'] = dt.minute
+        return features
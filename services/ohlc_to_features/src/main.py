@@ -0,0 +1,93 @@
+from quixstreams import Application
+from loguru import logger
+
+from candle_features import CandlesToFeatures
+from indicators import StreamingIndicators
+from config import config_ohlc_to_features
+
+
+def ohlc_to_features(
+        kafka_input_topic: str,
+        kafka_output_topic: str,
+        kafka_broker_address: str,
+        kafka_consumer_group: str,
+        indicators: StreamingIndicators,
+        ohlc_window_seconds: int,
+        fill_missing_candles: bool = True,
+        state_dir: str = 'state',
+) -> None:
+    """
+    Reads the closed candles of trade_to_ohlc and writes one feature row per candle to the output topic: the candle
+    with the technical indicators of the predictor's FeatureEngineeringPipeline.
+
+    NOTE: the predictor re-runs talib over the whole candle history for every prediction. Here every indicator keeps
+    an O(1)-update state per product (indicators.py), so a feature row costs the same whatever the history, and the
+    values match talib over the same history once the indicators are warm.
+
+    Args:
+        kafka_input_topic (str): Kafka topic of the candles
+        kafka_output_topic (str): Kafka topic of the feature rows
+        kafka_broker_address (str): Kafka broker address
+        kafka_consumer_group (str): Consumer group reading the candles
+        indicators (StreamingIndicators): The indicators, with the parameters of the pipeline
+        ohlc_window_seconds (int): Window size of the candles without a `window_seconds` field
+        fill_missing_candles (bool): Forward fill the windows without a candle before computing the indicators
+        state_dir (str): Local state of the indicators
+
+    Returns:
+        None
+    """
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group,
+        auto_offset_reset='earliest',
+        state_dir=state_dir,
+    )
+
+    input_topic = app.topic(name=kafka_input_topic, value_deserializer='json')
+    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+
+    candles_to_features = CandlesToFeatures(indicators, ohlc_window_seconds, fill_missing_candles)
+
+    # The candles are keyed by product_id, so the state of the indicators is per product
+    sdf = app.dataframe(topic=input_topic)
+    sdf = sdf.apply(candles_to_features.update, stateful=True, expand=True)
+    sdf = sdf.update(logger.info)
+    sdf = sdf.to_topic(output_topic)
+
+    app.run(sdf)
+
+
+if __name__ == '__main__':
+
+    ohlc_to_features(
+        kafka_input_topic=config_ohlc_to_features.kafka_input_topic_name,
+        kafka_output_topic=config_ohlc_to_features.kafka_output_topic_name,
+        kafka_broker_address=config_ohlc_to_features.kafka_broker_address,
+        kafka_consumer_group=config_ohlc_to_features.kafka_consumer_group,
+        indicators=StreamingIndicators(
+            n_candles_into_future=config_ohlc_to_features.n_candles_into_future,
+            RSI_timeperiod=config_ohlc_to_features.RSI_timeperiod,
+            MOM_timeperiod=config_ohlc_to_features.MOM_timeperiod,
+            MACD_fastperiod=config_ohlc_to_features.MACD_fastperiod,
+            MACD_slowperiod=config_ohlc_to_features.MACD_slowperiod,
+            MACD_signalperiod=config_ohlc_to_features.MACD_signalperiod,
+            MFI_timeperiod=config_ohlc_to_features.MFI_timeperiod,
+            ADX_timeperiod=config_ohlc_to_features.ADX_timeperiod,
+            ROC_timeperiod=config_ohlc_to_features.ROC_timeperiod,
+            STOCH_fastk_period=config_ohlc_to_features.STOCH_fastk_period,
+            STOCH_slowk_period=config_ohlc_to_features.STOCH_slowk_period,
+            STOCH_slowk_matype=config_ohlc_to_features.STOCH_slowk_matype,
+            STOCH_slowd_period=config_ohlc_to_features.STOCH_slowd_period,
+            STOCH_slowd_matype=config_ohlc_to_features.STOCH_slowd_matype,
+            ULTOSC_timeperiod1=config_ohlc_to_features.ULTOSC_timeperiod1,
+            ULTOSC_timeperiod2=config_ohlc_to_features.ULTOSC_timeperiod2,
+            ULTOSC_timeperiod3=config_ohlc_to_features.ULTOSC_timeperiod3,
+            STDDEV_timeperiod=config_ohlc_to_features.STDDEV_timeperiod,
+            STDDEV_nbdev=config_ohlc_to_features.STDDEV_nbdev,
+            ATR_timeperiod=config_ohlc_to_features.ATR_timeperiod,
+        ),
+        ohlc_window_seconds=config_ohlc_to_features.ohlc_window_seconds,
+        fill_missing_candles=config_ohlc_to_features.fill_missing_candles,
+        state_dir=config_ohlc_to_features.state_dir,
+    )
@@ -0,0 +1,109 @@
+from typing import List, Optional
+
+import numpy as np
+import pytest
+import talib
+
+from indicators import ADX, ATR, MACD, MFI, MOM, ROC, RSI, STDDEV, STOCH, ULTOSC, PctChange, StreamingIndicators
+
+N_CANDLES = 300
+START_MS = 1_717_632_060_000 # window end of the first candle, 2024-06-06 00:01:00 UTC
+
+
+@pytest.fixture(scope='module')
+def candles() -> dict:
+    """ A random walk at crypto prices, with a flat stretch (STDDEV and STOCH zero checks) """
+    rng = np.random.default_rng(0)
+    close = 65_000 + np.cumsum(rng.normal(0, 20, N_CANDLES))
+    close[150:160] = close[149]
+    spread = np.abs(rng.normal(0, 10, N_CANDLES))
+    high = close + spread
+    low = close - spread
+    high[150:160] = low[150:160] = close[149]
+    volume = rng.exponential(2, N_CANDLES)
+    return {'high': high, 'low': low, 'close': close, 'volume': volume}
+
+
+def stream(indicator, *inputs: np.ndarray) -> List[Optional[float]]:
+    state = indicator.init_state()
+    return [indicator.update(state, *(float(value) for value in values)) for values in zip(*inputs)]
+
+
+def assert_matches_talib(streamed: List[Optional[float]], expected: np.ndarray) -> None:
+    # None until warm, where talib has NaN, then the talib values
+    assert [value is None for value in streamed] == np.isnan(expected).tolist()
+    warm = ~np.isnan(expected)
+    np.testing.assert_allclose(np.array(streamed, dtype=float)[warm], expected[warm], rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize('timeperiod', [5, 14])
+def test_close_indicators(candles, timeperiod):
+    close = candles['close']
+    assert_matches_talib(stream(RSI(timeperiod), close), talib.RSI(close, timeperiod=timeperiod))
+    assert_matches_talib(stream(MOM(timeperiod), close), talib.MOM(close, timeperiod=timeperiod))
+    assert_matches_talib(stream(ROC(timeperiod), close), talib.ROC(close, timeperiod=timeperiod))
+    assert_matches_talib(stream(STDDEV(timeperiod), close), talib.STDDEV(close, timeperiod=timeperiod, nbdev=1))
+
+
+@pytest.mark.parametrize('timeperiod', [5, 14])
+def test_high_low_close_indicators(candles, timeperiod):
+    hlc = candles['high'], candles['low'], candles['close']
+    assert_matches_talib(stream(ATR(timeperiod), *hlc), talib.ATR(*hlc, timeperiod=timeperiod))
+    assert_matches_talib(stream(ADX(timeperiod), *hlc), talib.ADX(*hlc, timeperiod=timeperiod))
+    assert_matches_talib(
+        stream(MFI(timeperiod), *hlc, candles['volume']), talib.MFI(*hlc, candles['volume'], timeperiod=timeperiod)
+    )
+
+
+def test_macd(candles):
+    streamed = stream(MACD(12, 26, 9), candles['close'])
+    macd, signal, _ = talib.MACD(candles['close'], fastperiod=12, slowperiod=26, signalperiod=9)
+
+    assert_matches_talib([value[0] if value else None for value in streamed], macd)
+    assert_matches_talib([value[1] if value else None for value in streamed], signal)
+
+
+def test_stoch(candles):
+    hlc = candles['high'], candles['low'], candles['close']
+    streamed = stream(STOCH(5, 3, 0, 3, 0), *hlc)
+    slowk, slowd = talib.STOCH(*hlc, fastk_period=5, slowk_period=3, slowk_matype=0, slowd_period=3, slowd_matype=0)
+
+    assert_matches_talib([value[0] if value else None for value in streamed], slowk)
+    assert_matches_talib([value[1] if value else None for value in streamed], slowd)
+
+
+def test_ultosc(candles):
+    hlc = candles['high'], candles['low'], candles['close']
+    assert_matches_talib(stream(ULTOSC(7, 14, 28), *hlc), talib.ULTOSC(*hlc, timeperiod1=7, timeperiod2=14, timeperiod3=28))
+
+
+def test_pct_change(candles):
+    close = candles['close']
+    expected = np.r_[np.nan, close[1:] / close[:-1] - 1.0]
+    assert_matches_talib(stream(PctChange(1), close), expected)
+
+
+def test_streaming_indicators_features(candles):
+    indicators = StreamingIndicators(n_candles_into_future=1)
+    state = indicators.init_state()
+
+    rows = []
+    for i in range(N_CANDLES):
+        candle = {
+            'timestamp': START_MS + i * 60_000,
+            'open': float(candles['close'][i]),
+            'high': float(candles['high'][i]),
+            'low': float(candles['low'][i]),
+            'close': float(candles['close'][i]),
+            'volume': float(candles['volume'][i]),
+        }
+        rows.append(indicators.update(state, candle))
+
+    assert_matches_talib([row['RSI'] for row in rows], talib.RSI(candles['close'], timeperiod=14))
+    assert_matches_talib([row['MFI'] for row in rows], talib.MFI(candles['high'], candles['low'], candles['close'], candles['volume'], timeperiod=14))
+    # Window end in UTC
+    assert (rows[0]['day_of_week'], rows[0]['hour_of_day'], rows[0]['minute_of_hour']) == (3, 0, 1)
+
+    # No MFI without volume, like add_features()
+    candle.pop('volume')
+    assert 'MFI' not in indicators.update(indicators.init_state(), candle)
@@ -42,13 +42,29 @@ def interpolate_missing_candles(ohlc_data: pd.DataFrame = ohlc_data ,
    
     from_ms = ohlc_data.index.min() #not to be confused with from_ms and to_ms of trade_producer -the from and to are defining the range of values
     to_ms = ohlc_data.index.max()
-    labels = range(from_ms, to_ms, ohlc_windows_seconds * 1000)
+    # NOTE: to_ms included, the last candle is kept
+    labels = range(from_ms, to_ms + 1, ohlc_windows_seconds * 1000)
+
+    # Candles from trade_to_ohlc carry an is_forward_filled flag, True on the ones it filled in watermark mode. The
+    # streaming mode flags every candle False and fills nothing, so the flag alone does not mean nothing is missing
+    if 'is_forward_filled' in ohlc_data and len(ohlc_data) == len(labels):
+        ohlc_data.reset_index(inplace=True)
+        ohlc_data['datetime'] = pd.to_datetime(ohlc_data['timestamp'], unit='ms')
+        return ohlc_data
+    already_filled = ohlc_data.pop('is_forward_filled').astype(bool) if 'is_forward_filled' in ohlc_data else None
     
     # reindex the dataframe to add missing rows
     ohlc_data = ohlc_data.reindex(labels)
 
     # Flag forward-filled rows :NOTE: Used later for engineering the time-since-last-trades column
     ohlc_data['is_forward_filled'] = ohlc_data['close'].isnull()
+    if already_filled is not None:
+        ohlc_data['is_forward_filled'] |= already_filled.reindex(labels, fill_value=False)
+
+    # The filled windows had no trades: no volume flow, and the vwap of a flat candle is its close
+    for column in ['volume', 'notional', 'trade_count', 'buy_volume', 'sell_volume']:
+        if column in ohlc_data:
+            ohlc_data[column] = ohlc_data[column].fillna(0)
 
     # interpolate missing values using forward fill for close prices
     ohlc_data['close'].ffill(inplace=True)
@@ -57,6 +73,8 @@ def interpolate_missing_candles(ohlc_data: pd.DataFrame = ohlc_data ,
     ohlc_data['high'].fillna(ohlc_data['close'], inplace=True)
     ohlc_data['low'].fillna(ohlc_data['close'], inplace=True)
     ohlc_data['product_id'].ffill(inplace=True)
+    if 'vwap' in ohlc_data:
+        ohlc_data['vwap'] = ohlc_data['vwap'].fillna(ohlc_data['close'])
 
     # reset the index
     ohlc_data.reset_index(inplace=True)
@@ -29,6 +29,7 @@ class FeatureEngineeringPipeline(BaseEstimator, TransformerMixin):
         MACD_fastperiod: Optional[int] = 12,
         MACD_slowperiod: Optional[int] = 26,
         MACD_signalperiod: Optional[int] = 9,
+        use_MFI: Optional[bool] = False,
         MFI_timeperiod: Optional[int] = 14,
         ADX_timeperiod: Optional[int] = 14,
         ROC_timeperiod: Optional[int] = 10,
@@ -58,6 +59,7 @@ class FeatureEngineeringPipeline(BaseEstimator, TransformerMixin):
             - MACD_fastperiod: Optional[int]: the fast period for the MACD indicator
             - MACD_slowperiod: Optional[int]: the slow period for the MACD indicator
             - MACD_signalperiod: Optional[int]: the signal period for the MACD indicator
+            - use_MFI: Optional[bool]: whether to add the MFI indicator, which needs the candle volume
             - MFI_timeperiod: Optional[int]: the time period for the MFI indicator
             - ADX_timeperiod: Optional[int]: the time period for the ADX indicator
             - ROC_timeperiod: Optional[int]: the time period for the ROC indicator
@@ -88,6 +90,7 @@ class FeatureEngineeringPipeline(BaseEstimator, TransformerMixin):
         self.MACD_fastperiod = MACD_fastperiod
         self.MACD_slowperiod = MACD_slowperiod
         self.MACD_signalperiod = MACD_signalperiod
+        self.use_MFI = use_MFI
         self.MFI_timeperiod = MFI_timeperiod
         self.ADX_timeperiod = ADX_timeperiod
         self.ROC_timeperiod = ROC_timeperiod
@@ -112,7 +115,7 @@ class FeatureEngineeringPipeline(BaseEstimator, TransformerMixin):
             'MOM',
             'MACD',
             'MACD_signal',
-            # 'MFI',
+            'MFI',
             'ADX',
             'ROC',
             'STOCH_slowk',
@@ -125,6 +128,8 @@ class FeatureEngineeringPipeline(BaseEstimator, TransformerMixin):
             'hour_of_day',
             'minute_of_hour',
         ]
+        if not use_MFI:
+            self.final_features.remove('MFI')
 
     def fit(self, X, y=None):
         return self
@@ -138,6 +143,7 @@ class FeatureEngineeringPipeline(BaseEstimator, TransformerMixin):
             MACD_fastperiod=self.MACD_fastperiod,
             MACD_slowperiod=self.MACD_slowperiod,
             MACD_signalperiod=self.MACD_signalperiod,
+            use_MFI=self.use_MFI,
             MFI_timeperiod=self.MFI_timeperiod,
             ADX_timeperiod=self.ADX_timeperiod,
             ROC_timeperiod=self.ROC_timeperiod,
@@ -169,6 +175,7 @@ def add_features(
     MACD_fastperiod: Optional[int] = 12,
     MACD_slowperiod: Optional[int] = 26,
     MACD_signalperiod: Optional[int] = 9,
+    use_MFI: Optional[bool] = False,
     MFI_timeperiod: Optional[int] = 14,
     ADX_timeperiod: Optional[int] = 14,
     ROC_timeperiod: Optional[int] = 10,
@@ -198,7 +205,9 @@ def add_features(
         slowperiod=MACD_slowperiod,
         signalperiod=MACD_signalperiod,
     )
-    # X_ = add_MFI(X_, timeperiod=MFI_timeperiod)
+    # MFI needs the candle volume, only in the feature groups written since trade_to_ohlc tracks it
+    if use_MFI:
+        X_ = add_MFI(X_, timeperiod=MFI_timeperiod)
     X_ = add_ADX(X_, timeperiod=ADX_timeperiod)
     X_ = add_ROC(X_, timeperiod=ROC_timeperiod)
     X_ = add_STOCH(
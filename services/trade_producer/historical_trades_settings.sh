@@ -2,4 +2,9 @@ export KAFKA_TOPIC=trade_historical
 export PRODUCT_IDS='["BTC/USD"]'
 export LIVE_OR_HISTORICAL=historical
 export LAST_N_DAYS=3
-export CACHE_DIR_HISTORICAL_DATA=/tmp/historical_trade_data
\ No newline at end of file
+export CACHE_DIR_HISTORICAL_DATA=/tmp/historical_trade_data
+export N_THREADS=4
+export KAFKA_COMPRESSION_TYPE=lz4
+export KAFKA_LINGER_MS=50
+export STATE_DIR=/tmp/historical_trade_data/state
+export KAFKA_NUM_PARTITIONS=4
@@ -1,3 +1,4 @@
 export KAFKA_TOPIC=trade
 export PRODUCT_IDS='["BTC/USD","ETH/EUR","ETH/USD"]'
-export LIVE_OR_HISTORICAL=live
\ No newline at end of file
+export LIVE_OR_HISTORICAL=live
+export KAFKA_NUM_PARTITIONS=4
@@ -2,4 +2,5 @@
 # the trade_producer in live mode in Quix Cloud
 export KAFKA_TOPIC=trade
 export PRODUCT_IDS='["BTC/USD","ETH/EUR","ETH/USD"]'
-export LIVE_OR_HISTORICAL=live
\ No newline at end of file
+export LIVE_OR_HISTORICAL=live
+export KAFKA_NUM_PARTITIONS=4
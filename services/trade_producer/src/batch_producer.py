@@ -0,0 +1,180 @@
+# Helpers to push whole TradeBatch objects into Kafka, instead of serialising and producing trade by trade
+import time
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from loguru import logger
+from quixstreams.kafka import Producer
+from quixstreams.utils.json import dumps
+
+from src.kraken_api.checkpoints import BackfillCheckpoints
+from src.kraken_api.trade_batch import TradeBatch
+
+
+def get_producer_extra_config(
+    linger_ms: int,
+    batch_size: int,
+    compression_type: str,
+    enable_idempotence: bool,
+) -> dict:
+    """
+    librdkafka settings for a high throughput producer, passed to Application(producer_extra_config=...)
+
+    Args:
+        linger_ms (int): How long the producer waits to fill a batch before sending it
+        batch_size (int): Maximum size of a batch of messages, in bytes
+        compression_type (str): One of none, gzip, snappy, lz4, zstd. Applied per batch, so it pairs well with linger_ms
+        enable_idempotence (bool): Exactly once, in order delivery per partition, even when the producer retries
+
+    Returns:
+        dict: The librdkafka config
+    """
+    return {
+        'linger.ms': linger_ms,
+        'batch.size': batch_size,
+        'compression.type': compression_type,
+        'enable.idempotence': enable_idempotence,
+    }
+
+
+def serialize_batch(trades: TradeBatch) -> Tuple[List[bytes], List[bytes]]:
+    """
+    Serialises a whole batch of trades in one go, into the same key/value bytes topic.serialize() gives for a
+    json topic: the product_id as key, and the JSON of Trade.model_dump() as value.
+
+    Args:
+        trades (TradeBatch): The trades to serialise
+
+    Returns:
+        Tuple[List[bytes], List[bytes]]: The keys and the values, one per trade
+    """
+    # NOTE: a handful of distinct product_ids per batch, so encode each of them once
+    encoded_product_ids = {product_id: product_id.encode() for product_id in set(trades.product_id.tolist())}
+
+    keys = [encoded_product_ids[product_id] for product_id in trades.product_id.tolist()]
+    values = [dumps(record) for record in trades.to_records()]
+    return keys, values
+
+
+class DeliveryStats:
+    """
+    Collects the delivery reports of the producer to report throughput and delivery latency.
+    Pass `on_delivery` as the delivery callback of every produced message.
+    """
+
+    def __init__(self, log_every_sec: Optional[float] = 10, checkpoints: Optional[BackfillCheckpoints] = None) -> None:
+        self.log_every_sec = log_every_sec
+        # A failed delivery of any trade freezes the checkpoint of its product
+        self.checkpoints = checkpoints
+
+        self.n_delivered = 0
+        self.n_failed = 0
+        self.bytes_delivered = 0
+        self._total_latency_sec = 0.0
+        self._max_latency_sec = 0.0
+
+        self._started_at = time.monotonic()
+        self._last_logged_at = self._started_at
+        self._n_delivered_at_last_log = 0
+
+    def on_delivery(self, err, msg) -> None:
+        """
+        Delivery callback, called by the producer from poll()/flush()
+        """
+        if err is not None:
+            self.n_failed += 1
+            logger.error(f'Failed to deliver message to {msg.topic()}: {err}')
+            if self.checkpoints is not None and msg.key():
+                self.checkpoints.mark_failed(msg.key().decode())
+            return
+
+        self.n_delivered += 1
+        self.bytes_delivered += len(msg.value() or b'')
+        # NOTE: msg.latency() is the time between produce() and the broker acknowledging the message
+        latency_sec = msg.latency() or 0.0
+        self._total_latency_sec += latency_sec
+        self._max_latency_sec = max(self._max_latency_sec, latency_sec)
+
+    def log(self, force: Optional[bool] = False) -> None:
+        """
+        Logs the delivery rate since the last log and the average/max latency, at most every log_every_sec
+        """
+        now = time.monotonic()
+        if not force and now - self._last_logged_at < self.log_every_sec:
+            return
+
+        interval_sec = max(now - self._last_logged_at, 1e-9)
+        rate = (self.n_delivered - self._n_delivered_at_last_log) / interval_sec
+        avg_latency_ms = 1000 * self._total_latency_sec / max(self.n_delivered, 1)
+
+        logger.info(
+            f'Delivered {self.n_delivered} trades ({rate:.0f}/sec, {self.bytes_delivered / 1e6:.1f} MB), '
+            f'{self.n_failed} failed, latency avg={avg_latency_ms:.1f}ms max={1000 * self._max_latency_sec:.1f}ms'
+        )
+        self._last_logged_at = now
+        self._n_delivered_at_last_log = self.n_delivered
+
+
+def produce_batch(
+    producer: Producer,
+    topic_name: str,
+    trades: TradeBatch,
+    delivery_stats: DeliveryStats,
+    checkpoints: Optional[BackfillCheckpoints] = None,
+) -> None:
+    """
+    Serialises the whole batch and hands every message to the producer, which batches and compresses
+    them according to linger.ms/batch.size/compression.type.
+
+    Args:
+        producer (Producer): Producer from app.get_producer()
+        topic_name (str): The topic the trades are written to
+        trades (TradeBatch): The trades
+        delivery_stats (DeliveryStats): Collects the delivery reports
+        checkpoints (Optional(BackfillCheckpoints)): Advanced when the last trade of each product in the batch is delivered
+
+    Returns:
+        None
+    """
+    if len(trades) == 0:
+        return
+
+    # The last message of every product gets a delivery callback that also commits its checkpoint
+    checkpoint_callbacks = {}
+    if checkpoints is not None:
+        for product_id in np.unique(trades.product_id):
+            last_index = int(np.flatnonzero(trades.product_id == product_id)[-1])
+            checkpoint_callbacks[last_index] = _checkpoint_on_delivery(trades, last_index, delivery_stats, checkpoints)
+
+    keys, values = serialize_batch(trades)
+    for i, (key, value) in enumerate(zip(keys, values)):
+        producer.produce(
+            topic=topic_name,
+            value=value,
+            key=key,
+            on_delivery=checkpoint_callbacks.get(i, delivery_stats.on_delivery),
+        )
+
+
+def _checkpoint_on_delivery(
+    trades: TradeBatch,
+    last_index: int,
+    delivery_stats: DeliveryStats,
+    checkpoints: BackfillCheckpoints,
+) -> Callable:
+    """
+    Delivery callback of the last trade of a product in a batch. Once Kafka acknowledges it, every earlier trade
+    of that product (same key, same partition, delivered in order) is acknowledged too, so the checkpoint moves
+    to its timestamp.
+    """
+    product_id = trades.product_id[last_index]
+    last_ms = int(trades.timestamp_ms[last_index])
+    last_trade_id = int(trades.trade_id[last_index])
+
+    def on_delivery(err, msg) -> None:
+        delivery_stats.on_delivery(err, msg)
+        if err is None:
+            checkpoints.commit(product_id, last_ms, last_trade_id)
+
+    return on_delivery
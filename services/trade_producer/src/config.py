@@ -36,11 +36,48 @@ class Config(BaseSettings):
     last_n_days: Optional[int] = 2 # remove for prod
     cache_dir: Optional[str] = None # remove for prod
 
+    # Historical backfill via the REST API
+    n_threads: int = 4 # number of pairs fetched concurrently
+    n_shards_per_product: int = 1 # >1 splits each pair's time window into shards fetched in parallel
+    rest_max_counter: float = 15 # Kraken call counter limit, shared by all the threads
+    rest_decay_per_sec: float = 1.0 # rate at which Kraken's call counter decays
+    rest_connect_timeout_sec: float = 3.05 # HTTP connect timeout of the pooled REST session
+    rest_read_timeout_sec: float = 10 # HTTP read timeout of the pooled REST session
+    rest_max_retries: int = 5 # retries, with jittered backoff, on transient HTTP errors
+
+    # Kafka producer batching
+    kafka_linger_ms: int = 50 # how long the producer waits to fill a batch before sending it
+    kafka_batch_size: int = 1_000_000 # max size of a batch of messages, in bytes
+    kafka_compression_type: str = 'lz4' # none, gzip, snappy, lz4 or zstd
+    kafka_enable_idempotence: bool = True # no duplicates/reordering when the producer retries
+    kafka_num_partitions: int = 1 # partitions of the trade topic when it is created, the max number of trade_to_ohlc workers
+
+    # Fetch and produce concurrently, through a bounded queue of trade batches
+    pipelined: bool = True
+    pipeline_queue_size: int = 16 # fetchers block once this many batches wait to be produced
+
+    # Live trades via the websocket API
+    ws_async: bool = True # asyncio client with the pairs sharded over several connections, False for the blocking one
+    ws_max_pairs_per_connection: int = 50 # pairs subscribed on one websocket connection
+    ws_compression: bool = True # permessage-deflate
+
+    # Backfill checkpoints (historical) and last delivered trades (hybrid) of every pair
+    state_dir: Optional[str] = "/tmp/trade_producer_state"
+
+    # Hybrid mode: websocket, with the gaps since the last produced trades backfilled from the REST API
+    hybrid_max_gap_days: float = 1 # longest gap backfilled on start/reconnect
+
 
     @field_validator('live_or_historical')
     @classmethod
     def validate_live_or_historical(cls, value):
-        assert value in {'live', 'historical'}, f'Invalid value for live_or_historical: {value}'
+        assert value in {'live', 'historical', 'hybrid'}, f'Invalid value for live_or_historical: {value}'
+        return value
+
+    @field_validator('kafka_compression_type')
+    @classmethod
+    def validate_kafka_compression_type(cls, value):
+        assert value in {'none', 'gzip', 'snappy', 'lz4', 'zstd'}, f'Invalid value for kafka_compression_type: {value}'
         return value
 
 config_kraken_to_trade = Config()
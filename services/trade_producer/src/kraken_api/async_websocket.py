@@ -0,0 +1,274 @@
+# asyncio websocket client that spreads the pairs over several Kraken connections (shards) read concurrently
+import asyncio
+import json
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+import websockets
+from websockets.exceptions import WebSocketException
+from loguru import logger
+
+from src.kraken_api.trade_batch import TradeBatch
+
+
+class KrakenAsyncWebsocketTradeAPI:
+    """
+    Live trades from Kraken's websocket API v2, for large pair universes.
+
+    The pairs are split into shards of at most `max_pairs_per_connection` pairs, each shard on its own websocket
+    connection. All the shards are read concurrently by one asyncio event loop running in a background thread,
+    and their trades land in a thread-safe queue that get_trades() drains, so the produce loop (or the
+    TradePipeline) keeps the same get_trades()/is_done() interface as KrakenWebsocketTradeAPI.
+
+    - permessage-deflate compression is negotiated on every connection (compression='deflate')
+    - protocol level pings are answered by the websockets library, which also pings Kraken every
+      ping_interval_sec and drops the connection if no pong comes back within ping_timeout_sec
+    - Kraken's heartbeat messages are tracked: no message at all for heartbeat_timeout_sec means the
+      connection is stale and the shard reconnects
+    - every shard reconnects on its own, with jittered exponential backoff, so one bad connection only
+      stalls its own pairs, and a message that fails to be handled is logged and skipped
+
+    NOTE: when get_trades() is not called fast enough, the shards wait for room in the buffer (and stop
+    reading their socket), instead of buffering without limit.
+    """
+
+    URL = 'wss://ws.kraken.com/v2'
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        max_pairs_per_connection: Optional[int] = 50,
+        compression: Optional[bool] = True,
+        ping_interval_sec: Optional[float] = 20,
+        ping_timeout_sec: Optional[float] = 20,
+        heartbeat_timeout_sec: Optional[float] = 30,
+        max_reconnect_backoff_sec: Optional[float] = 60,
+        max_buffered_messages: Optional[int] = 10_000,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The currency pairs to subscribe to
+            max_pairs_per_connection (int): Maximum number of pairs subscribed on one websocket connection
+            compression (bool): Negotiate permessage-deflate compression
+            ping_interval_sec (float): Seconds between the pings sent to Kraken
+            ping_timeout_sec (float): Seconds to wait for the pong before dropping the connection
+            heartbeat_timeout_sec (float): Seconds without any message before the connection is considered stale
+            max_reconnect_backoff_sec (float): Cap of the backoff between two reconnects of a shard
+            max_buffered_messages (int): Maximum number of trade messages waiting for get_trades()
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.compression = 'deflate' if compression else None
+        self.ping_interval_sec = ping_interval_sec
+        self.ping_timeout_sec = ping_timeout_sec
+        self.heartbeat_timeout_sec = heartbeat_timeout_sec
+        self.max_reconnect_backoff_sec = max_reconnect_backoff_sec
+
+        self.shards = [
+            product_ids[i:i + max_pairs_per_connection]
+            for i in range(0, len(product_ids), max_pairs_per_connection)
+        ]
+
+        self._messages: queue.Queue = queue.Queue(maxsize=max_buffered_messages)
+
+        # Per shard counters, for the stats report
+        self.n_messages = [0] * len(self.shards)
+        self.n_reconnects = [0] * len(self.shards)
+        self._started_at = time.monotonic()
+
+        # Pairs whose shard reconnected since the last pop_reconnected_products(), i.e. that may have missed trades
+        self._reconnected_products: set = set()
+        self._reconnected_lock = threading.Lock()
+
+        self._loop = asyncio.new_event_loop()
+        self._shards_task: Optional[asyncio.Future] = None
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run_loop, name='kraken-websocket', daemon=True)
+        self._thread.start()
+
+        logger.info(f'Subscribing to {len(product_ids)} pairs over {len(self.shards)} websocket connections')
+
+    # %% Event loop side
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._shards_task = asyncio.gather(*(self._run_shard(i, pairs) for i, pairs in enumerate(self.shards)))
+        try:
+            self._loop.run_until_complete(self._shards_task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _run_shard(self, shard_id: int, product_ids: List[str]) -> None:
+        """
+        Keeps one connection alive for the given pairs, reconnecting with backoff whenever it drops.
+        """
+        backoff_sec = 1.0
+        is_reconnect = False
+        while not self._stopping:
+            try:
+                async with websockets.connect(
+                    self.URL,
+                    compression=self.compression,
+                    ping_interval=self.ping_interval_sec,
+                    ping_timeout=self.ping_timeout_sec,
+                ) as ws:
+                    await self._subscribe(ws, product_ids)
+                    logger.info(f'Shard {shard_id}: subscribed to {len(product_ids)} pairs')
+                    backoff_sec = 1.0
+                    if is_reconnect:
+                        with self._reconnected_lock:
+                            self._reconnected_products.update(product_ids)
+                    is_reconnect = True
+
+                    while not self._stopping:
+                        # NOTE: Kraken sends a heartbeat every second, so silence means the connection is stale
+                        message = await asyncio.wait_for(ws.recv(), timeout=self.heartbeat_timeout_sec)
+                        try:
+                            await self._on_message(shard_id, message)
+                        except Exception as e:
+                            # NOTE: one malformed message is skipped, it must not take down the shard
+                            logger.error(f'Shard {shard_id}: failed to handle message {message[:200]!r}: {e!r}')
+
+            except (WebSocketException, OSError, asyncio.TimeoutError) as e:
+                if self._stopping:
+                    break
+                sleep_sec = self._next_backoff(shard_id, backoff_sec)
+                logger.warning(f'Shard {shard_id}: connection lost ({e!r}), reconnecting in {sleep_sec:.1f}s')
+                await asyncio.sleep(sleep_sec)
+                backoff_sec = min(2 * backoff_sec, self.max_reconnect_backoff_sec)
+
+            except Exception as e:
+                # Anything else (e.g. a bug in _subscribe) would end the gather() of every shard: this shard alone
+                # is reconnected instead
+                if self._stopping:
+                    break
+                sleep_sec = self._next_backoff(shard_id, backoff_sec)
+                logger.exception(f'Shard {shard_id}: unexpected error ({e!r}), reconnecting in {sleep_sec:.1f}s')
+                await asyncio.sleep(sleep_sec)
+                backoff_sec = min(2 * backoff_sec, self.max_reconnect_backoff_sec)
+
+    def _next_backoff(self, shard_id: int, backoff_sec: float) -> float:
+        """
+        Counts the reconnect and returns the jittered wait before it
+        """
+        self.n_reconnects[shard_id] += 1
+        return backoff_sec + random.uniform(0, backoff_sec)
+
+    async def _subscribe(self, ws, product_ids: List[str]) -> None:
+        msg = {
+            'method': 'subscribe',
+            'params': {'channel': 'trade', 'symbol': product_ids, 'snapshot': False},
+        }
+        await ws.send(json.dumps(msg))
+
+    async def _on_message(self, shard_id: int, message: str) -> None:
+        """
+        Keeps the trade updates, drops everything else (heartbeats, subscription acks, status messages)
+        """
+        message_data = json.loads(message)
+
+        if message_data.get('channel') != 'trade' or message_data.get('type') != 'update':
+            return
+
+        self.n_messages[shard_id] += 1
+        try:
+            self._messages.put_nowait(message_data['data'])
+        except queue.Full:
+            # Backpressure: wait for room without blocking the other shards
+            await asyncio.to_thread(self._messages.put, message_data['data'])
+
+    # %% Caller side
+    def get_trades(self, timeout_sec: Optional[float] = 1.0) -> TradeBatch:
+        """
+        Returns every trade received since the last call, waiting up to timeout_sec for the first one.
+
+        Args:
+            timeout_sec (float): How long to wait when no trade is buffered
+
+        Returns:
+            TradeBatch: The trades of every shard, empty if nothing came in
+        """
+        try:
+            messages = [self._messages.get(timeout=timeout_sec)]
+        except queue.Empty:
+            return TradeBatch.empty()
+
+        while True:
+            try:
+                messages.append(self._messages.get_nowait())
+            except queue.Empty:
+                break
+
+        trades = [trade for data in messages for trade in data if 'qty' in trade]
+        return TradeBatch(
+            product_id=np.array([trade['symbol'] for trade in trades], dtype=object),
+            price=[trade['price'] for trade in trades],
+            volume=[trade['qty'] for trade in trades],
+            timestamp_ms=[self.to_ms(trade['timestamp']) for trade in trades],
+            trade_id=[trade['trade_id'] for trade in trades],
+            side=[trade['side'] for trade in trades],
+        )
+
+    def pop_reconnected_products(self) -> List[str]:
+        """
+        Returns (and forgets) the pairs whose connection dropped and came back since the last call.
+        Their trades during the outage are missing, see KrakenHybridTradeAPI.
+        """
+        with self._reconnected_lock:
+            products, self._reconnected_products = list(self._reconnected_products), set()
+        return products
+
+    def is_done(self) -> bool:
+        """
+        Live data never runs out
+        """
+        return False
+
+    def get_stats(self) -> List[Dict]:
+        """
+        Message rate and number of reconnects of every shard
+        """
+        elapsed_sec = max(time.monotonic() - self._started_at, 1e-9)
+        return [
+            {
+                'shard': i,
+                'n_pairs': len(pairs),
+                'n_messages': self.n_messages[i],
+                'messages_per_sec': self.n_messages[i] / elapsed_sec,
+                'n_reconnects': self.n_reconnects[i],
+            }
+            for i, pairs in enumerate(self.shards)
+        ]
+
+    def log_stats(self) -> None:
+        for stats in self.get_stats():
+            logger.info(
+                f"Shard {stats['shard']}: {stats['n_pairs']} pairs, {stats['n_messages']} messages "
+                f"({stats['messages_per_sec']:.1f}/sec), {stats['n_reconnects']} reconnects"
+            )
+
+    def close(self) -> None:
+        """
+        Stops every shard and the event loop
+        """
+        self._stopping = True
+        if self._shards_task is not None:
+            # NOTE: cancelling wakes up the shards blocked in recv(), the connections are closed on the way out
+            self._loop.call_soon_threadsafe(self._shards_task.cancel)
+        self._thread.join(timeout=10)
+
+    @staticmethod
+    def to_ms(timestamp: str) -> int:
+        """
+        '2024-06-17T09:36:39.467866Z' -> Unix milliseconds, as in KrakenWebsocketTradeAPI.to_ms
+        """
+        timestamp = datetime.fromisoformat(timestamp[:-1]).replace(tzinfo=timezone.utc)
+        return int(timestamp.timestamp() * 1000)
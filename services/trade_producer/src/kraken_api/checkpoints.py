@@ -0,0 +1,105 @@
+# Durable per-product checkpoints of the historical backfill, advanced only once Kafka confirms the delivery
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from loguru import logger
+
+# (timestamp in ms, trade_id) of the last delivered trade
+Checkpoint = Tuple[int, int]
+
+
+class BackfillCheckpoints:
+    """
+    Remembers, per product_id, the timestamp of the last trade Kafka acknowledged, so a restarted backfill
+    (crash, `restart: on-failure`, manual stop) resumes right after it instead of re-publishing every trade.
+
+    The checkpoints are advanced from the delivery callbacks: the last message of each product in every
+    produced batch carries the timestamp of that trade. Messages with the same key go to the same partition
+    and the idempotent producer delivers them in order, so when that message is acknowledged every earlier
+    trade of the product is too. A failed delivery freezes the checkpoint of its product for the rest of the run.
+
+    Stored in <state_dir>/backfill_checkpoints_<topic>.json as {product_id: [last_ms, last_trade_id]},
+    one file per topic so a backfill into a new topic starts from scratch.
+
+    The hybrid mode keeps its last produced trades the same way, in its own file (see KrakenHybridTradeAPI).
+    """
+
+    def __init__(
+        self,
+        state_dir: str,
+        topic_name: str,
+        save_every_sec: Optional[float] = 5,
+        file_name: Optional[str] = None,
+    ) -> None:
+        """
+        Args:
+            state_dir (str): Directory of the checkpoint file
+            topic_name (str): The topic the trades are produced to
+            save_every_sec (float): How often the checkpoints are written to disk
+            file_name (Optional(str)): Name of the checkpoint file, backfill_checkpoints_<topic>.json by default
+
+        Returns:
+            None
+        """
+        self.path = Path(state_dir) / (file_name or f'backfill_checkpoints_{topic_name}.json')
+        self.save_every_sec = save_every_sec
+
+        self._checkpoints: Dict[str, Checkpoint] = {}
+        self._failed_products: Set[str] = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_saved_at = time.monotonic()
+
+        if self.path.exists():
+            with open(self.path) as f:
+                for product_id, (last_ms, last_trade_id) in json.load(f).items():
+                    self._checkpoints[product_id] = (int(last_ms), int(last_trade_id))
+            logger.info(f'Resuming from the checkpoints in {self.path}')
+
+    def get(self, product_id: str) -> Optional[Checkpoint]:
+        with self._lock:
+            return self._checkpoints.get(product_id)
+
+    def commit(self, product_id: str, last_ms: int, last_trade_id: int) -> None:
+        """
+        Moves the checkpoint of product_id to the trade last_trade_id, once every trade up to it is delivered
+        """
+        with self._lock:
+            if product_id in self._failed_products:
+                return
+            current = self._checkpoints.get(product_id)
+            if current is not None and last_trade_id <= current[1]:
+                return
+            self._checkpoints[product_id] = (last_ms, last_trade_id)
+            self._dirty = True
+
+    def mark_failed(self, product_id: str) -> None:
+        """
+        A trade of product_id was not delivered: stop advancing its checkpoint, so the next run fetches it again
+        """
+        with self._lock:
+            if product_id not in self._failed_products:
+                logger.error(f'Delivery failed for {product_id}, its checkpoint stays where it is')
+            self._failed_products.add(product_id)
+
+    def save(self, force: Optional[bool] = False) -> None:
+        """
+        Writes the checkpoints atomically, at most every save_every_sec unless forced
+        """
+        if not self._dirty or (not force and time.monotonic() - self._last_saved_at < self.save_every_sec):
+            return
+
+        with self._lock:
+            state = {product_id: list(checkpoint) for product_id, checkpoint in self._checkpoints.items()}
+            self._dirty = False
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+        self._last_saved_at = time.monotonic()
@@ -0,0 +1,118 @@
+# A pooled keep-alive HTTP session shared by every Kraken REST endpoint
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class KrakenHttpSession:
+    """
+    Thin wrapper around a requests.Session with a connection pool, so consecutive pages re-use the
+    same TCP+TLS connection instead of paying for a fresh handshake every time.
+
+    - keep-alive connections, pooled per host (pool_maxsize should be >= number of threads)
+    - gzip/deflate compression negotiated through the Accept-Encoding header
+    - (connect, read) timeouts, so a hung socket raises instead of stalling the producer
+    - retries with exponential, jittered backoff on connection errors, read errors and 429/5xx answers
+
+    NOTE: requests.Session is safe to share between threads for plain GET requests like ours, the
+    connection pool of the adapter is what hands out one connection per thread.
+    """
+
+    BASE_URL = 'https://api.kraken.com/0/public'
+
+    def __init__(
+        self,
+        connect_timeout_sec: Optional[float] = 3.05,
+        read_timeout_sec: Optional[float] = 10,
+        max_retries: Optional[int] = 5,
+        backoff_factor: Optional[float] = 0.5,
+        backoff_jitter: Optional[float] = 0.5,
+        pool_maxsize: Optional[int] = 32,
+    ) -> None:
+        """
+        Args:
+            connect_timeout_sec (float): Seconds to wait for the TCP/TLS connection to be established
+            read_timeout_sec (float): Seconds to wait between bytes of the response
+            max_retries (int): Number of retries on transient errors before giving up
+            backoff_factor (float): Base of the exponential backoff between retries, in seconds
+            backoff_jitter (float): Random number of seconds, up to this value, added to every backoff
+            pool_maxsize (int): Maximum number of keep-alive connections kept per host
+
+        Returns:
+            None
+        """
+        self.timeout = (connect_timeout_sec, read_timeout_sec)
+
+        retries = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=['GET'],
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=retries)
+
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+    def get_json(self, url: str, params: Optional[Dict[str, Any]] = None) -> Dict:
+        """
+        GET the given url (absolute, or relative to BASE_URL) and parse the JSON body.
+
+        Args:
+            url (str): e.g. 'https://api.kraken.com/0/public/Trades?pair=BTC/USD' or 'Trades'
+            params (Optional(Dict)): Query string parameters
+
+        Returns:
+            Dict: The parsed JSON response
+        """
+        if not url.startswith('http'):
+            url = f'{self.BASE_URL}/{url}'
+
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self) -> None:
+        """
+        Closes every pooled connection
+        """
+        self.session.close()
+
+
+# One session per process, shared by every KrakenRestAPI instance (and any future Kraken endpoint)
+_shared_session: Optional[KrakenHttpSession] = None
+_shared_session_lock = threading.Lock()
+
+
+def get_kraken_session(**kwargs) -> KrakenHttpSession:
+    """
+    Returns the process wide KrakenHttpSession, creating it with the given kwargs on the first call.
+
+    Args:
+        **kwargs: Passed to KrakenHttpSession the first time only
+
+    Returns:
+        KrakenHttpSession: The shared session
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = KrakenHttpSession(**kwargs)
+            logger.debug(f'Created the shared Kraken HTTP session with {kwargs}')
+        elif kwargs:
+            logger.debug('Kraken HTTP session already exists, ignoring the new settings')
+        return _shared_session
@@ -0,0 +1,236 @@
+# Live trades from the websocket, with the gaps (restarts, reconnects) filled from the REST API
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from loguru import logger
+
+from src.kraken_api.checkpoints import BackfillCheckpoints
+from src.kraken_api.rate_limiter import KrakenRateLimiter
+from src.kraken_api.restapi import KrakenRestAPI, ts_to_date
+from src.kraken_api.trade_batch import TradeBatch
+
+
+class KrakenHybridTradeAPI:
+    """
+    Hybrid of the REST and websocket APIs, so a restarted (or reconnected) live producer doesn't drop the
+    trades of its outage.
+
+    The last delivered trade of every product is kept in a small JSON state file, a BackfillCheckpoints advanced
+    from the delivery callbacks of the producer (see main.py), so a trade that never reached Kafka is never
+    recorded as produced. On start, the products are backfilled with KrakenRestAPI from their last delivered
+    trade up to now, and whenever a websocket connection comes back, from their last produced one. Then the
+    producer carries on with the websocket trades. The websocket keeps
+    reading (and buffering) in the background during the backfill, so both sides overlap at the seam. Both APIs
+    give the same trade_id to a trade, so the overlap is dropped exactly:
+        - websocket trades whose trade_id was backfilled
+        - trades whose trade_id is at or below the last produced one of their product
+
+    NOTE: the live API must be started (subscribed) before the backfill, see main.py, otherwise the trades
+    between the end of the backfill and the subscription would be lost instead.
+    """
+
+    STATE_FILE = 'last_produced_ms.json'
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        live_api,
+        checkpoints: Optional[BackfillCheckpoints] = None,
+        max_gap_days: Optional[float] = 1,
+        rate_limiter: Optional[KrakenRateLimiter] = None,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The currency pairs
+            live_api: KrakenAsyncWebsocketTradeAPI or KrakenWebsocketTradeAPI, already subscribed
+            checkpoints (Optional(BackfillCheckpoints)): The last delivered trades, in the STATE_FILE of the state
+                directory. Committed and saved by the producer, no gap backfill on start without it
+            max_gap_days (float): Gaps longer than this are only backfilled over their last max_gap_days
+            rate_limiter (Optional(KrakenRateLimiter)): Rate limiter for the gap backfills
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.live_api = live_api
+        self.max_gap_ms = int(max_gap_days * 24 * 60 * 60 * 1000)
+        self.rate_limiter = rate_limiter or KrakenRateLimiter()
+
+        # NOTE: the last trades handed to the producer, in memory only. They drop the duplicates within this run,
+        # what survives a restart is the delivered state in the checkpoints
+        self.last_produced_ms: Dict[str, int] = {}
+        self.last_produced_trade_id: Dict[str, int] = {}
+        for product_id in product_ids:
+            checkpoint = checkpoints.get(product_id) if checkpoints is not None else None
+            if checkpoint is not None:
+                self.last_produced_ms[product_id], self.last_produced_trade_id[product_id] = checkpoint
+        if self.last_produced_ms:
+            logger.info(f'Last delivered trades: { {p: ts_to_date(ts) for p, ts in self.last_produced_ms.items()} }')
+
+        # Every product with a known last delivered trade has a gap since then, to be filled first
+        self._gap_products: Set[str] = set(self.last_produced_ms)
+
+        # The running backfill, of _backfill_products, and the live trades held back until it is done
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='kraken-backfill')
+        self._backfill: Optional[Future] = None
+        self._backfill_products: Set[str] = set()
+        self._held_trades: List[TradeBatch] = []
+        self._closing = threading.Event()
+
+        # Stats
+        self.n_gap_backfills = 0
+        self.n_backfilled_trades = 0
+        self.n_seam_duplicates = 0
+
+    # %% Trades
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next websocket trades, and the REST backfill of the gap products once it is done.
+
+        Returns:
+            TradeBatch: The trades, sorted by timestamp, without the ones already produced
+        """
+        live_trades = self.live_api.get_trades()
+
+        # Products whose websocket connection dropped and came back have a gap since their last trade
+        for product_id in self.live_api.pop_reconnected_products():
+            if product_id in self.last_produced_ms:
+                self._gap_products.add(product_id)
+
+        if self._backfill is None and not self._gap_products and not self._held_trades:
+            return self._drop_produced_trades(live_trades)
+
+        # NOTE: the trades of a gap product must not be produced before its gap, they would move its last produced
+        # trade past the gap
+        trades, held_trades = self._split_held_trades(live_trades, self._backfill_products | self._gap_products)
+        self._held_trades.append(held_trades)
+
+        if self._backfill is not None and self._backfill.done():
+            backfilled_trades = self._backfill.result()
+            self._backfill, self._backfill_products = None, set()
+
+            # Only the gaps found during this backfill are still held, behind the next one
+            released_trades, held_trades = self._split_held_trades(TradeBatch.concat(self._held_trades), self._gap_products)
+            self._held_trades = [held_trades] if len(held_trades) else []
+            released_trades = self._drop_backfilled_trades(released_trades, backfilled_trades)
+            trades = TradeBatch.concat([trades, backfilled_trades, released_trades])
+            trades = trades[np.argsort(trades.timestamp_ms, kind='stable')]
+
+        # One backfill at a time, the gaps found meanwhile wait for the next one
+        if self._backfill is None and self._gap_products:
+            self._backfill_products, self._gap_products = self._gap_products, set()
+            from_ms = {product_id: self.last_produced_ms[product_id] for product_id in self._backfill_products}
+            self._backfill = self._executor.submit(self._backfill_gaps, from_ms)
+
+        return self._drop_produced_trades(trades)
+
+    @staticmethod
+    def _split_held_trades(trades: TradeBatch, held_products: Set[str]) -> Tuple[TradeBatch, TradeBatch]:
+        """
+        Splits the trades into the ones to produce and the ones of held_products, to hold back
+        """
+        if len(trades) == 0 or not held_products:
+            return trades, TradeBatch.empty()
+
+        is_held = np.isin(trades.product_id, list(held_products))
+        return trades[~is_held], trades[is_held]
+
+    def _backfill_gaps(self, from_ms: Dict[str, int]) -> TradeBatch:
+        """
+        Fetches, from the REST API, the trades of every gap product from its last produced timestamp up to now.
+        Runs on the worker thread.
+
+        Args:
+            from_ms (Dict[str, int]): The last produced timestamp of every product to backfill
+
+        Returns:
+            TradeBatch: The trades of every product, one product after the other
+        """
+        now_ms = int(time.time() * 1000)
+        batches = []
+        for product_id in sorted(from_ms):
+            product_from_ms = from_ms[product_id]
+            if now_ms - product_from_ms > self.max_gap_ms:
+                logger.warning(
+                    f'{product_id}: gap since {ts_to_date(product_from_ms)} is longer than the max gap, '
+                    f'only backfilling from {ts_to_date(now_ms - self.max_gap_ms)}'
+                )
+                product_from_ms = now_ms - self.max_gap_ms
+
+            logger.info(f'{product_id}: backfilling the gap {ts_to_date(product_from_ms)} -> {ts_to_date(now_ms)} from the REST API')
+            rest_api = KrakenRestAPI(
+                product_id=product_id,
+                last_n_days=1,
+                rate_limiter=self.rate_limiter,
+                from_ms=product_from_ms,
+                to_ms=now_ms,
+            )
+            product_batches = []
+            while not rest_api.is_done() and not self._closing.is_set():
+                product_batches.append(rest_api.get_trades())
+            product_trades = TradeBatch.concat(product_batches)
+
+            logger.info(f'{product_id}: {len(product_trades)} trades backfilled in {rest_api.n_requests} requests')
+            batches.append(product_trades)
+            self.n_gap_backfills += 1
+            self.n_backfilled_trades += len(product_trades)
+
+        return TradeBatch.concat(batches)
+
+    def _drop_backfilled_trades(self, live_trades: TradeBatch, backfilled_trades: TradeBatch) -> TradeBatch:
+        """
+        Drops the websocket trades that the backfill already fetched, i.e. the overlap at the seam
+        """
+        if len(live_trades) == 0 or len(backfilled_trades) == 0:
+            return live_trades
+
+        backfilled = set(zip(backfilled_trades.product_id.tolist(), backfilled_trades.trade_id.tolist()))
+        keep = np.array([
+            key not in backfilled
+            for key in zip(live_trades.product_id.tolist(), live_trades.trade_id.tolist())
+        ], dtype=bool)
+        self.n_seam_duplicates += int((~keep).sum())
+        return live_trades[keep]
+
+    def _drop_produced_trades(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Drops the trades at or below the last produced trade_id of their product, and moves the last produced
+        trade of every product forward. In memory only, the state file follows the deliveries.
+        """
+        if len(trades) == 0:
+            return trades
+
+        keep = np.ones(len(trades), dtype=bool)
+        for product_id in np.unique(trades.product_id):
+            is_product = trades.product_id == product_id
+            last_trade_id = self.last_produced_trade_id.get(product_id)
+            if last_trade_id is not None:
+                keep &= ~is_product | (trades.trade_id > last_trade_id)
+
+            kept = np.flatnonzero(is_product & keep)
+            if len(kept):
+                last = kept[np.argmax(trades.trade_id[kept])]
+                self.last_produced_ms[product_id] = int(trades.timestamp_ms[last])
+                self.last_produced_trade_id[product_id] = int(trades.trade_id[last])
+
+        self.n_seam_duplicates += int((~keep).sum())
+        return trades[keep]
+
+    def is_done(self) -> bool:
+        return False
+
+    def log_stats(self) -> None:
+        logger.info(
+            f'Hybrid: {self.n_gap_backfills} gap backfills, {self.n_backfilled_trades} trades backfilled, '
+            f'{self.n_seam_duplicates} duplicates dropped at the seams'
+        )
+
+    def close(self) -> None:
+        # NOTE: the running backfill stops after its current request
+        self._closing.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        if hasattr(self.live_api, 'close'):
+            self.live_api.close()
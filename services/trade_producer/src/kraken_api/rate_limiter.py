@@ -0,0 +1,111 @@
+# A shared rate limiter for every thread/product that talks to the Kraken REST API
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+
+class KrakenRateLimiter:
+    """
+    Token bucket that models Kraken's REST API call counter.
+
+    Kraken keeps a counter per IP/API key. Every call adds `cost` to the counter and the
+    counter decays at a fixed number of points per second. Once the counter goes above
+    the maximum, Kraken answers with `EGeneral:Too many requests`.
+    Docs: https://docs.kraken.com/api/docs/guides/spot-rest-ratelimits
+
+    One instance is shared by every KrakenRestAPI instance, so adding more threads (or
+    more product_ids) never increases the total request rate, it only keeps the budget busy.
+
+    The decay rate is adaptive (AIMD):
+        - on a rate limit error the counter is maxed out and the decay rate is halved
+        - on every successful call the decay rate creeps back up towards its nominal value
+    """
+
+    def __init__(
+        self,
+        max_counter: Optional[float] = 15,
+        decay_per_sec: Optional[float] = 1.0,
+        min_decay_per_sec: Optional[float] = 0.1,
+    ) -> None:
+        """
+        Args:
+            max_counter (float): Maximum value of the call counter before Kraken rate limits us
+            decay_per_sec (float): Nominal number of counter points that decay every second
+            min_decay_per_sec (float): Floor for the decay rate after repeated rate limit errors
+
+        Returns:
+            None
+        """
+        self.max_counter = max_counter
+        self.nominal_decay_per_sec = decay_per_sec
+        self.min_decay_per_sec = min_decay_per_sec
+        self.decay_per_sec = decay_per_sec
+
+        self._counter = 0.0
+        self._last_update = time.monotonic()
+        self._lock = threading.Lock()
+
+        # Counters exposed for the stats report and for the adaptive concurrency of KrakenRestAPIMultipleProducts
+        self.n_calls = 0
+        self.n_rate_limited = 0
+        self.total_wait_sec = 0.0
+
+    def _decay(self) -> None:
+        """
+        Decays the call counter by the time elapsed since the last update. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        self._counter = max(0.0, self._counter - (now - self._last_update) * self.decay_per_sec)
+        self._last_update = now
+
+    def acquire(self, cost: Optional[float] = 1) -> float:
+        """
+        Blocks until a call of the given cost fits under the counter limit, then books it.
+
+        Args:
+            cost (float): How many counter points the call costs. Public/Trades costs 1.
+
+        Returns:
+            float: The number of seconds the caller had to wait
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._decay()
+                if self._counter + cost <= self.max_counter:
+                    self._counter += cost
+                    self.n_calls += 1
+                    self.total_wait_sec += waited
+                    return waited
+                wait_sec = (self._counter + cost - self.max_counter) / self.decay_per_sec
+
+            # NOTE: sleep outside of the lock so the other threads can still check the counter
+            time.sleep(wait_sec)
+            waited += wait_sec
+
+    def on_success(self) -> None:
+        """
+        Additive increase: move the decay rate back towards its nominal value after a successful call.
+        """
+        with self._lock:
+            self.decay_per_sec = min(
+                self.nominal_decay_per_sec,
+                self.decay_per_sec + 0.05 * self.nominal_decay_per_sec,
+            )
+
+    def on_rate_limited(self) -> None:
+        """
+        Multiplicative decrease: Kraken told us to slow down, so max out the counter (every thread
+        now has to wait for it to decay) and halve the decay rate.
+        """
+        with self._lock:
+            self._decay()
+            self._counter = self.max_counter
+            self.decay_per_sec = max(self.min_decay_per_sec, self.decay_per_sec / 2)
+            self.n_rate_limited += 1
+
+        logger.warning(
+            f'Kraken rate limit hit ({self.n_rate_limited} so far). Decay rate lowered to {self.decay_per_sec:.2f} calls/sec'
+        )
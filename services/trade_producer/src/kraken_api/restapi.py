@@ -1,22 +1,27 @@
 # A seperate file to create a restapi class for historical backfilling of the model instead of the live trade via websocket
-import json
 import requests
-from pathlib import Path
-from typing import List,Dict,Tuple, Optional
+from typing import List,Dict,Tuple, Optional, Union
 from loguru import logger
 
-from time import sleep
+from time import monotonic
 
 from datetime import datetime,timezone
 
-from src.kraken_api.trade import Trade
+from src.kraken_api.trade_batch import TradeBatch
 from concurrent.futures import ThreadPoolExecutor
 
-import pandas as pd #used by caching class to store trades in df
+from src.kraken_api.rate_limiter import KrakenRateLimiter
+from src.kraken_api.http_session import KrakenHttpSession, get_kraken_session
+from src.kraken_api.trade_store import TradeStore, end_of_day_ms
+from src.kraken_api.checkpoints import BackfillCheckpoints, Checkpoint
 
 class KrakenRestAPIMultipleProducts:
     """
         For each of the elements of the product_ids aka currency pair list, this class deploys an instance of the KrakenRestAPI class via paralellism.
+
+        All the instances share one KrakenRateLimiter, so the pairs are fetched concurrently while the total request
+        rate stays within Kraken's call counter budget. The number of pairs fetched per round adapts: it is halved when
+        Kraken rate limits us and grows back by one, up to n_threads, after every clean round.
     """
     
     def __init__(self, 
@@ -24,17 +29,51 @@ class KrakenRestAPIMultipleProducts:
                  last_n_days: int,
                  n_threads: Optional[int] = 1 ,
                  cache_dir: Optional[str] = None,
+                 rate_limiter: Optional[KrakenRateLimiter] = None,
+                 n_shards_per_product: Optional[int] = 1,
+                 checkpoints: Optional[BackfillCheckpoints] = None,
+                 log_progress_every_sec: Optional[float] = 30,
                  ) -> None:
         self.n_threads = n_threads
+        self.log_progress_every_sec = log_progress_every_sec
+        self._last_progress_log = monotonic()
+
+        # One rate limiter shared by every pair, as Kraken counts the calls per IP and not per pair
+        self.rate_limiter = rate_limiter or KrakenRateLimiter()
 
         #Instanitate a KrakenRestApi class for each element in product_ids 
         self.product_ids = product_ids
-        self.kraken_apis = [
-            KrakenRestAPI(product_id=product_id, last_n_days=last_n_days) for product_id in product_ids
-            ]
+        # One local trade store for every pair
+        trade_store = TradeStore(cache_dir) if cache_dir is not None else None
+
+        # With n_shards_per_product > 1, each pair's time window is itself split and fetched in parallel
+        if n_shards_per_product > 1:
+            self.kraken_apis = [
+                KrakenRestAPIShardedProduct(product_id=product_id,
+                                            last_n_days=last_n_days,
+                                            n_shards=n_shards_per_product,
+                                            rate_limiter=self.rate_limiter,
+                                            trade_store=trade_store,
+                                            checkpoint=checkpoints.get(product_id) if checkpoints else None,
+                                            ) for product_id in product_ids
+                ]
+        else:
+            self.kraken_apis = [
+                KrakenRestAPI(product_id=product_id, 
+                              last_n_days=last_n_days,
+                              rate_limiter=self.rate_limiter,
+                              trade_store=trade_store,
+                              checkpoint=checkpoints.get(product_id) if checkpoints else None,
+                              ) for product_id in product_ids
+                ]
+
+        # NOTE: The pool is created once and reused by every get_trades() call, instead of one pool per call
+        self._executor = ThreadPoolExecutor(max_workers=n_threads) if n_threads > 1 else None
+        self._concurrency = n_threads
+        self._next_api = 0 # round robin pointer, so every pair progresses even when concurrency < number of pairs
         
 
-    def get_trades(self) -> List[Trade]: 
+    def get_trades(self) -> TradeBatch: 
         """
         Bring back the collection of trades in a dictionary containing each of the currency pair object classes
         that take after the KrakenRestAPI class.
@@ -43,48 +82,56 @@ class KrakenRestAPIMultipleProducts:
             None
 
         Returns:
-            List[Trade]: A list of dicts  where each dict has the currency pair, as initialised by the dictates of the self.product_ids.
+            TradeBatch: The trades of every currency pair, as initialised by the dictates of the self.product_ids. Use .to_trades() for a List[Trade]
         """
 
         # For sequential calls and trade generation 
-        if self.n_threads == 1:
+        if self._executor is None:
             trades = []
             for kraken_api in self.kraken_apis:
                 if kraken_api.is_done():
                     continue
                 else:
-                    trades.extend(kraken_api.get_trades())
-        
+                    trades.append(kraken_api.get_trades())
+            return TradeBatch.concat(trades)
         
         #For concurrent(parlellish) API calls using multiple product_ids
-        else:
-            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
-                trades = list(executor.map(self.get_trades_for_one_pairclass, self.kraken_apis))
+        pending_apis = [kraken_api for kraken_api in self.kraken_apis if not kraken_api.is_done()]
+        if not pending_apis:
+            return TradeBatch.empty()
+
+        # Pick the next `self._concurrency` pairs, round robin
+        start = self._next_api % len(pending_apis)
+        round_apis = (pending_apis[start:] + pending_apis[:start])[:self._concurrency]
+        self._next_api = start + len(round_apis)
+
+        n_rate_limited_before = self.rate_limiter.n_rate_limited
+        trades = list(self._executor.map(self.get_trades_for_one_pairclass, round_apis))
                 
-                # Flatten the list of lists into a single list
-                trades = [trade for sublist in trades for trade in sublist]
-     
-     # Add back in if the concurrent block is to be removed
-        # for kraken_api in self.kraken_apis:
-        #     # this is_done() is quite useful don't omit
-        #     if kraken_api.is_done():
-        #         continue
-        #     trades.extend(kraken_api.get_trades())
+        # Flatten the list of batches into a single batch
+        trades = TradeBatch.concat(trades)
+
+        # Adapt the number of pairs in flight to what Kraken lets us do
+        if self.rate_limiter.n_rate_limited > n_rate_limited_before:
+            self._concurrency = max(1, self._concurrency // 2)
+            logger.info(f'Rate limited, lowering REST concurrency to {self._concurrency}')
+        elif self._concurrency < self.n_threads:
+            self._concurrency += 1
         
         return trades
     
-    def get_trades_for_one_pairclass(self, kraken_api: 'KrakenRestAPI') -> List[Dict]:
+    def get_trades_for_one_pairclass(self, kraken_api: Union['KrakenRestAPI', 'KrakenRestAPIShardedProduct']) -> TradeBatch:
         """
         The single most critical and indentifiable function, that is to be executed in each paralel thread to get trades for the self. product_id assigned to the thread 
         
-        Invokes the get_trades() method for each class returning trades in a List[Dict] until is_done is flipped from false to true.
+        Invokes the get_trades() method for each class returning trades in a TradeBatch until is_done is flipped from false to true.
         
         Returns:
-            List[Dict]: List of trades from one Kraken API instance.
+            TradeBatch: Trades from one Kraken API instance.
         """
         if not kraken_api.is_done():
             return kraken_api.get_trades()
-        return []
+        return TradeBatch.empty()
 
     def is_done(self) -> bool:
         """
@@ -93,14 +140,179 @@ class KrakenRestAPIMultipleProducts:
         Returns:
             bool: True if all instances are done, False otherwise.
         """
-        # for kraken_api in self.kraken_apis:
-        #     if not kraken_api.is_done():
-        #         return False
-
-        # return True
-        
         return all(kraken_api.is_done() for kraken_api in self.kraken_apis)
 
+    def get_stats(self) -> List[Dict]:
+        """
+        Per pair throughput of the backfill so far.
+
+        Returns:
+            List[Dict]: One dict per product_id with the requests/sec and trades/sec
+        """
+        return [kraken_api.get_stats() for kraken_api in self.kraken_apis]
+
+    def log_stats(self) -> None:
+        """
+        Logs the per pair throughput and the state of the shared rate limiter
+        """
+        for stats in self.get_stats():
+            logger.info(
+                f"{stats['product_id']}: {stats['n_requests']} requests ({stats['requests_per_sec']:.2f}/sec), "
+                f"{stats['n_trades']} trades ({stats['trades_per_sec']:.1f}/sec), "
+                f"{stats['n_duplicates']} duplicates dropped by trade_id"
+            )
+        logger.info(
+            f'Rate limiter: {self.rate_limiter.n_calls} calls, {self.rate_limiter.n_rate_limited} rate limited, '
+            f'{self.rate_limiter.total_wait_sec:.1f} sec spent waiting, concurrency={self._concurrency}'
+        )
+
+    def log_progress(self, force: Optional[bool] = False) -> None:
+        """
+        Logs how far into its window every pair is and the estimated time left, at most every log_progress_every_sec.
+        The pairs are fetched concurrently, so the backfill ends with the slowest pair.
+        """
+        if not force and monotonic() - self._last_progress_log < self.log_progress_every_sec:
+            return
+        self._last_progress_log = monotonic()
+
+        etas = []
+        for stats in self.get_stats():
+            etas.append(stats['eta_sec'])
+            logger.info(
+                f"{stats['product_id']}: {100 * stats['progress']:.1f}% of the window, "
+                f"at {ts_to_date(stats['cursor_ms'])}, ETA {format_duration(stats['eta_sec'])}"
+            )
+        logger.info(f'Backfill ETA: {format_duration(max(etas, default=0.0))}')
+
+    def close(self) -> None:
+        """
+        Shuts down the thread pool once the backfill is over
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+class KrakenRestAPIShardedProduct:
+    """
+        Splits the [from_ms, to_ms] window of a single product_id into n_shards time shards and walks each of them
+        with its own KrakenRestAPI cursor, concurrently.
+
+        Each shard stops at the start of the next one, so the shards never overlap, and the trades are handed back
+        in timestamp order: the trades of a shard are only released once every earlier shard is done. Later shards
+        are buffered in memory meanwhile, up to max_buffered_trades each.
+    """
+
+    def __init__(self,
+                 product_id: str,
+                 last_n_days: int,
+                 n_shards: int,
+                 cache_dir: Optional[str] = None,
+                 rate_limiter: Optional[KrakenRateLimiter] = None,
+                 max_buffered_trades: Optional[int] = 1_000_000,
+                 trade_store: Optional[TradeStore] = None,
+                 checkpoint: Optional[Checkpoint] = None,
+                 ) -> None:
+        """
+        Args:
+            product_id (str): The currency pair to backfill
+            last_n_days (int): The total number of days for which you want the trades
+            n_shards (int): Number of time shards fetched in parallel
+            cache_dir (Optional(str)): Local trade store directory, shared by all the shards
+            rate_limiter (Optional(KrakenRateLimiter)): Rate limiter shared by all the shards (and other pairs)
+            max_buffered_trades (Optional(int)): A shard that is not the head stops fetching once it buffers this many trades
+            trade_store (Optional(TradeStore)): Local trade store shared by all the shards. Takes precedence over cache_dir
+            checkpoint (Optional(Checkpoint)): Last delivered trade of a previous run, only the rest of the window is sharded
+
+        Returns:
+            None
+        """
+        self.product_id = product_id
+        self.max_buffered_trades = max_buffered_trades
+        self.rate_limiter = rate_limiter or KrakenRateLimiter()
+        if trade_store is None and cache_dir is not None:
+            trade_store = TradeStore(cache_dir)
+
+        from_ms, to_ms = KrakenRestAPI._init_from_ms_and_from_ms(last_n_days)
+        # Resuming: split what is left of the window, the first shard starts at the checkpoint
+        if checkpoint is not None and from_ms <= checkpoint[0]:
+            from_ms = min(checkpoint[0], to_ms)
+        shard_starts = [from_ms + (to_ms - from_ms) * i // n_shards for i in range(n_shards)] + [to_ms + 1]
+
+        # to_ms is inclusive in KrakenRestAPI, hence the -1 to stop right before the next shard starts
+        self.shards = [
+            KrakenRestAPI(product_id=product_id,
+                          last_n_days=last_n_days,
+                          rate_limiter=self.rate_limiter,
+                          trade_store=trade_store,
+                          from_ms=shard_starts[i],
+                          to_ms=shard_starts[i + 1] - 1,
+                          checkpoint=checkpoint if i == 0 else None,
+                          ) for i in range(n_shards)
+        ]
+        self._buffers: List[List[TradeBatch]] = [[] for _ in self.shards]
+        self._head = 0 # index of the earliest shard whose trades have not all been released yet
+
+        self._executor = ThreadPoolExecutor(max_workers=n_shards)
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Fetches one page for every shard that still has work (and buffer room), then releases the trades that are
+        next in timestamp order.
+
+        Returns:
+            TradeBatch: Trades of this product_id, in timestamp order across calls
+        """
+        shards_to_fetch = [
+            i for i, shard in enumerate(self.shards[self._head:], start=self._head)
+            if not shard.is_done() and (
+                i == self._head or sum(len(batch) for batch in self._buffers[i]) < self.max_buffered_trades
+            )
+        ]
+        pages = self._executor.map(lambda i: self.shards[i].get_trades(), shards_to_fetch)
+        for i, page in zip(shards_to_fetch, pages):
+            self._buffers[i].append(page)
+
+        # Release the head shard, and every following shard that is complete, in order
+        trades = []
+        while self._head < len(self.shards):
+            trades.extend(self._buffers[self._head])
+            self._buffers[self._head] = []
+            if not self.shards[self._head].is_done():
+                break
+            self._head += 1
+
+        if self.is_done():
+            self._executor.shutdown(wait=False)
+
+        return TradeBatch.concat(trades)
+
+    def is_done(self) -> bool:
+        """
+        Done once every shard has been walked and released
+        """
+        return self._head >= len(self.shards)
+
+    def get_stats(self) -> Dict:
+        """
+        Requests and trades summed over the shards of this product_id
+        """
+        shard_stats = [shard.get_stats() for shard in self.shards]
+        window_ms = sum(stats['to_ms'] - stats['from_ms'] for stats in shard_stats)
+        done_ms = sum(stats['progress'] * (stats['to_ms'] - stats['from_ms']) for stats in shard_stats)
+        return {
+            'product_id': self.product_id,
+            **{
+                key: sum(stats[key] for stats in shard_stats)
+                for key in ('n_requests', 'n_trades', 'n_duplicates', 'requests_per_sec', 'trades_per_sec')
+            },
+            'from_ms': shard_stats[0]['from_ms'],
+            'to_ms': shard_stats[-1]['to_ms'],
+            'cursor_ms': shard_stats[min(self._head, len(self.shards) - 1)]['cursor_ms'],
+            'progress': done_ms / max(window_ms, 1),
+            'eta_sec': max(stats['eta_sec'] for stats in shard_stats), # the shards run in parallel
+        }
+
+
 class KrakenRestAPI:
     
     # Documentation here https://docs.kraken.com/api/docs/rest-api/get-recent-trades
@@ -109,9 +321,9 @@ class KrakenRestAPI:
 
     # URL : "https://api.kraken.com/0/public/Trades" # based URL 
 
-    URL = "https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_seconds}" 
+    URL = "https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_ns}" 
     
-    # NOTE: In kraken, for some reason, the since time is given in seconds (not consitent with milliseconds) AND as seen below, the last timestamp is nanosenconds (also needs to be consistent with milliseconds)
+    # NOTE: `since` accepts the full precision `last` cursor of the previous page, in nanoseconds. The first page starts from from_ms converted to nanoseconds
     # NOTE: # The REST API's GET method, specifically for public/Trades, can accept currency pair symbols in the form of BTC/USD, BTCUSD, and in the ISO 4217-A3 format, such as XBT/USD. 
     # On this page @ https://docs.kraken.com/api/docs/rest-api/get-recent-trades
 
@@ -119,7 +331,14 @@ class KrakenRestAPI:
                 self, 
                 product_id: str,
                 last_n_days: int,
-                cache_dir: Optional[int]=None,
+                cache_dir: Optional[str]=None,
+                rate_limiter: Optional[KrakenRateLimiter]=None,
+                from_ms: Optional[int]=None,
+                to_ms: Optional[int]=None,
+                session: Optional[KrakenHttpSession]=None,
+                trade_store: Optional[TradeStore]=None,
+                store_flush_trades: Optional[int]=50_000,
+                checkpoint: Optional[Checkpoint]=None,
                 )-> None:
         """
         Initialise this class with the possibility of multiple currency pairs which can be specified in the product_ids
@@ -128,7 +347,14 @@ class KrakenRestAPI:
         Args:
         product_ids (str): A single product ID from the set of initialised currency pairs in via the looping over self.product_ids.
         last_n_days (int): The total number of days for which you want the trades. from and to timestamps are calculated within the class
-        cache_dir (Optional(str)): A directory to cache the trade data in compressed parquet format to help speed things when re-running (after breakage or manual stopping) the trade_producer over the same product_ids and time window 
+        cache_dir (Optional(str)): A directory for the local trade store (see TradeStore). Trades already in the store are read from disk and only the missing time ranges are fetched, when re-running (after breakage, manual stopping or on a new day) the trade_producer over overlapping windows
+        rate_limiter (Optional(KrakenRateLimiter)): Rate limiter shared with the other pairs. A private one is created if not given
+        from_ms (Optional(int)): Overrides the start of the window computed from last_n_days, e.g. for a time shard
+        to_ms (Optional(int)): Overrides the (inclusive) end of the window computed from last_n_days, e.g. for a time shard
+        session (Optional(KrakenHttpSession)): Pooled HTTP session. Defaults to the process wide shared session
+        trade_store (Optional(TradeStore)): Local trade store shared with other pairs/shards. Takes precedence over cache_dir
+        store_flush_trades (Optional(int)): Fetched trades are written to the store in chunks of (at least) this many trades
+        checkpoint (Optional(Checkpoint)): Last trade delivered by a previous run (see BackfillCheckpoints). The cursor resumes from there
         
         Returns:
             none
@@ -138,20 +364,55 @@ class KrakenRestAPI:
 
         self.product_id = product_id
         self.from_ms,self.to_ms = self._init_from_ms_and_from_ms(last_n_days) 
+        if from_ms is not None:
+            self.from_ms = from_ms
+        if to_ms is not None:
+            self.to_ms = to_ms
         
         # The _is_done() variable is initialised as false
         self.last_trade_ms = self.from_ms 
 
+        # Highest trade_id handed out so far: trades at or below it are repeats (page overlaps, store reads)
+        self._last_trade_id = -1
+
+        # Resume after the last trade a previous run got delivered, if it falls in this window
+        if checkpoint is not None and self.from_ms <= checkpoint[0]:
+            self.last_trade_ms = min(checkpoint[0], self.to_ms)
+            self._last_trade_id = checkpoint[1]
+            logger.info(f'Resuming {self.product_id} from its checkpoint at {ts_to_date(self.last_trade_ms)}')
+        self._resumed_from_ms = self.last_trade_ms
+
+        # Kraken's pagination cursor, the `last` of the previous page, in nanoseconds. It starts a nanosecond before
+        # last_trade_ms, the trades at that millisecond that were already handed out are dropped by trade_id
+        self._cursor_ns = self.last_trade_ms * 1_000_000 - 1
+
         self._is_done = False # to be flipped and flopped
         
         logger.info(f"Initialized KrakenRestAPI with product_ids: {self.product_id}, from_ms: {self.from_ms}, to_ms: {self.to_ms}")
         logger.debug(f'Initializing KrakenRestAPI: The furthest point in time from_ms={ts_to_date(self.from_ms)}, towards to_ms={ts_to_date(self.to_ms)}')
         
         
-        self.use_cache = False
-        if cache_dir is not None:
-            self.cache = CachedTradeData(cache_dir)
-            self.use_cache = True
+        if trade_store is None and cache_dir is not None:
+            trade_store = TradeStore(cache_dir)
+        self.trade_store = trade_store
+        self.store_flush_trades = store_flush_trades
+
+        # Fetched trades waiting to be written to the store, and the start of the range they cover
+        self._pending_trades: List[TradeBatch] = []
+        self._n_pending_trades = 0
+        self._pending_from_ms = self.last_trade_ms
+
+        # NOTE: replaces the hard-coded sleep(1)/sleep(30) throttling
+        self.rate_limiter = rate_limiter or KrakenRateLimiter()
+
+        # Keep-alive connection pool, shared with every other pair/shard by default
+        self.session = session or get_kraken_session()
+
+        # Throughput stats for this pair
+        self.n_requests = 0
+        self.n_trades = 0
+        self.n_duplicates = 0 # trades received again (page overlaps) and dropped by trade_id
+        self._started_at = monotonic()
 
     # %% Compute the from_ms and to_ms
     @staticmethod
@@ -177,13 +438,13 @@ class KrakenRestAPI:
 
     
     # %%
-    def get_trades(self)-> List[Trade]:
+    def get_trades(self)-> TradeBatch:
         """
         #NOTE: max 1000 trades can be gotten for each currency per api request
         
         This method fetches trades, as trade objects, for a single product_id and....
 
-        1. Caches the trades into compressed parquet to avoid repeat requests when re-running over the same timewindow in case of errors (or manually stopping)
+        1. Reads the trades from the local trade store when it already covers the cursor, and stores freshly fetched ones, to avoid repeat requests over overlapping time windows
         2. Handle errors in case restapi chucks a rate limiting thing
         3. Filter the trades within a specific time window (bounded by from_ms and to_ms).
 
@@ -191,94 +452,96 @@ class KrakenRestAPI:
             None
 
         Returns:
-            List[Trade] : A list of Trade objects, each dict object is of a trade containing info like : {'product_id': 'BTC/EUR', 'price': 54255.9, 'volume': 0.00189445, 'timestamp': '2024-08-18T16:08:24.768249Z'}
+            TradeBatch : The trades as columns (product_id, price, volume, timestamp_ms, trade_id). .to_trades() gives the List[Trade] view, each trade containing info like : {'product_id': 'BTC/EUR', 'price': 54255.9, 'timestamp_ms': 1723997304768, 'volume': 0.00189445, 'trade_id': 71256321}
         
         """
          
         
         # Step 1 - The URL constructor
-        url = "https://api.kraken.com/0/public/Trades"
-
-        payload = {}
-        headers = {'Accept': 'application/json'}
-
-        # NOTE: from_ms needs to be consistent in seconds units that is used by kraken URL for GET
-
-        #since_time_in_seconds = self.last_trade_ms // 1000 # convert the earliest timsetamp into seconds (last_trade_ms, derived from self.from_ms upon initialisation)
-        
-        since_ns = self.last_trade_ms * 1_000_000
-
-        since_time_in_seconds = self.last_trade_ms // 1000 # convert the earliest timsetamp into seconds (last_trade_ms, derived from self.from_ms upon initialisation)
-        url = self.URL.format(product_id=self.product_id, since_seconds=since_time_in_seconds)
+        # NOTE: the cursor is Kraken's own nanosecond `last`, so the next page starts right after the previous one
+        # instead of re-downloading the trades of the cursor's second
+        url = self.URL.format(product_id=self.product_id, since_ns=self._cursor_ns)
         logger.debug(f"{url=}")
 
-        # Step 2 - Check if the url hasn't already been cached with data to avoid redundant calls to api
-        if self.use_cache and self.cache.has(url):
-            trades = self.cache.read(url)
-            # since_ns = self.last_trade_ms *1_000_000
-            logger.debug(f"Loaded a  number of trades that were cached. A total of {len(trades)} trades retrieved for {self.product_id}, since={ns_to_date(since_ns)}")
-
-        # Step 3 - If no cache, then proceed with the url and GET request to the servers
-        else:
-            response = requests.request("GET", url, headers=headers, data=payload) 
-
-            # NOTE The data returns a dict with two keys error and results which contains a list of list containing trade results
-            # NOTE Array of trade entries [<price>, <volume>, <time>, <buy/sell>, <market/limit>, <miscellaneous>, <trade_id>]
+        # Step 2 - If the cursor is inside a time range the local trade store already covers, read it from disk instead of calling the api
+        if self.trade_store is not None:
+            covered_to_ms = self.trade_store.covered_until(self.product_id, self.last_trade_ms)
+            if covered_to_ms is not None:
+                return self._read_from_store(covered_to_ms)
+
+        # Step 3 - Otherwise, proceed with the url and GET request to the servers
+        self.rate_limiter.acquire()
+        self.n_requests += 1
+
+        # NOTE The data returns a dict with two keys error and results which contains a list of list containing trade results
+        # NOTE Array of trade entries [<price>, <volume>, <time>, <buy/sell>, <market/limit>, <miscellaneous>, <trade_id>]
+
+        # GET request through the pooled session, the JSON str is parsed into an interatble dict.
+        # Transient errors are already retried with backoff by the session. If they persist, keep the cursor
+        # where it is and let the caller try again on the next call instead of crashing the producer
+        try:
+            data = self.session.get_json(url)
+        except requests.RequestException as e:
+            logger.error(f'Failed to fetch trades for {self.product_id}: {e}')
+            return TradeBatch.empty()
         
-            # Parse the incoming data from the GET request, which is JSON str, into an interatble dict
-            data = json.loads(response.text)
-            
-            
-            # Error handling incase api is rate-limited
-            if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info('Too many requests. Sleeping for 30 seconds')
-                sleep(30) # Billions must wait in line
-
-            # Generate the trades- NOTE: using a list comprehension trick instead instead of doing 
-            trades = [
-            Trade(
-                    product_id=self.product_id,
-                    price=float(trade[0]),
-                    volume=float(trade[1]),
-                    timestamp_ms=int(trade[2]*1000), # Converting the timestamp (in seconds) to milliseconds
-                )
-
-                for trade in data["result"][self.product_id]
-                
-                ]                
-            
-            # Total trades in batch
-            logger.debug(f"Total amount of trades = {len(trades)}")       
-            # Log the number of trades and the timestamps in the current batch
-            logger.debug(f"Fetched {len(trades)} trades for {self.product_id}, last trade timestamp_ms={trades[-1].timestamp_ms}")
-            
-
-            # Step 4 - Cache them shits
-            if self.use_cache:
-                self.cache.write(url,trades)
-                logger.debug(
-                    f'Cached {self.product_id}, since={ns_to_date(since_ns)}'
-                )
-
-            # Sleep for a moment before next fresh url
-            sleep(1)
-
-        # # NOTE: This is a fix to solve a sitiation where, on occaisons the last trade in a single batch is the same as the first batch, which is throwing it for an infite loop.
-        # In the occaison that last trade and the first trade are the same, 
-        if trades[-1].timestamp_ms == self.last_trade_ms:
-            # If the timestamps are the same, increment the `last_trade_ms` by 1 millisecond to move forward.
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
-
-        # else: 
+        # Error handling incase api is rate-limited
+        if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
+            # slow down the rate at which we are making requests to the Kraken API. The shared rate limiter
+            # makes every thread back off, and the cursor is left untouched so the same page is retried
+            logger.info(f'Too many requests for {self.product_id}. Backing off')
+            self.rate_limiter.on_rate_limited()
+            return TradeBatch.empty()
+
+        self.rate_limiter.on_success()
+
+        # Generate the trades- NOTE: parsed column-wise into a TradeBatch, instead of one pydantic Trade per trade.
+        # The timestamp (in seconds) is converted to milliseconds on the way
+        trades = TradeBatch.from_kraken_rows(self.product_id, data["result"][self.product_id])
+
+        last_ts_in_ns = int(data['result']['last'])
+
+        # Total trades in batch
+        logger.debug(f"Total amount of trades = {len(trades)}")       
+        # Log the number of trades and the timestamps in the current batch
+        logger.debug(f"Fetched {len(trades)} trades for {self.product_id}, last={last_ts_in_ns}")
+
+        # Step 4 - Keep the page for the local trade store. It is written in chunks, see _flush_to_store
+        if self.trade_store is not None:
+            self._pending_trades.append(trades)
+            self._n_pending_trades += len(trades)
+
+        # An empty page means there is nothing after the cursor, so there is nothing left to fetch
+        if len(trades) == 0:
+            logger.debug(f'No more trades for {self.product_id}')
+            self._flush_to_store()
+            self.last_trade_ms = self.to_ms
+            return trades
+
+        page_last_trade_ms = trades.last_timestamp_ms()
+
+        # The page can overlap what was already handed out (the previous page, the store, a checkpoint). Trade ids
+        # increase per pair, so those repeats are dropped exactly by trade_id
+        trades = self._drop_repeated_trades(trades)
+
+        # Nothing new and Kraken's cursor did not move: we caught up with the most recent trade, e.g. for a window
+        # that ends now (gap backfills of the hybrid mode)
+        if len(trades) == 0 and last_ts_in_ns <= self._cursor_ns:
+            logger.debug(f'Caught up with the latest trades for {self.product_id}')
+            self._flush_to_store()
+            self.last_trade_ms = self.to_ms
+            return trades
+
+        # else:
         # NOTE: Otherwise, under normal expected conditions, use the value for timestamp_ms trades[-1].timestamp_ms as `self.last_trade_ms`....
         # But..the last_ts_in_ns = int(data['result']['last']) 
         #    self.last_trade_ms = trades[-1].timestamp_ms
         
         # breakpoint()
 
-        # Apply Filtering
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
+        # Apply Filtering. NOTE: the last page of a window (or time shard) runs past to_ms, those trades belong to the
+        # next shard
+        trades = trades[(trades.timestamp_ms >= self.from_ms) & (trades.timestamp_ms <= self.to_ms)]
         logger.debug(f"Received {len(trades)} trades for {self.product_id}")      
 
         # NOTE: The last timestamp is in nanoseconds given by KrakenAPI.....making a comparision with to_ms (which is in milliseconds), units need to be converted.
@@ -319,83 +582,112 @@ class KrakenRestAPI:
             # "last": "1383581942793000173" <-the same trades[-1].timestamp_ms above, but under key of "last" and in nanoseconds 
             #   }
             # }
-        last_ts_in_ns = int(data['result']['last']) 
-        self.last_trade_ms = last_ts_in_ns // 1_000_000 # convert the kraken's timsetamp, given in nanoseconds, into milliseconds
-
-    
+        # last_ts_in_ns = int(data['result']['last']) is read above, right after the request, and is the next `since`
+        self._cursor_ns = max(self._cursor_ns, last_ts_in_ns)
+        # NOTE: the trade times are floats in seconds, so after rounding the last trade can land 1ms after `last`
+        self.last_trade_ms = max(self.last_trade_ms, last_ts_in_ns // 1_000_000, page_last_trade_ms) # convert the kraken's timsetamp, given in nanoseconds, into milliseconds
+
+        # Write the fetched pages to the local trade store every store_flush_trades trades, and at the end
+        if self._n_pending_trades >= self.store_flush_trades or self.is_done():
+            self._flush_to_store()
     
         logger.debug(f'The total amount of trades recieved for this window of time = {len(trades)} ')
         logger.debug(f'The timestamp of the EARLIEST (SMALLEST EPOCH) trade in this backwards looking window is : {last_ts_in_ns}')
+
+        self.n_trades += len(trades)
     
         return trades
-        
-    # %%
-    def is_done(self) -> bool:       
-        return self.last_trade_ms >= self.to_ms
-        
 
-class CachedTradeData:
-     
-        """
-            Class to handle the caching of trade data fetched from the Kraken REST API.
+    def _read_from_store(self, covered_to_ms: int) -> TradeBatch:
         """
+        Serves the trades from the local trade store, from the cursor up to the end of the covered range, one
+        UTC day at most per call, and moves the cursor past them.
 
-    # Innit bruv a path for cache dir
-        def __init__(self, cache_dir: str) -> None:
-            self.cache_dir = Path(cache_dir)
-
-            if not self.cache_dir.exists():
-                # create the cache directory if it does not exist
-                self.cache_dir.mkdir(parents=True)
-
+        Args:
+            covered_to_ms (int): End of the covered range the cursor is in
 
-        def read(self, url: str) -> List[Trade]:
-            """
-            Reads from the cache the trade data for the given url
-            """
-            file_path = self._get_file_path(url)
+        Returns:
+            TradeBatch: The stored trades, within [from_ms, to_ms]
+        """
+        # Whatever was fetched before reaching the covered range is contiguous with it, so save it first
+        self._flush_to_store()
 
-            if file_path.exists():
-                # read the data from the parquet file
-                
+        read_to_ms = min(covered_to_ms, self.to_ms, end_of_day_ms(self.last_trade_ms))
+        trades = self._drop_repeated_trades(self.trade_store.read(self.product_id, self.last_trade_ms, read_to_ms))
+        logger.debug(f'Loaded {len(trades)} trades for {self.product_id} from the local trade store, up to {ts_to_date(read_to_ms)}')
 
-                data = pd.read_parquet(file_path)
-                # transform the data to a list of Trade objects
-                return [Trade(**trade) for trade in data.to_dict(orient='records')]
+        self.last_trade_ms = read_to_ms + 1
+        self._cursor_ns = self.last_trade_ms * 1_000_000 - 1
+        self._pending_from_ms = self.last_trade_ms
+        self.n_trades += len(trades)
 
-            return []
+        return trades
 
-        def write(self, url: str, trades: List[Trade]) -> None:
-            """
-            Save trades into a compressed parquet file in the cache directory
-            """
-            
-            if not trades:
-                return
+    def _drop_repeated_trades(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Drops the trades that were already handed out, i.e. with a trade_id at or below the last one handed out,
+        and counts them in n_duplicates.
 
-            data = pd.DataFrame([trade.model_dump() for trade in trades])
+        Args:
+            trades (TradeBatch): Trades read from a page or the store
 
-            # write the DataFrame to a parquet file
-            file_path = self._get_file_path(url)
-            data.to_parquet(file_path)
+        Returns:
+            TradeBatch: The trades that were not handed out yet
+        """
+        keep = trades.trade_id > self._last_trade_id
+        self.n_duplicates += int(len(trades) - keep.sum())
+        trades = trades[keep]
 
-        def has(self, url: str) -> bool:
-            """
-            Returns True if the cache has the trade data for the given url, False otherwise.
-            """
-            file_path = self._get_file_path(url)
-            return file_path.exists()
+        if len(trades):
+            self._last_trade_id = int(trades.trade_id.max())
+        return trades
 
-        def _get_file_path(self, url: str) -> str:
-            """
-            Returns the file path where the trade data for the given url is (or will be) stored.
-            """
-            # use the given url to generate a unique file name in a deterministic way
-            import hashlib
+    def _flush_to_store(self) -> None:
+        """
+        Writes the fetched-but-not-stored trades to the local trade store. Every trade before the cursor has been
+        fetched, so the range [start of the pending trades, cursor - 1] is recorded as covered.
+        """
+        if self.trade_store is None or self.last_trade_ms <= self._pending_from_ms:
+            return
+
+        self.trade_store.write(
+            product_id=self.product_id,
+            trades=TradeBatch.concat(self._pending_trades),
+            from_ms=self._pending_from_ms,
+            to_ms=self.last_trade_ms - 1,
+        )
+        self._pending_trades = []
+        self._n_pending_trades = 0
+        self._pending_from_ms = self.last_trade_ms
+        
+    # %%
+    def is_done(self) -> bool:       
+        return self.last_trade_ms >= self.to_ms
 
-            url_hash = hashlib.md5(url.encode()).hexdigest()
-            return self.cache_dir / f'{url_hash}.parquet'
-            # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+    def get_stats(self) -> Dict:
+        """
+        Returns the number of requests and trades fetched so far for this pair, their rate per second, and how far
+        the cursor is into the window with the estimated time left at the current pace
+        """
+        elapsed_sec = max(monotonic() - self._started_at, 1e-9)
+        cursor_ms = min(self.last_trade_ms, self.to_ms)
+        remaining_ms = self.to_ms - cursor_ms
+        # Milliseconds of market time walked per second of wall time, since this run started
+        pace = (cursor_ms - self._resumed_from_ms) / elapsed_sec
+        return {
+            'product_id': self.product_id,
+            'n_requests': self.n_requests,
+            'n_trades': self.n_trades,
+            'n_duplicates': self.n_duplicates,
+            'requests_per_sec': self.n_requests / elapsed_sec,
+            'trades_per_sec': self.n_trades / elapsed_sec,
+            'from_ms': self.from_ms,
+            'to_ms': self.to_ms,
+            'cursor_ms': cursor_ms,
+            'progress': (cursor_ms - self.from_ms) / max(self.to_ms - self.from_ms, 1),
+            'eta_sec': remaining_ms / pace if pace > 0 else (0.0 if remaining_ms == 0 else float('inf')),
+        }
+        
 
 def ts_to_date(ts: int) -> str:
     """
@@ -413,6 +705,17 @@ def ts_to_date(ts: int) -> str:
     )
 
 
+def format_duration(seconds: float) -> str:
+    """
+    Formats a number of seconds like '1h02m03s', for the ETA reports
+    """
+    if seconds == float('inf'):
+        return 'unknown'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+
 def ns_to_date(ns: int) -> str:
     """
     Transform a timestamp in Unix nanoseconds format to a human-readable date
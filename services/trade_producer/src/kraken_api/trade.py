@@ -6,3 +6,5 @@ class Trade(BaseModel):
     price:float
     timestamp_ms: int #converted from timsetamp to timestamp_ms (ms for microsenconds). This is done to standardise the timestamps recieved from websocket and restapi. 
     volume: float
+    trade_id: int # Kraken's trade identifier, increasing per pair. Same ids in the REST and websocket APIs, used to drop repeated trades
+    side: str # 'buy' or 'sell', the taker side. REST 'b'/'s', websocket 'side'
@@ -0,0 +1,142 @@
+# A columnar container for many trades at once, so the hot paths don't build one pydantic object per trade
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.kraken_api.trade import Trade
+
+
+class TradeBatch:
+    """
+    Column oriented batch of trades: one numpy array per field of the Trade model.
+
+    REST parsing, the local trade store and the produce loop all pass TradeBatch objects around, so no
+    per-trade object (pydantic validation, model_dump() dicts) is created until the trades are serialised.
+    `to_trades()` gives back the List[Trade] view for code that still wants it.
+
+    Columns:
+        product_id (np.ndarray[object]): currency pair of each trade
+        price (np.ndarray[float64])
+        volume (np.ndarray[float64])
+        timestamp_ms (np.ndarray[int64]): Unix milliseconds
+        trade_id (np.ndarray[int64]): Kraken's trade id, increasing per pair
+        side (np.ndarray[object]): 'buy' or 'sell', the taker side of each trade
+    """
+
+    COLUMNS = ('product_id', 'price', 'timestamp_ms', 'volume', 'trade_id', 'side') # same order as Trade.model_dump()
+
+    __slots__ = COLUMNS
+
+    def __init__(
+        self,
+        product_id: np.ndarray,
+        price: np.ndarray,
+        volume: np.ndarray,
+        timestamp_ms: np.ndarray,
+        trade_id: np.ndarray,
+        side: np.ndarray,
+    ) -> None:
+        self.product_id = np.asarray(product_id, dtype=object)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.volume = np.asarray(volume, dtype=np.float64)
+        self.timestamp_ms = np.asarray(timestamp_ms, dtype=np.int64)
+        self.trade_id = np.asarray(trade_id, dtype=np.int64)
+        self.side = np.asarray(side, dtype=object)
+
+    # %% Constructors
+    @classmethod
+    def empty(cls) -> 'TradeBatch':
+        return cls(product_id=[], price=[], volume=[], timestamp_ms=[], trade_id=[], side=[])
+
+    @classmethod
+    def from_kraken_rows(cls, product_id: str, rows: Sequence[Sequence[Any]]) -> 'TradeBatch':
+        """
+        Builds a batch from the trade arrays of the REST public/Trades endpoint:
+        [<price>, <volume>, <time>, <buy/sell>, <market/limit>, <miscellaneous>, <trade_id>]
+
+        Args:
+            product_id (str): The currency pair the rows belong to
+            rows (Sequence[Sequence[Any]]): data['result'][product_id]
+
+        Returns:
+            TradeBatch: The trades, time in seconds converted to milliseconds, 'b'/'s' to 'buy'/'sell'
+        """
+        if len(rows) == 0:
+            return cls.empty()
+
+        price, volume, time_sec, side, trade_id = zip(*((row[0], row[1], row[2], row[3], row[6]) for row in rows))
+        return cls(
+            product_id=np.full(len(rows), product_id, dtype=object),
+            price=np.array(price, dtype=np.float64), # prices and volumes come as strings, numpy parses them
+            volume=np.array(volume, dtype=np.float64),
+            timestamp_ms=(np.array(time_sec, dtype=np.float64) * 1000).astype(np.int64),
+            trade_id=np.array(trade_id, dtype=np.int64),
+            side=np.where(np.array(side) == 'b', 'buy', 'sell').astype(object),
+        )
+
+    @classmethod
+    def from_trades(cls, trades: Iterable[Trade]) -> 'TradeBatch':
+        trades = list(trades)
+        return cls(
+            product_id=[trade.product_id for trade in trades],
+            price=[trade.price for trade in trades],
+            volume=[trade.volume for trade in trades],
+            timestamp_ms=[trade.timestamp_ms for trade in trades],
+            trade_id=[trade.trade_id for trade in trades],
+            side=[trade.side for trade in trades],
+        )
+
+    @classmethod
+    def from_dataframe(cls, data: pd.DataFrame) -> 'TradeBatch':
+        return cls(**{column: data[column].to_numpy() for column in cls.COLUMNS})
+
+    @classmethod
+    def concat(cls, batches: Iterable['TradeBatch']) -> 'TradeBatch':
+        batches = [batch for batch in batches if len(batch) > 0]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+        return cls(**{
+            column: np.concatenate([getattr(batch, column) for batch in batches]) for column in cls.COLUMNS
+        })
+
+    # %% Views
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    def __getitem__(self, index) -> 'TradeBatch':
+        """
+        Slices or boolean-masks every column at once, e.g. batch[batch.timestamp_ms <= to_ms]
+        """
+        return TradeBatch(**{column: getattr(self, column)[index] for column in self.COLUMNS})
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({column: getattr(self, column) for column in self.COLUMNS})
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """
+        Plain dicts with the same keys as Trade.model_dump(), ready to be serialised.
+        NOTE: tolist() converts the numpy scalars to python ones in one go, so json can serialise them
+        """
+        return [
+            dict(zip(self.COLUMNS, values))
+            for values in zip(
+                self.product_id.tolist(),
+                self.price.tolist(),
+                self.timestamp_ms.tolist(),
+                self.volume.tolist(),
+                self.trade_id.tolist(),
+                self.side.tolist(),
+            )
+        ]
+
+    def to_trades(self) -> List[Trade]:
+        """
+        Compatibility view as a list of pydantic Trade objects. Slow, keep it out of the hot paths.
+        """
+        return [Trade(**record) for record in self.to_records()]
+
+    def last_timestamp_ms(self) -> Optional[int]:
+        return int(self.timestamp_ms[-1]) if len(self) else None
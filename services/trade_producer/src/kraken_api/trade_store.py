@@ -0,0 +1,195 @@
+# A persistent local store of the trades fetched from the Kraken REST API, partitioned by product and day
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from src.kraken_api.trade_batch import TradeBatch
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class TradeStore:
+    """
+    Local columnar store of historical trades, which replaces the old per-URL parquet cache.
+
+    Layout on disk:
+        <store_dir>/<product>/index_v3.json                       -> covered time ranges, [[start_ms, end_ms], ...]
+        <store_dir>/<product>/<YYYY-MM-DD>/<start_ms>-<end_ms>.parquet -> trades of that day
+
+    The index only records a range once the trades of that range are on disk, so after a crash the index may
+    miss a range that is (partly) on disk, but it never claims a range that is not. Backfills ask for the
+    missing sub-ranges of their window and only fetch those from Kraken, independently of `since`/midnight
+    alignment, so re-running a 90 day backfill on a new day only fetches the new day.
+
+    NOTE: all time ranges are inclusive and in Unix milliseconds.
+    NOTE: v3 files carry the trade_id and side of every trade. Files written before that (index.json/index_v2.json,
+    no trade_id or side column) are ignored, so their ranges are fetched again.
+    """
+
+    INDEX_FILE = 'index_v3.json'
+
+    def __init__(self, store_dir: str) -> None:
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+        # Time shards of the same product write concurrently, so index updates are serialised per product
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def _lock(self, product_id: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(product_id, threading.Lock())
+
+    def _product_dir(self, product_id: str) -> Path:
+        return self.store_dir / product_id.replace('/', '-')
+
+    def _index_path(self, product_id: str) -> Path:
+        return self._product_dir(product_id) / self.INDEX_FILE
+
+    # %% Interval index
+    def covered_ranges(self, product_id: str) -> List[Tuple[int, int]]:
+        """
+        Returns the sorted, non-overlapping time ranges whose trades are all in the store.
+        """
+        index_path = self._index_path(product_id)
+        if not index_path.exists():
+            return []
+        with open(index_path) as f:
+            return [tuple(interval) for interval in json.load(f)]
+
+    def missing_ranges(self, product_id: str, from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+        """
+        Returns the sub-ranges of [from_ms, to_ms] that are not covered by the store yet.
+
+        Args:
+            product_id (str): The currency pair
+            from_ms (int): Start of the window, inclusive
+            to_ms (int): End of the window, inclusive
+
+        Returns:
+            List[Tuple[int, int]]: The gaps, in time order
+        """
+        gaps = []
+        cursor = from_ms
+        for start, end in self.covered_ranges(product_id):
+            if end < cursor:
+                continue
+            if start > to_ms:
+                break
+            if start > cursor:
+                gaps.append((cursor, start - 1))
+            cursor = max(cursor, end + 1)
+        if cursor <= to_ms:
+            gaps.append((cursor, to_ms))
+        return gaps
+
+    def covered_until(self, product_id: str, ts_ms: int) -> Optional[int]:
+        """
+        If ts_ms falls inside a covered range, returns the end of that range, otherwise None.
+        """
+        for start, end in self.covered_ranges(product_id):
+            if start <= ts_ms <= end:
+                return end
+        return None
+
+    def _add_covered_range(self, product_id: str, from_ms: int, to_ms: int) -> None:
+        """
+        Merges [from_ms, to_ms] into the index and rewrites it atomically. Must be called with the product lock held.
+        """
+        intervals = sorted(self.covered_ranges(product_id) + [(from_ms, to_ms)])
+        merged = [list(intervals[0])]
+        for start, end in intervals[1:]:
+            if start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+
+        index_path = self._index_path(product_id)
+        tmp_path = index_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(merged, f)
+        os.replace(tmp_path, index_path)
+
+    # %% Trades
+    def write(self, product_id: str, trades: TradeBatch, from_ms: int, to_ms: int) -> None:
+        """
+        Saves the trades into the day partitions and marks [from_ms, to_ms] as covered.
+
+        Args:
+            product_id (str): The currency pair
+            trades (TradeBatch): Every trade of the pair between from_ms and to_ms (trades outside are stored too)
+            from_ms (int): Start of the range these trades fully cover, inclusive
+            to_ms (int): End of the range these trades fully cover, inclusive
+
+        Returns:
+            None
+        """
+        if to_ms < from_ms:
+            return
+
+        with self._lock(product_id):
+            self._product_dir(product_id).mkdir(parents=True, exist_ok=True)
+
+            # Split the batch into UTC days, without leaving the columnar format
+            days = trades.timestamp_ms // DAY_MS
+            for day in np.unique(days):
+                day_trades = trades[days == day]
+                day_dir = self._product_dir(product_id) / day_to_date(int(day))
+                day_dir.mkdir(exist_ok=True)
+                file_path = day_dir / f'{day_trades.timestamp_ms.min()}-{day_trades.timestamp_ms.max()}.parquet'
+                day_trades.to_dataframe().to_parquet(file_path, index=False)
+
+            # NOTE: the index is updated last, so a range is only ever advertised once its trades are on disk
+            self._add_covered_range(product_id, from_ms, to_ms)
+
+        logger.debug(f'Stored {len(trades)} trades for {product_id}, covering {from_ms} -> {to_ms}')
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Reads the stored trades of product_id with from_ms <= timestamp_ms <= to_ms, sorted by timestamp.
+        """
+        day = datetime.fromtimestamp(from_ms / 1000, tz=timezone.utc).date()
+        last_day = datetime.fromtimestamp(to_ms / 1000, tz=timezone.utc).date()
+
+        frames = []
+        while day <= last_day:
+            day_dir = self._product_dir(product_id) / day.isoformat()
+            if day_dir.exists():
+                for file_path in day_dir.glob('*.parquet'):
+                    first_ms, last_ms = map(int, file_path.stem.split('-'))
+                    if last_ms >= from_ms and first_ms <= to_ms:
+                        frame = pd.read_parquet(file_path)
+                        if 'trade_id' in frame and 'side' in frame:
+                            frames.append(frame)
+            day += timedelta(days=1)
+
+        if not frames:
+            return TradeBatch.empty()
+
+        data = pd.concat(frames)
+        data = data[(data['timestamp_ms'] >= from_ms) & (data['timestamp_ms'] <= to_ms)]
+        # Neighbouring pages can overlap at their edges
+        data = data.drop_duplicates(subset='trade_id').sort_values('trade_id')
+
+        return TradeBatch.from_dataframe(data)
+
+
+def day_to_date(day: int) -> str:
+    """
+    Returns the 'YYYY-MM-DD' date of the given number of days since the Unix epoch.
+    """
+    return (datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(days=day)).strftime('%Y-%m-%d')
+
+
+def end_of_day_ms(ts_ms: int) -> int:
+    """
+    Returns the last millisecond of the UTC day ts_ms falls in.
+    """
+    return ts_ms - ts_ms % DAY_MS + DAY_MS - 1
@@ -5,6 +5,7 @@ from loguru import logger
 from websocket import create_connection
 from datetime import datetime,timezone
 from src.kraken_api.trade import Trade #The pydantic class for creating the unique trade objects, instead of dictionaries
+from src.kraken_api.trade_batch import TradeBatch
 
 class KrakenWebsocketTradeAPI:
     URL = 'wss://ws.kraken.com/v2'
@@ -41,13 +42,13 @@ class KrakenWebsocketTradeAPI:
 
         logger.info('Success, message subscription live')
 
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         """
         Modded function/method that:
 
         Args:None
 
-        Returns: A "Trade" object, instead of a list of dictionaries...the "Trade" class is defined using pydantic
+        Returns: A TradeBatch, the same columnar type the restapi returns, instead of a list of dictionaries...use .to_trades() for the pydantic "Trade" objects
         
         """
         # while True:
@@ -89,6 +90,8 @@ class KrakenWebsocketTradeAPI:
                             price=trade['price'],
                             volume=trade['qty'],
                             timestamp_ms=timestamp_ms,
+                            trade_id=trade['trade_id'],
+                            side=trade['side'],
 
                         )
                      
@@ -96,7 +99,13 @@ class KrakenWebsocketTradeAPI:
 
             # breakpoint()
 
-        return trades
+        return TradeBatch.from_trades(trades)
+    def pop_reconnected_products(self) -> List[str]:
+        """
+        This blocking client never reconnects, so no pair ever has a reconnection gap. See KrakenAsyncWebsocketTradeAPI
+        """
+        return []
+
     #Cheeky 
     def is_done(self) -> bool:
         """
@@ -1,16 +1,21 @@
-from typing import Dict, List
+from typing import List
 
 from loguru import logger
 from quixstreams import Application
+from quixstreams.models import TopicConfig
 
 from src.config import config_kraken_to_trade
 
 from src.kraken_api.websocket import KrakenWebsocketTradeAPI
-from src.kraken_api.restapi import KrakenRestAPI
+from src.kraken_api.hybrid import KrakenHybridTradeAPI
+from src.kraken_api.checkpoints import BackfillCheckpoints
 from src.kraken_api.restapi import KrakenRestAPIMultipleProducts
-from src.kraken_api.trade import Trade
+from src.kraken_api.rate_limiter import KrakenRateLimiter
+from src.kraken_api.http_session import get_kraken_session
+from src.kraken_api.trade_batch import TradeBatch
+from src.batch_producer import DeliveryStats, get_producer_extra_config, produce_batch
+from src.pipeline import TradePipeline
 from typing import Optional
-import json
 # import sys
 # import os
 
@@ -24,34 +29,131 @@ def produce_trades(kaka_broker_address: str,
                    live_or_historical: str,
                    last_n_days: str,
                    cache_dir: Optional[str],
+                   n_threads: Optional[int] = 1,
+                   n_shards_per_product: Optional[int] = 1,
+                   rest_max_counter: Optional[float] = 15,
+                   rest_decay_per_sec: Optional[float] = 1.0,
+                   rest_connect_timeout_sec: Optional[float] = 3.05,
+                   rest_read_timeout_sec: Optional[float] = 10,
+                   rest_max_retries: Optional[int] = 5,
+                   kafka_linger_ms: Optional[int] = 50,
+                   kafka_batch_size: Optional[int] = 1_000_000,
+                   kafka_compression_type: Optional[str] = 'lz4',
+                   kafka_enable_idempotence: Optional[bool] = True,
+                   pipelined: Optional[bool] = True,
+                   pipeline_queue_size: Optional[int] = 16,
+                   ws_async: Optional[bool] = True,
+                   ws_max_pairs_per_connection: Optional[int] = 50,
+                   ws_compression: Optional[bool] = True,
+                   state_dir: Optional[str] = None,
+                   hybrid_max_gap_days: Optional[float] = 1,
+                   kafka_num_partitions: Optional[int] = 1,
                    ) -> None:
     """
     Reads trades from the Kraken APIs and saves them into a Kafka topic
-    Note: live_or_historical can be the live or historical. 
+    Note: live_or_historical can be live, historical or hybrid (live, with the gaps since the last produced trades backfilled). 
 
     Args:
         kaka_broker_address (str): The address of the Kafka broker.
         kaka_topic_name (str): The name of the Kafka topic.
         product_ids List(str): currency pair or pairs
         live_or_historical(str) : Number of days in the past the trading data for the currency pairs that you want
+        n_threads (int): Number of currency pairs fetched concurrently from the REST API (historical only)
+        n_shards_per_product (int): Number of time shards each pair's window is split into and fetched in parallel (historical only)
+        rest_max_counter (float): Kraken REST call counter limit shared by all the threads (historical only)
+        rest_decay_per_sec (float): Rate at which Kraken's REST call counter decays (historical only)
+        rest_connect_timeout_sec (float): Connect timeout of the pooled REST session (historical only)
+        rest_read_timeout_sec (float): Read timeout of the pooled REST session (historical only)
+        rest_max_retries (int): Retries on transient HTTP errors of the pooled REST session (historical only)
+        kafka_linger_ms (int): How long the producer waits to fill a batch before sending it
+        kafka_batch_size (int): Max size of a producer batch, in bytes
+        kafka_compression_type (str): Compression of the producer batches: none, gzip, snappy, lz4 or zstd
+        kafka_enable_idempotence (bool): Idempotent producer, no duplicates when librdkafka retries
+        pipelined (bool): Fetch and produce concurrently through a bounded queue, instead of one after the other
+        pipeline_queue_size (int): Max number of fetched batches waiting to be produced, before the fetchers block
+        ws_async (bool): Use the asyncio websocket client, with the pairs sharded over several connections (live only)
+        ws_max_pairs_per_connection (int): Max number of pairs subscribed on one websocket connection (live only)
+        ws_compression (bool): Negotiate permessage-deflate on the websocket connections (live only)
+        state_dir (Optional(str)): Where the delivered checkpoints (historical) or last delivered trades (hybrid) of every pair are saved
+        hybrid_max_gap_days (float): Longest gap backfilled from the REST API on start/reconnect (hybrid only)
+        kafka_num_partitions (int): Number of partitions the trade topic is created with, i.e. how many trade_to_ohlc workers can share it
 
     Returns:
         Live trades
     """
     #First validate is running trade_producr live or history
-    assert live_or_historical in {"live", "historical"}, f"Invalid value for live or historical: {live_or_historical}" #Notes: Assert is for testing, for production just use if else try
+    assert live_or_historical in {"live", "historical", "hybrid"}, f"Invalid value for live or historical: {live_or_historical}" #Notes: Assert is for testing, for production just use if else try
     
-    app = Application(broker_address=kaka_broker_address)
+    app = Application(
+        broker_address=kaka_broker_address,
+        producer_extra_config=get_producer_extra_config(
+            linger_ms=kafka_linger_ms,
+            batch_size=kafka_batch_size,
+            compression_type=kafka_compression_type,
+            enable_idempotence=kafka_enable_idempotence,
+        ),
+    )
 
-    # the topic where we will save the trades
-    topic = app.topic(name=kaka_topic_name, value_serializer='json')
+    # the topic where we will save the trades. NOTE: app.get_producer() creates it with this config if it doesn't exist,
+    # instead of the broker defaults. An existing topic is left as it is (trade_to_ohlc warns about its partition count)
+    topic = app.topic(
+        name=kaka_topic_name,
+        value_serializer='json',
+        config=TopicConfig(num_partitions=kafka_num_partitions, replication_factor=1),
+    )
 
     logger.info(f'Creating the api to fetch data for {product_ids}')
 
+    # Delivery confirmed checkpoints of the historical backfill, or last delivered trades of the hybrid mode, so a
+    # restart resumes where it stopped
+    checkpoints = None
+    if live_or_historical == 'historical' and state_dir is not None:
+        checkpoints = BackfillCheckpoints(state_dir=state_dir, topic_name=kaka_topic_name)
+    elif live_or_historical == 'hybrid' and state_dir is not None:
+        checkpoints = BackfillCheckpoints(state_dir=state_dir,
+                                          topic_name=kaka_topic_name,
+                                          file_name=KrakenHybridTradeAPI.STATE_FILE,
+                                          )
+
     # Create an instance of the Kraken API for websocket or restapi depending on the settings chosen in live_or_historical 
-    if live_or_historical == 'live':
-        kraken_api = KrakenWebsocketTradeAPI(product_ids=product_ids) #Updared websocket class to handle a list of strings aka product_ids instead of a single str currency  as product_id
+    if live_or_historical in {'live', 'hybrid'}:
+        if ws_async:
+            # NOTE: imported here so historical runs don't need the websockets package
+            from src.kraken_api.async_websocket import KrakenAsyncWebsocketTradeAPI
+
+            kraken_api = KrakenAsyncWebsocketTradeAPI(product_ids=product_ids,
+                                                      max_pairs_per_connection=ws_max_pairs_per_connection,
+                                                      compression=ws_compression,
+                                                      )
+        else:
+            kraken_api = KrakenWebsocketTradeAPI(product_ids=product_ids) #Updared websocket class to handle a list of strings aka product_ids instead of a single str currency  as product_id
+
+        if live_or_historical == 'hybrid':
+            # The websocket is already subscribed (and buffering), the gaps since the last produced trades are
+            # filled from the REST API on a worker thread, in front of the live trades of their products
+            get_kraken_session(
+                connect_timeout_sec=rest_connect_timeout_sec,
+                read_timeout_sec=rest_read_timeout_sec,
+                max_retries=rest_max_retries,
+            )
+            kraken_api = KrakenHybridTradeAPI(product_ids=product_ids,
+                                              live_api=kraken_api,
+                                              checkpoints=checkpoints,
+                                              max_gap_days=hybrid_max_gap_days,
+                                              rate_limiter=KrakenRateLimiter(
+                                                  max_counter=rest_max_counter,
+                                                  decay_per_sec=rest_decay_per_sec,
+                                              ),
+                                              )
     else: 
+        # Set up the shared keep-alive session before any KrakenRestAPI picks it up
+        get_kraken_session(
+            connect_timeout_sec=rest_connect_timeout_sec,
+            read_timeout_sec=rest_read_timeout_sec,
+            max_retries=rest_max_retries,
+            pool_maxsize=max(n_threads * n_shards_per_product, 1),
+        )
+
         # TODO Add back the multiple product ID fix using using KrakenRestAPIMultipleProducts
         
         # kraken_api = KrakenRestAPIMultipleProducts(product_ids=[product_id],
@@ -60,6 +162,13 @@ def produce_trades(kaka_broker_address: str,
         kraken_api = KrakenRestAPIMultipleProducts(product_ids=product_ids,
                                    last_n_days = last_n_days,
                                    cache_dir= cache_dir,
+                                   n_threads=n_threads,
+                                   n_shards_per_product=n_shards_per_product,
+                                   rate_limiter=KrakenRateLimiter(
+                                       max_counter=rest_max_counter,
+                                       decay_per_sec=rest_decay_per_sec,
+                                   ),
+                                   checkpoints=checkpoints,
                                    )
 
 
@@ -70,38 +179,75 @@ def produce_trades(kaka_broker_address: str,
 # %%
     # Create a Producer instance - updated for both live and history using the is_done method-which is a method installed in both websocket and restapi classes
     # and uses the hidden _is_done condition to stop when the last timestamp hits the to_ms mark at which point the break is hit insde the while true 
-    with app.get_producer() as producer:
-        while True:
-            #breakpoint()
-            # An if statement to allow breaks in the while True for historical data fetching which does need to switch from on to off once the history is fetched
-            if kraken_api.is_done():
+    delivery_stats = DeliveryStats(checkpoints=checkpoints)
+
+    def produce(producer, trades: TradeBatch) -> None:
+        # NOTE: the whole batch is serialised in one go and librdkafka groups the messages into
+        # compressed batches (linger.ms/batch.size), instead of one serialise + log per trade
+        produce_batch(
+            producer=producer,
+            topic_name=topic.name,
+            trades=trades,
+            delivery_stats=delivery_stats,
+            checkpoints=checkpoints,
+        )
+        if len(trades) > 0:
+            logger.debug(f'Produced {len(trades)} trades, last one at {trades.last_timestamp_ms()}')
+
+        # Serve the delivery callbacks of the messages sent so far, without blocking
+        producer.poll(0)
+        delivery_stats.log()
+        if checkpoints is not None:
+            checkpoints.save()
+        if live_or_historical == 'historical':
+            kraken_api.log_progress()
+
+    try:
+        with app.get_producer() as producer:
+            if pipelined:
+                # Fetch and produce at the same time: one fetcher thread, feeding a bounded queue drained here.
+                # NOTE: in historical mode it pulls through KrakenRestAPIMultipleProducts, so the pairs in flight stay
+                # capped at n_threads and are halved when Kraken rate limits us, rather than one fetcher per pair
+                pipeline = TradePipeline(sources=[kraken_api], max_queue_size=pipeline_queue_size).start()
+                try:
+                    for trades in pipeline:
+                        produce(producer, trades)
+                finally:
+                    pipeline.stop()
+                    pipeline.log_metrics(force=True)
+
                 logger.info('Done fetching')
-                break
-            
-            
-            # Get the trades from the Kraken API class with typed hints
-                       
-            trades: List[Trade]  = kraken_api.get_trades()
-            
-            # breakpoint()
-            for trade in trades:
-                # Kafka transmits messages as machine readable byte string, so prepare input to be serialised for Topic transmission
-                message = topic.serialize(
-                    key=trade.product_id, 
-                    value = trade.model_dump(), #model_dump() from pydantic converts objects to dicts; for serialising 
-                    )
+                if live_or_historical == 'historical':
+                    kraken_api.log_stats()
+
+            else:
+                while True:
+                    #breakpoint()
+                    # An if statement to allow breaks in the while True for historical data fetching which does need to switch from on to off once the history is fetched
+                    if kraken_api.is_done():
+                        logger.info('Done fetching')
+                        if live_or_historical == 'historical':
+                            kraken_api.log_stats()
+                        break
                 
-                producer.produce(
-                    topic=topic.name, 
-                    value=message.value,
-                    #value = json.dumps(test_message), 
-                    #key="BTC/USD",
-                    key=message.key)
                 
-                logger.debug(f'{trade.model_dump()}')
+                    # Get the trades from the Kraken API class with typed hints
+                           
+                    trades: TradeBatch  = kraken_api.get_trades()
                 
+                    # breakpoint()
+                    produce(producer, trades)
 
-                #logger.info(f'Message sent to first kafka topic: {trade}')
+            # Wait for the in-flight messages so the final report counts every trade
+            producer.flush()
+    finally:
+        # NOTE: stops the websocket connections (live, hybrid) or the REST thread pool (historical) on every exit,
+        # not only at the end of a backfill
+        if hasattr(kraken_api, 'close'):
+            kraken_api.close()
+        delivery_stats.log(force=True)
+        if checkpoints is not None:
+            checkpoints.save(force=True)
 
 
 
@@ -117,4 +263,23 @@ if __name__ == '__main__':
                    live_or_historical=config_kraken_to_trade.live_or_historical,
                    last_n_days = config_kraken_to_trade.last_n_days,
                    cache_dir=config_kraken_to_trade.cache_dir,
+                   n_threads=config_kraken_to_trade.n_threads,
+                   n_shards_per_product=config_kraken_to_trade.n_shards_per_product,
+                   rest_max_counter=config_kraken_to_trade.rest_max_counter,
+                   rest_decay_per_sec=config_kraken_to_trade.rest_decay_per_sec,
+                   rest_connect_timeout_sec=config_kraken_to_trade.rest_connect_timeout_sec,
+                   rest_read_timeout_sec=config_kraken_to_trade.rest_read_timeout_sec,
+                   rest_max_retries=config_kraken_to_trade.rest_max_retries,
+                   kafka_linger_ms=config_kraken_to_trade.kafka_linger_ms,
+                   kafka_batch_size=config_kraken_to_trade.kafka_batch_size,
+                   kafka_compression_type=config_kraken_to_trade.kafka_compression_type,
+                   kafka_enable_idempotence=config_kraken_to_trade.kafka_enable_idempotence,
+                   pipelined=config_kraken_to_trade.pipelined,
+                   pipeline_queue_size=config_kraken_to_trade.pipeline_queue_size,
+                   ws_async=config_kraken_to_trade.ws_async,
+                   ws_max_pairs_per_connection=config_kraken_to_trade.ws_max_pairs_per_connection,
+                   ws_compression=config_kraken_to_trade.ws_compression,
+                   state_dir=config_kraken_to_trade.state_dir,
+                   hybrid_max_gap_days=config_kraken_to_trade.hybrid_max_gap_days,
+                   kafka_num_partitions=config_kraken_to_trade.kafka_num_partitions,
                    )
\ No newline at end of file
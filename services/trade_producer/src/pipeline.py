@@ -0,0 +1,185 @@
+# Pipelined fetch -> produce: fetcher threads fill a bounded queue of TradeBatch objects that the producer drains
+import queue
+import threading
+import time
+from typing import Iterator, List, Optional, Protocol
+
+from loguru import logger
+
+from src.kraken_api.trade_batch import TradeBatch
+
+
+class TradeSource(Protocol):
+    """
+    Anything with the get_trades()/is_done() interface of the Kraken API classes
+    """
+    def get_trades(self) -> TradeBatch: ...
+
+    def is_done(self) -> bool: ...
+
+
+class TradePipeline:
+    """
+    Runs the fetching and the producing of trades at the same time, instead of one after the other.
+
+    One fetcher thread per source calls get_trades() until the source is done and puts the batches into a
+    bounded queue. The caller iterates over the pipeline (on its own thread, the one that owns the Kafka
+    producer) and produces every batch. While a REST page is in flight the producer keeps serialising, and
+    while it serialises the next pages are already being fetched, so a backfill takes about
+    max(fetch time, produce time) rather than their sum.
+
+    Backpressure: when Kafka (or the serialising) is slower than the fetchers, the queue fills up and the
+    fetchers block on put() until the producer catches up, so memory stays bounded by max_queue_size batches.
+
+    NOTE: get_trades() of a single source is never called from two threads at once, so the Kraken API classes
+    don't need to be thread safe. Sources sharing a KrakenRateLimiter still stay within Kraken's budget.
+    """
+
+    _DONE = object() # put by a fetcher when its source is exhausted
+
+    def __init__(
+        self,
+        sources: List[TradeSource],
+        max_queue_size: Optional[int] = 16,
+        log_every_sec: Optional[float] = 10,
+    ) -> None:
+        """
+        Args:
+            sources (List[TradeSource]): The trade sources, one fetcher thread each
+            max_queue_size (int): Maximum number of batches waiting to be produced
+            log_every_sec (float): How often the queue metrics are logged
+
+        Returns:
+            None
+        """
+        self.sources = sources
+        self.max_queue_size = max_queue_size
+        self.log_every_sec = log_every_sec
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+        self._threads: List[threading.Thread] = []
+
+        # Metrics
+        self.n_batches = 0
+        self.n_trades = 0
+        self.max_queue_depth = 0
+        self._sum_queue_depth = 0
+        self.fetchers_blocked_sec = 0.0 # time the fetchers waited for room in the queue, i.e. backpressure
+        self.producer_idle_sec = 0.0 # time the producer waited for a batch, i.e. fetching is the bottleneck
+        self._blocked_lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._last_logged_at = self._started_at
+
+    # %% Fetchers
+    def start(self) -> 'TradePipeline':
+        """
+        Starts one fetcher thread per source
+        """
+        for i, source in enumerate(self.sources):
+            thread = threading.Thread(target=self._fetch, args=(source,), name=f'trade-fetcher-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f'Started {len(self._threads)} fetcher threads, queue of {self.max_queue_size} batches')
+        return self
+
+    def _fetch(self, source: TradeSource) -> None:
+        try:
+            while not self._stop.is_set() and not source.is_done():
+                trades = source.get_trades()
+                if len(trades) > 0:
+                    self._put(trades)
+        except Exception as e:
+            logger.exception(f'Fetcher {threading.current_thread().name} failed: {e}')
+            self._errors.append(e)
+        finally:
+            self._put(self._DONE)
+
+    def _put(self, item) -> None:
+        """
+        Blocking put that still notices stop(), and that books the time spent blocked
+        """
+        started_at = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+        with self._blocked_lock:
+            self.fetchers_blocked_sec += time.monotonic() - started_at
+
+    # %% Producer side
+    def __iter__(self) -> Iterator[TradeBatch]:
+        """
+        Yields the batches in the order they were fetched, until every source is done.
+        Re-raises the first fetcher error, if any.
+        """
+        n_running = len(self._threads)
+        while n_running > 0:
+            started_at = time.monotonic()
+            item = self._queue.get()
+            self.producer_idle_sec += time.monotonic() - started_at
+
+            if item is self._DONE:
+                n_running -= 1
+                continue
+
+            depth = self._queue.qsize()
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+            self._sum_queue_depth += depth
+            self.n_batches += 1
+            self.n_trades += len(item)
+
+            yield item
+            self.log_metrics()
+
+        if self._errors:
+            raise self._errors[0]
+
+    def stop(self) -> None:
+        """
+        Asks the fetchers to stop after their current call and waits for them
+        """
+        self._stop.set()
+        # Unblock fetchers waiting on a full queue
+        while not self._queue.empty():
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    # %% Metrics
+    def get_metrics(self) -> dict:
+        elapsed_sec = max(time.monotonic() - self._started_at, 1e-9)
+        return {
+            'n_batches': self.n_batches,
+            'n_trades': self.n_trades,
+            'trades_per_sec': self.n_trades / elapsed_sec,
+            'queue_depth': self._queue.qsize(),
+            'avg_queue_depth': self._sum_queue_depth / max(self.n_batches, 1),
+            'max_queue_depth': self.max_queue_depth,
+            'fetchers_blocked_sec': self.fetchers_blocked_sec,
+            'producer_idle_sec': self.producer_idle_sec,
+        }
+
+    def log_metrics(self, force: Optional[bool] = False) -> None:
+        """
+        Logs the queue depth and where the time goes, at most every log_every_sec.
+        A queue that is mostly full means Kafka is the bottleneck, a mostly empty one means the REST API is.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_logged_at < self.log_every_sec:
+            return
+        self._last_logged_at = now
+
+        metrics = self.get_metrics()
+        logger.info(
+            f"Pipeline: {metrics['n_trades']} trades in {metrics['n_batches']} batches ({metrics['trades_per_sec']:.0f}/sec), "
+            f"queue depth {metrics['queue_depth']}/{self.max_queue_size} "
+            f"(avg {metrics['avg_queue_depth']:.1f}, max {metrics['max_queue_depth']}), "
+            f"fetchers blocked {metrics['fetchers_blocked_sec']:.1f}s, producer idle {metrics['producer_idle_sec']:.1f}s"
+        )
@@ -0,0 +1,133 @@
+import threading
+import time
+from typing import Dict, List
+
+import pytest
+
+from src.kraken_api import hybrid
+from src.kraken_api.checkpoints import BackfillCheckpoints
+from src.kraken_api.hybrid import KrakenHybridTradeAPI
+from src.kraken_api.trade_batch import TradeBatch
+
+NOW_MS = int(time.time() * 1000)
+
+
+def trades(product_id: str, trade_ids: List[int]) -> TradeBatch:
+    """ Trades of product_id, one second apart in trade_id order """
+    return TradeBatch(
+        product_id=[product_id] * len(trade_ids),
+        price=[100.0] * len(trade_ids),
+        volume=[0.1] * len(trade_ids),
+        timestamp_ms=[NOW_MS - 1_000_000 + 1_000 * trade_id for trade_id in trade_ids],
+        trade_id=trade_ids,
+        side=['buy'] * len(trade_ids),
+    )
+
+
+class FakeLiveAPI:
+    """ Hands out the given batches, one per get_trades() call, then empty ones """
+
+    def __init__(self, batches: List[TradeBatch]) -> None:
+        self.batches = list(batches)
+        self.reconnected_products: List[str] = []
+
+    def get_trades(self) -> TradeBatch:
+        return self.batches.pop(0) if self.batches else TradeBatch.empty()
+
+    def pop_reconnected_products(self) -> List[str]:
+        products, self.reconnected_products = self.reconnected_products, []
+        return products
+
+
+class FakeRestAPI:
+    """ Returns the trade_ids of REST_TRADES for its product in one page, once `release` is set """
+
+    release = threading.Event()
+    requests: List[Dict] = []
+
+    def __init__(self, product_id: str, from_ms: int, to_ms: int, **kwargs) -> None:
+        FakeRestAPI.requests.append({'product_id': product_id, 'from_ms': from_ms})
+        self.product_id = product_id
+        self.n_requests = 0
+
+    def get_trades(self) -> TradeBatch:
+        FakeRestAPI.release.wait(timeout=10)
+        self.n_requests += 1
+        return trades(self.product_id, REST_TRADES[self.product_id])
+
+    def is_done(self) -> bool:
+        return self.n_requests > 0
+
+
+REST_TRADES = {'BTC/USD': [11, 12, 13, 14], 'ETH/USD': [21, 22]}
+
+
+@pytest.fixture(autouse=True)
+def fake_rest_api(monkeypatch):
+    FakeRestAPI.release = threading.Event()
+    FakeRestAPI.requests = []
+    monkeypatch.setattr(hybrid, 'KrakenRestAPI', FakeRestAPI)
+
+
+def make_api(tmp_path, live_api: FakeLiveAPI, delivered: Dict[str, int]) -> KrakenHybridTradeAPI:
+    checkpoints = BackfillCheckpoints(str(tmp_path), 'trades', file_name=KrakenHybridTradeAPI.STATE_FILE)
+    for product_id, trade_id in delivered.items():
+        checkpoints.commit(product_id, int(trades(product_id, [trade_id]).timestamp_ms[0]), trade_id)
+    return KrakenHybridTradeAPI(product_ids=['BTC/USD', 'ETH/USD'], live_api=live_api, checkpoints=checkpoints)
+
+
+def wait_for_backfill(api: KrakenHybridTradeAPI) -> None:
+    FakeRestAPI.release.set()
+    api._backfill.result(timeout=10)
+
+
+def test_backfill_and_live_trades_are_stitched_without_duplicates(tmp_path):
+    # The websocket overlaps the backfill from trade 13, and re-sends the delivered trade 10
+    live_api = FakeLiveAPI([trades('BTC/USD', [10, 13, 14]), trades('BTC/USD', [15])])
+    api = make_api(tmp_path, live_api, {'BTC/USD': 10})
+
+    # The live trades of BTC/USD are held back while its gap is backfilled
+    assert len(api.get_trades()) == 0
+    wait_for_backfill(api)
+    batch = api.get_trades()
+
+    assert batch.trade_id.tolist() == [11, 12, 13, 14, 15]
+    assert FakeRestAPI.requests == [{'product_id': 'BTC/USD', 'from_ms': int(trades('BTC/USD', [10]).timestamp_ms[0])}]
+    assert api.n_backfilled_trades == 4
+    # 13 and 14 were backfilled, 10 was delivered before the restart
+    assert api.n_seam_duplicates == 3
+    assert api.last_produced_trade_id == {'BTC/USD': 15}
+
+
+def test_other_products_are_produced_during_the_backfill(tmp_path):
+    live_api = FakeLiveAPI([
+        TradeBatch.concat([trades('BTC/USD', [15]), trades('ETH/USD', [23])]),
+        trades('ETH/USD', [24]),
+    ])
+    api = make_api(tmp_path, live_api, {'BTC/USD': 10})
+
+    assert api.get_trades().trade_id.tolist() == [23]
+    assert api.get_trades().trade_id.tolist() == [24]
+
+    wait_for_backfill(api)
+    assert api.get_trades().trade_id.tolist() == [11, 12, 13, 14, 15]
+
+
+def test_a_reconnection_during_the_backfill_waits_for_the_next_one(tmp_path):
+    live_api = FakeLiveAPI([
+        TradeBatch.concat([trades('BTC/USD', [15]), trades('ETH/USD', [20])]),
+        trades('ETH/USD', [25]),
+    ])
+    api = make_api(tmp_path, live_api, {'BTC/USD': 10})
+
+    assert api.get_trades().trade_id.tolist() == [20]
+    # ETH/USD reconnects while BTC/USD is backfilled: its live trades are held behind its own backfill
+    live_api.reconnected_products = ['ETH/USD']
+    assert len(api.get_trades()) == 0
+
+    wait_for_backfill(api)
+    assert api.get_trades().trade_id.tolist() == [11, 12, 13, 14, 15]
+
+    wait_for_backfill(api)
+    assert api.get_trades().trade_id.tolist() == [21, 22, 25]
+    assert [request['product_id'] for request in FakeRestAPI.requests] == ['BTC/USD', 'ETH/USD']
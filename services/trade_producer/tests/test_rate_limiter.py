@@ -0,0 +1,36 @@
+from src.kraken_api.rate_limiter import KrakenRateLimiter
+
+
+def test_acquire_waits_for_the_counter_to_decay():
+    rate_limiter = KrakenRateLimiter(max_counter=2, decay_per_sec=100)
+
+    assert rate_limiter.acquire() == 0.0
+    assert rate_limiter.acquire() == 0.0
+    # The counter is full, one point decays in 10 ms
+    assert rate_limiter.acquire() > 0.0
+    assert rate_limiter.n_calls == 3
+
+
+def test_rate_limit_halves_the_decay_down_to_its_floor():
+    rate_limiter = KrakenRateLimiter(max_counter=15, decay_per_sec=1.0, min_decay_per_sec=0.3)
+
+    rate_limiter.on_rate_limited()
+    assert rate_limiter.decay_per_sec == 0.5
+    # Every thread waits for the maxed out counter
+    assert rate_limiter._counter == rate_limiter.max_counter
+
+    rate_limiter.on_rate_limited()
+    assert rate_limiter.decay_per_sec == 0.3
+    assert rate_limiter.n_rate_limited == 2
+
+
+def test_success_brings_the_decay_back_up_to_nominal():
+    rate_limiter = KrakenRateLimiter(decay_per_sec=1.0)
+    rate_limiter.on_rate_limited()
+
+    rate_limiter.on_success()
+    assert abs(rate_limiter.decay_per_sec - 0.55) < 1e-9
+
+    for _ in range(20):
+        rate_limiter.on_success()
+    assert rate_limiter.decay_per_sec == rate_limiter.nominal_decay_per_sec
@@ -0,0 +1,238 @@
+from typing import Dict, List
+
+from src.kraken_api.rate_limiter import KrakenRateLimiter
+from src.kraken_api.restapi import KrakenRestAPI, KrakenRestAPIMultipleProducts, KrakenRestAPIShardedProduct
+from src.kraken_api.trade_batch import TradeBatch
+
+PRODUCT_ID = 'BTC/USD'
+FROM_MS = 1_717_632_000_000 # 2024-06-06 00:00:00 UTC
+TO_MS = FROM_MS + 60_000
+
+
+class FakeSession:
+    """ Answers the public/Trades requests with the given pages, in order, and records the urls asked for """
+
+    def __init__(self, pages: List[Dict]) -> None:
+        self.pages = list(pages)
+        self.urls: List[str] = []
+
+    def get_json(self, url: str, params=None) -> Dict:
+        self.urls.append(url)
+        return self.pages.pop(0)
+
+
+def page(rows: List[list], last_ns: int) -> Dict:
+    return {'error': [], 'result': {PRODUCT_ID: rows, 'last': str(last_ns)}}
+
+
+def row(ms: int, trade_id: int, price: str = '65000.0', side: str = 'b') -> list:
+    # [<price>, <volume>, <time>, <buy/sell>, <market/limit>, <miscellaneous>, <trade_id>]
+    return [price, '0.1', ms / 1000, side, 'l', '', trade_id]
+
+
+def make_api(session: FakeSession, **kwargs) -> KrakenRestAPI:
+    return KrakenRestAPI(
+        product_id=PRODUCT_ID,
+        last_n_days=1,
+        from_ms=FROM_MS,
+        to_ms=TO_MS,
+        session=session,
+        rate_limiter=KrakenRateLimiter(max_counter=1000),
+        **kwargs,
+    )
+
+
+def test_cursor_follows_kraken_last():
+    last_ns = (FROM_MS + 2_000) * 1_000_000 + 123
+    session = FakeSession([
+        page([row(FROM_MS + 1_000, 1), row(FROM_MS + 2_000, 2)], last_ns),
+        page([row(FROM_MS + 3_000, 3)], (FROM_MS + 3_000) * 1_000_000 + 7),
+    ])
+    api = make_api(session)
+
+    trades = api.get_trades()
+    assert trades.trade_id.tolist() == [1, 2]
+    api.get_trades()
+
+    # The first page starts a nanosecond before from_ms, the next one from the full precision `last`
+    assert session.urls[0].endswith(f'since={FROM_MS * 1_000_000 - 1}')
+    assert session.urls[1].endswith(f'since={last_ns}')
+    assert api.last_trade_ms == FROM_MS + 3_000
+    assert not api.is_done()
+
+
+def test_overlapping_pages_are_deduplicated_by_trade_id():
+    session = FakeSession([
+        page([row(FROM_MS + 1_000, 1), row(FROM_MS + 2_000, 2)], (FROM_MS + 2_000) * 1_000_000),
+        # Overlaps the previous page on trade 2
+        page([row(FROM_MS + 2_000, 2), row(FROM_MS + 3_000, 3)], (FROM_MS + 3_000) * 1_000_000),
+    ])
+    api = make_api(session)
+
+    first = api.get_trades()
+    second = api.get_trades()
+
+    assert first.trade_id.tolist() == [1, 2]
+    assert second.trade_id.tolist() == [3]
+    assert api.n_duplicates == 1
+    assert api.n_trades == 3
+
+
+def test_checkpoint_skips_the_trades_already_delivered():
+    session = FakeSession([
+        page(
+            [row(FROM_MS + 5_000, 10), row(FROM_MS + 5_000, 11), row(FROM_MS + 6_000, 12)],
+            (FROM_MS + 6_000) * 1_000_000,
+        ),
+    ])
+    api = make_api(session, checkpoint=(FROM_MS + 5_000, 10))
+
+    trades = api.get_trades()
+
+    assert session.urls[0].endswith(f'since={(FROM_MS + 5_000) * 1_000_000 - 1}')
+    assert trades.trade_id.tolist() == [11, 12]
+    assert api.n_duplicates == 1
+
+
+def test_trades_after_to_ms_are_left_out_and_the_window_is_done():
+    session = FakeSession([
+        page([row(TO_MS - 1_000, 1), row(TO_MS + 1_000, 2)], (TO_MS + 1_000) * 1_000_000),
+    ])
+    api = make_api(session)
+
+    trades = api.get_trades()
+
+    assert trades.trade_id.tolist() == [1]
+    assert api.is_done()
+
+
+def test_rate_limited_page_keeps_the_cursor():
+    session = FakeSession([
+        {'error': ['EGeneral:Too many requests'], 'result': {}},
+        page([row(FROM_MS + 1_000, 1)], (FROM_MS + 1_000) * 1_000_000),
+    ])
+    api = make_api(session)
+
+    assert len(api.get_trades()) == 0
+    assert api.get_trades().trade_id.tolist() == [1]
+    assert session.urls[0] == session.urls[1]
+
+
+def test_empty_page_ends_the_window():
+    session = FakeSession([page([], FROM_MS * 1_000_000)])
+    api = make_api(session)
+
+    assert len(api.get_trades()) == 0
+    assert api.is_done()
+
+
+class FakeProductAPI:
+    """ One page per get_trades() call, the calls are recorded. Rate limited on the calls listed in rate_limited_calls """
+
+    def __init__(self, product_id: str, rate_limiter: KrakenRateLimiter, n_pages: int = 10, rate_limited_calls=()) -> None:
+        self.product_id = product_id
+        self.rate_limiter = rate_limiter
+        self.n_pages = n_pages
+        self.rate_limited_calls = set(rate_limited_calls)
+        self.n_calls = 0
+
+    def get_trades(self) -> TradeBatch:
+        self.n_calls += 1
+        if self.n_calls in self.rate_limited_calls:
+            self.rate_limiter.on_rate_limited()
+            return TradeBatch.empty()
+        self.n_pages -= 1
+        return TradeBatch(product_id=[self.product_id], price=[1.0], volume=[1.0], timestamp_ms=[FROM_MS],
+                          trade_id=[self.n_calls], side=['buy'])
+
+    def is_done(self) -> bool:
+        return self.n_pages <= 0
+
+
+def make_multiple_products(n_threads: int, product_ids: List[str], **fake_kwargs) -> KrakenRestAPIMultipleProducts:
+    api = KrakenRestAPIMultipleProducts(product_ids=product_ids, last_n_days=1, n_threads=n_threads,
+                                        rate_limiter=KrakenRateLimiter(max_counter=1000))
+    api.kraken_apis = [FakeProductAPI(product_id, api.rate_limiter, **fake_kwargs.get(product_id, {}))
+                       for product_id in product_ids]
+    return api
+
+
+def test_pairs_are_fetched_round_robin_when_concurrency_is_lower():
+    api = make_multiple_products(2, ['BTC/USD', 'ETH/USD', 'SOL/USD'])
+
+    rounds = [sorted(set(api.get_trades().product_id.tolist())) for _ in range(3)]
+    api.close()
+
+    assert rounds == [['BTC/USD', 'ETH/USD'], ['BTC/USD', 'SOL/USD'], ['ETH/USD', 'SOL/USD']]
+    assert [kraken_api.n_calls for kraken_api in api.kraken_apis] == [2, 2, 2]
+
+
+def test_concurrency_halves_on_rate_limits_and_grows_back():
+    api = make_multiple_products(4, ['BTC/USD', 'ETH/USD', 'SOL/USD', 'XRP/USD'], **{'BTC/USD': {'rate_limited_calls': [1]}})
+
+    api.get_trades()
+    assert api._concurrency == 2
+    assert len(api.get_trades()) == 2
+    assert api._concurrency == 3
+    api.get_trades()
+    assert api._concurrency == 4
+    api.close()
+
+
+def test_done_pairs_are_skipped():
+    api = make_multiple_products(2, ['BTC/USD', 'ETH/USD'], **{'BTC/USD': {'n_pages': 1}})
+
+    assert len(api.get_trades()) == 2
+    assert api.get_trades().product_id.tolist() == ['ETH/USD']
+    assert not api.is_done()
+    api.close()
+
+
+def make_sharded_product(pages_per_shard: List[List[Dict]], **kwargs) -> KrakenRestAPIShardedProduct:
+    """ Each shard answers from its own FakeSession. The pages are built from the shard windows, see shard_page """
+    api = KrakenRestAPIShardedProduct(product_id=PRODUCT_ID, last_n_days=1, n_shards=len(pages_per_shard),
+                                      rate_limiter=KrakenRateLimiter(max_counter=1000), **kwargs)
+    for shard, pages in zip(api.shards, pages_per_shard):
+        shard.session = FakeSession([shard_page(shard, trades) for trades in pages])
+    return api
+
+
+def shard_page(shard: KrakenRestAPI, trades: List[tuple]) -> Dict:
+    """ (seconds after the start of the shard, trade_id) pairs, None as seconds for a trade past the end of the shard """
+    rows = [row(shard.to_ms + 1_000 if sec is None else shard.from_ms + sec * 1_000, trade_id) for sec, trade_id in trades]
+    return page(rows, int(rows[-1][2] * 1000) * 1_000_000)
+
+
+def test_shards_do_not_overlap():
+    api = make_sharded_product([[], [], []])
+
+    for shard, next_shard in zip(api.shards, api.shards[1:]):
+        assert shard.to_ms == next_shard.from_ms - 1
+
+
+def test_shards_are_released_in_timestamp_order():
+    api = make_sharded_product([
+        [[(1, 1)], [(2, 2), (None, 10)]],
+        # The later shard is done first, its trades wait for the earlier one
+        [[(1, 10), (2, 11), (None, 20)]],
+    ])
+
+    assert api.get_trades().trade_id.tolist() == [1]
+    assert api.get_trades().trade_id.tolist() == [2, 10, 11]
+    assert api.is_done()
+
+
+def test_a_later_shard_stops_fetching_once_its_buffer_is_full():
+    api = make_sharded_product([
+        [[(1, 1)], [(2, 2)], [(None, 10)]],
+        [[(1, 10), (2, 11)], [(3, 12), (None, 20)]],
+    ], max_buffered_trades=2)
+
+    api.get_trades()
+    api.get_trades()
+    # Two trades buffered: the second shard waits for the head shard
+    assert len(api.shards[1].session.urls) == 1
+
+    assert api.get_trades().trade_id.tolist() == [10, 11]
+    assert api.get_trades().trade_id.tolist() == [12]
+    assert api.is_done()
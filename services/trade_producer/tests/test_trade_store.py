@@ -0,0 +1,72 @@
+import numpy as np
+
+from src.kraken_api.trade_batch import TradeBatch
+from src.kraken_api.trade_store import DAY_MS, TradeStore, end_of_day_ms
+
+PRODUCT_ID = 'BTC/USD'
+DAY_0 = 1_717_632_000_000 # 2024-06-06 00:00:00 UTC
+
+
+def make_trades(timestamps_ms, trade_ids) -> TradeBatch:
+    n = len(timestamps_ms)
+    return TradeBatch(
+        product_id=np.full(n, PRODUCT_ID, dtype=object),
+        price=np.linspace(65000, 65100, n),
+        volume=np.full(n, 0.1),
+        timestamp_ms=timestamps_ms,
+        trade_id=trade_ids,
+        side=np.array(['buy', 'sell'] * n, dtype=object)[:n],
+    )
+
+
+def test_missing_ranges_of_an_empty_store(tmp_path):
+    store = TradeStore(str(tmp_path))
+
+    assert store.covered_ranges(PRODUCT_ID) == []
+    assert store.missing_ranges(PRODUCT_ID, 0, 999) == [(0, 999)]
+    assert store.covered_until(PRODUCT_ID, 10) is None
+
+
+def test_interval_index_merges_adjacent_and_overlapping_ranges(tmp_path):
+    store = TradeStore(str(tmp_path))
+    empty = TradeBatch.empty()
+
+    store.write(PRODUCT_ID, empty, DAY_0, DAY_0 + 99)
+    store.write(PRODUCT_ID, empty, DAY_0 + 200, DAY_0 + 299)
+    assert store.covered_ranges(PRODUCT_ID) == [(DAY_0, DAY_0 + 99), (DAY_0 + 200, DAY_0 + 299)]
+    assert store.missing_ranges(PRODUCT_ID, DAY_0 - 50, DAY_0 + 399) == [
+        (DAY_0 - 50, DAY_0 - 1),
+        (DAY_0 + 100, DAY_0 + 199),
+        (DAY_0 + 300, DAY_0 + 399),
+    ]
+    assert store.covered_until(PRODUCT_ID, DAY_0 + 250) == DAY_0 + 299
+    assert store.covered_until(PRODUCT_ID, DAY_0 + 150) is None
+
+    # Adjacent on the left, overlapping on the right: the three ranges become one
+    store.write(PRODUCT_ID, empty, DAY_0 + 100, DAY_0 + 250)
+    assert store.covered_ranges(PRODUCT_ID) == [(DAY_0, DAY_0 + 299)]
+    assert store.missing_ranges(PRODUCT_ID, DAY_0, DAY_0 + 299) == []
+
+
+def test_write_and_read_across_days(tmp_path):
+    store = TradeStore(str(tmp_path))
+    timestamps_ms = [DAY_0 + 1_000, DAY_0 + 2_000, DAY_0 + DAY_MS + 500]
+    store.write(PRODUCT_ID, make_trades(timestamps_ms, [1, 2, 3]), DAY_0, DAY_0 + DAY_MS + 999)
+
+    # One file per UTC day
+    assert len(list(tmp_path.glob('BTC-USD/*/*.parquet'))) == 2
+
+    trades = store.read(PRODUCT_ID, DAY_0 + 1_500, DAY_0 + DAY_MS + 999)
+    assert trades.trade_id.tolist() == [2, 3]
+    assert trades.side.tolist() == ['sell', 'buy']
+
+
+def test_read_drops_the_trades_of_overlapping_pages(tmp_path):
+    store = TradeStore(str(tmp_path))
+    store.write(PRODUCT_ID, make_trades([DAY_0 + 1_000, DAY_0 + 2_000], [1, 2]), DAY_0, DAY_0 + 2_000)
+    store.write(PRODUCT_ID, make_trades([DAY_0 + 2_000, DAY_0 + 3_000], [2, 3]), DAY_0 + 2_001, DAY_0 + 3_000)
+
+    trades = store.read(PRODUCT_ID, DAY_0, end_of_day_ms(DAY_0))
+
+    assert trades.trade_id.tolist() == [1, 2, 3]
+    assert store.covered_ranges(PRODUCT_ID) == [(DAY_0, DAY_0 + 3_000)]
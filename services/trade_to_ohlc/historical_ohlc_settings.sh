@@ -3,4 +3,15 @@
 export KAFKA_INPUT_TOPIC=trade_historical
 export KAFKA_OUTPUT_TOPIC=ohlc_historical
 export KAFKA_CONSUMER_GROUP=trade_to_ohlc_historical_consumer_group
-export OHLC_WINDOW_SECONDS=60
\ No newline at end of file
+export OHLC_WINDOW_SECONDS=60
+# Vectorized batch candles instead of the per-trade streaming windows, see src/batch_ohlc.py
+export OHLC_BATCH_MODE=true
+export BATCH_SOURCE=topic
+
+# Close windows on the cross-partition event time progress, never on the wall clock for a backfill
+export OHLC_CLOSE_WINDOWS_ON=watermark
+export WATERMARK_WALL_CLOCK=false
+
+# One worker process per partition of the trade topic, see src/workers.py
+export KAFKA_NUM_PARTITIONS=4
+export N_WORKERS=4
@@ -3,4 +3,13 @@
 export KAFKA_INPUT_TOPIC=trade
 export KAFKA_OUTPUT_TOPIC=ohlc
 export KAFKA_CONSUMER_GROUP=trade_to_ohlc_consumer_group
-export OHLC_WINDOW_SECONDS=60
\ No newline at end of file
+export OHLC_WINDOW_SECONDS=60
+# Close windows on the watermark (wall clock once caught up) and emit forward-filled candles for windows without trades
+export OHLC_CLOSE_WINDOWS_ON=watermark
+export WATERMARK_LATENESS_SECONDS=2
+# Per-message chunks while live, vectorized catch-up chunks while the consumer lags, see src/catch_up.py
+export ADAPTIVE_BATCHING=true
+
+# One worker process per partition of the trade topic, see src/workers.py
+export KAFKA_NUM_PARTITIONS=4
+export N_WORKERS=4
@@ -0,0 +1,691 @@
+# Vectorized OHLC candles for historical backfills, computed on large columnar chunks of trades instead of one trade at a time
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from confluent_kafka import TopicPartition
+from quixstreams import Application
+from quixstreams.utils.json import loads
+
+from candle_rollup import CandleRollup, InMemoryState
+from catch_up import AdaptiveBatching
+from checkpoint import PartitionCheckpoint, RecoveryMonitor
+from watermark import PartitionWatermark
+
+VOLUME_FIELDS = ['volume', 'notional', 'vwap', 'trade_count', 'buy_volume', 'sell_volume']
+CANDLE_COLUMNS = ['timestamp', 'product_id', 'open', 'high', 'low', 'close', *VOLUME_FIELDS]
+
+
+class BatchOHLCEngine:
+    """
+    Turns chunks of trades into tumbling window candles with a group-by on (product_id, window_start), and emits
+    the same candles as the streaming path of main.py:
+        - windows are aligned on the epoch, window_start = timestamp_ms - timestamp_ms % window_ms
+        - a candle is only emitted once its window is closed, i.e. a later trade of the same product reached the
+          window end (Quix `.final()` with no grace period, windows are kept per message key, the product_id)
+        - trades of a window that is already closed are late and dropped, like Quix does
+        - open/close are the first/last trade in arrival order, and `timestamp` is the window end
+        - volume, notional, trade_count and buy/sell volume are sums over the window, vwap = notional / volume
+
+    The trades of windows still open at the end of a chunk are carried over to the next one, so chunk boundaries
+    don't split candles.
+
+    With a watermark (see watermark.py), every window ending at or before the watermark is closed too, whether or
+    not its product traded since, and trades of those windows are late. With forward_fill, the windows of a product
+    that had no trade are emitted as well, as flat candles at the previous close with no volume and
+    is_forward_filled=True, so every product has one candle per window. Every other candle is is_forward_filled=False,
+    with or without forward_fill, like the candles of the streaming path.
+    """
+
+    def __init__(self, window_seconds: int, forward_fill: Optional[bool] = False) -> None:
+        """
+        Args:
+            window_seconds (int): The size of the tumbling windows
+            forward_fill (bool): Emit forward-filled candles for the windows without trades
+
+        Returns:
+            None
+        """
+        self.window_ms = int(window_seconds) * 1000
+        self.forward_fill = forward_fill
+        self.columns = CANDLE_COLUMNS + ['is_forward_filled']
+
+        # Trades of the windows that are still open, and latest timestamp seen, per product
+        self._pending = pd.DataFrame()
+        self._latest_ms: Dict[str, int] = {}
+        self._watermark_ms: Optional[int] = None
+
+        # (window end, close) of the last candle of every product, where forward filling starts from
+        self._last_candle: Dict[str, Tuple[int, float]] = {}
+
+        # Topic partition of every product (trades are keyed by product_id), to hand partitions over on rebalances
+        self._product_partition: Dict[str, int] = {}
+
+        # Stats
+        self.n_trades = 0
+        self.n_late_trades = 0
+        self.n_candles = 0
+        self.n_forward_filled = 0
+
+    def process(self, trades: pd.DataFrame, watermark_ms: Optional[int] = None) -> pd.DataFrame:
+        """
+        Adds a chunk of trades and returns the candles of every window it closed.
+
+        Args:
+            trades (pd.DataFrame): Trades in arrival order, with product_id, price, volume, timestamp_ms and side columns.
+                Can be empty, to close windows on a new watermark only
+            watermark_ms (Optional(int)): The watermark after this chunk, None to close windows on later trades only
+
+        Returns:
+            pd.DataFrame: The closed candles (self.columns), sorted by window end then product_id
+        """
+        self.n_trades += len(trades)
+        if 'partition' in trades and len(trades):
+            first_seen = trades.drop_duplicates(subset='product_id')
+            self._product_partition.update(zip(first_seen['product_id'], first_seen['partition'].tolist()))
+
+        # NOTE: lateness is judged against the watermark before this chunk, the chunk itself moved it forward
+        trades = self._drop_late_trades(trades)
+        if watermark_ms is not None and (self._watermark_ms is None or watermark_ms > self._watermark_ms):
+            self._watermark_ms = watermark_ms
+
+        data = pd.concat([self._pending, trades], ignore_index=True) if len(self._pending) else trades
+        if len(data) == 0:
+            candles = pd.DataFrame(columns=CANDLE_COLUMNS)
+        else:
+            window_start = data['timestamp_ms'].to_numpy() // self.window_ms * self.window_ms
+            close_until_ms = data['product_id'].map(self._latest_ms).to_numpy()
+            if self._watermark_ms is not None:
+                close_until_ms = np.maximum(close_until_ms, self._watermark_ms)
+            is_closed = window_start + self.window_ms <= close_until_ms
+
+            self._pending = data[~is_closed].reset_index(drop=True)
+            candles = self.to_candles(data[is_closed], window_start[is_closed], self.window_ms)
+
+        if self.forward_fill:
+            candles = self._forward_fill(candles)
+        else:
+            candles = candles.assign(is_forward_filled=False)
+        self.n_candles += len(candles)
+        return candles
+
+    def _drop_late_trades(self, trades: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drops the trades whose window was closed by an earlier trade of the same product, and moves the latest
+        timestamp of every product forward.
+        """
+        if len(trades) == 0:
+            return trades
+
+        # Latest timestamp of the product before each trade: running max within the chunk, seeded with the
+        # latest timestamp of the previous chunks
+        running_max = trades.groupby('product_id', sort=False)['timestamp_ms'].cummax()
+        latest_before = running_max.groupby(trades['product_id'], sort=False).shift(1)
+        seed = trades['product_id'].map(self._latest_ms)
+        latest_before = np.fmax(latest_before.to_numpy(dtype=float), seed.to_numpy(dtype=float))
+        if self._watermark_ms is not None:
+            latest_before = np.fmax(latest_before, self._watermark_ms)
+
+        window_end = trades['timestamp_ms'].to_numpy() // self.window_ms * self.window_ms + self.window_ms
+        is_late = window_end <= latest_before
+
+        for product_id, latest_ms in running_max.groupby(trades['product_id'], sort=False).max().items():
+            self._latest_ms[product_id] = max(self._latest_ms.get(product_id, latest_ms), int(latest_ms))
+
+        if is_late.any():
+            self.n_late_trades += int(is_late.sum())
+            trades = trades[~is_late]
+        return trades
+
+    @staticmethod
+    def to_candles(trades: pd.DataFrame, window_start: np.ndarray, window_ms: int) -> pd.DataFrame:
+        """
+        The vectorized reducer: one candle per (product_id, window_start) of the given trades.
+
+        Args:
+            trades (pd.DataFrame): Trades in arrival order
+            window_start (np.ndarray): The window start of every trade
+            window_ms (int): The size of the windows
+
+        Returns:
+            pd.DataFrame: The candles (CANDLE_COLUMNS), sorted by window end then product_id
+        """
+        if len(trades) == 0:
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+
+        volume = trades['volume'].to_numpy()
+        side = trades['side'].to_numpy()
+        grouped = trades.assign(
+            window_start=window_start,
+            notional=trades['price'].to_numpy() * volume,
+            buy_volume=np.where(side == 'buy', volume, 0.0),
+            sell_volume=np.where(side == 'sell', volume, 0.0),
+        ).groupby(['product_id', 'window_start'], sort=False)
+        candles = grouped.agg(
+            open=('price', 'first'),
+            high=('price', 'max'),
+            low=('price', 'min'),
+            close=('price', 'last'),
+            volume=('volume', 'sum'),
+            notional=('notional', 'sum'),
+            trade_count=('price', 'size'),
+            buy_volume=('buy_volume', 'sum'),
+            sell_volume=('sell_volume', 'sum'),
+        ).reset_index()
+        candles['vwap'] = (candles['notional'] / candles['volume']).where(candles['volume'] > 0, candles['close'])
+        candles['timestamp'] = candles['window_start'] + window_ms
+        return candles.sort_values(['timestamp', 'product_id'], kind='stable')[CANDLE_COLUMNS].reset_index(drop=True)
+
+    def _forward_fill(self, candles: pd.DataFrame) -> pd.DataFrame:
+        """
+        Adds the forward-filled candles of the windows without trades: between two candles of a product, and from
+        the last candle of a product up to the watermark.
+        """
+        frames = [candles.assign(is_forward_filled=False)]
+
+        for product_id, product_candles in candles.groupby('product_id', sort=False):
+            ends = product_candles['timestamp'].to_numpy(dtype=np.int64)
+            closes = product_candles['close'].to_numpy(dtype=np.float64)
+
+            # NOTE: nothing is filled before the first candle of a product
+            last_end, last_close = self._last_candle.get(product_id, (ends[0] - self.window_ms, np.nan))
+            previous_ends = np.r_[last_end, ends[:-1]]
+            previous_closes = np.r_[last_close, closes[:-1]]
+            for i in np.flatnonzero(ends - previous_ends > self.window_ms):
+                frames.append(self._filled_candles(
+                    product_id, previous_ends[i] + self.window_ms, ends[i] - self.window_ms, previous_closes[i]
+                ))
+            self._last_candle[product_id] = (int(ends[-1]), float(closes[-1]))
+
+        # Products without trades up to the watermark. Their open windows all end after it, see process()
+        if self._watermark_ms is not None:
+            last_closed_end = self._watermark_ms // self.window_ms * self.window_ms
+            for product_id, (last_end, last_close) in self._last_candle.items():
+                if last_end < last_closed_end:
+                    frames.append(self._filled_candles(product_id, last_end + self.window_ms, last_closed_end, last_close))
+                    self._last_candle[product_id] = (last_closed_end, last_close)
+
+        if len(frames) == 1:
+            return frames[0]
+        candles = pd.concat([frame for frame in frames if len(frame)], ignore_index=True)[self.columns]
+        return candles.sort_values(['timestamp', 'product_id'], kind='stable').reset_index(drop=True)
+
+    def _filled_candles(self, product_id: str, first_end: int, last_end: int, close: float) -> pd.DataFrame:
+        """
+        Flat candles at close, no volume, for the windows ending from first_end to last_end included
+        """
+        ends = np.arange(first_end, last_end + 1, self.window_ms, dtype=np.int64)
+        self.n_forward_filled += len(ends)
+        return pd.DataFrame({
+            'timestamp': ends,
+            'product_id': product_id,
+            'open': close,
+            'high': close,
+            'low': close,
+            'close': close,
+            'volume': 0.0,
+            'notional': 0.0,
+            'vwap': close,
+            'trade_count': 0,
+            'buy_volume': 0.0,
+            'sell_volume': 0.0,
+            'is_forward_filled': True,
+        })
+
+    def pending_offsets(self) -> Dict[int, int]:
+        """
+        Returns, per partition, the offset of the earliest trade still in an open window. Committing beyond it would
+        lose that window on a restart or a rebalance.
+        """
+        if len(self._pending) == 0 or 'offset' not in self._pending:
+            return {}
+        return {int(p): int(o) for p, o in self._pending.groupby('partition')['offset'].min().items()}
+
+    def drop_partitions(self, partitions: List[int]) -> Set[str]:
+        """
+        Forgets everything about the products of the given partitions, once they are assigned to another worker.
+
+        Returns:
+            Set[str]: The products that were dropped
+        """
+        products = {product_id for product_id, partition in self._product_partition.items() if partition in partitions}
+        if len(self._pending):
+            self._pending = self._pending[~self._pending['product_id'].isin(products)].reset_index(drop=True)
+        for product_id in products:
+            self._latest_ms.pop(product_id, None)
+            self._last_candle.pop(product_id, None)
+            self._product_partition.pop(product_id, None)
+        return products
+
+    def partition_state(self, partition: int) -> dict:
+        """
+        The state of the products of a partition, for a checkpoint: the trades of their open windows, their latest
+        timestamp and their last candle. JSON serialisable.
+        """
+        products = [product_id for product_id, p in self._product_partition.items() if p == partition]
+        pending = self._pending[self._pending['partition'] == partition] if len(self._pending) else self._pending
+        return {
+            'window_seconds': self.window_ms // 1000,
+            'pending': {column: pending[column].tolist() for column in pending.columns},
+            'latest_ms': {product_id: self._latest_ms[product_id] for product_id in products if product_id in self._latest_ms},
+            'last_candle': {product_id: self._last_candle[product_id] for product_id in products if product_id in self._last_candle},
+        }
+
+    def restore_partition(self, partition: int, state: dict) -> None:
+        """
+        Restores the products of a partition from partition_state()
+        """
+        assert state['window_seconds'] * 1000 == self.window_ms, \
+            f"Checkpoint of {state['window_seconds']}s windows, the engine runs {self.window_ms // 1000}s windows"
+
+        for product_id, latest_ms in state['latest_ms'].items():
+            self._latest_ms[product_id] = latest_ms
+            self._product_partition[product_id] = partition
+        for product_id, (window_end, close) in state['last_candle'].items():
+            self._last_candle[product_id] = (window_end, close)
+
+        pending = pd.DataFrame(state['pending'])
+        if len(pending):
+            pending = pending.astype({
+                'price': np.float64, 'timestamp_ms': np.int64, 'volume': np.float64, 'partition': np.int64, 'offset': np.int64,
+            })
+            self._pending = pd.concat([self._pending, pending], ignore_index=True) if len(self._pending) else pending
+
+    def n_open_windows(self) -> int:
+        if len(self._pending) == 0:
+            return 0
+        window_start = self._pending['timestamp_ms'] // self.window_ms
+        return int(self._pending.assign(window_start=window_start).groupby(['product_id', 'window_start']).ngroups)
+
+
+# %% Trade sources
+class TopicTradeReader:
+    """
+    Consumes the trade topic in chunks of up to batch_size messages and yields them as DataFrames, with the partition
+    and offset of every trade. Polls that return nothing yield an empty chunk, so a watermark can still progress.
+    Stops once no message came in for idle_timeout_sec, i.e. the backfill has been read to the end, never if None.
+
+    With adaptive batching, the chunks are only that large while the consumer lag is high, see catch_up.py.
+
+    Offsets are only committed through commit(), by the caller, once the candles of the chunk are delivered. The
+    consumer stays open until close(), so the caller can still commit after the last chunk.
+
+    Several readers in one consumer group share the partitions:
+        - on_revoke is called with the partitions taken away by a rebalance (a worker joined or left), before they
+          go, so the caller can commit them and drop their state. The flag tells whether they are already lost,
+          i.e. owned by another worker and not committable anymore
+        - on_assign is called with the partitions it gets, their committed and end offsets, and returns the offsets
+          to resume from where they differ from the committed ones, e.g. restored from a checkpoint
+    """
+
+    def __init__(
+        self,
+        app: Application,
+        kafka_input_topic: str,
+        batch_size: int,
+        idle_timeout_sec: Optional[float],
+        on_revoke: Optional[Callable[[List[int], bool], None]] = None,
+        on_assign: Optional[Callable[[List[int], Dict[int, int], Dict[int, int]], Dict[int, int]]] = None,
+        adaptive_batching: Optional[AdaptiveBatching] = None,
+    ) -> None:
+        self.app = app
+        self.kafka_input_topic = kafka_input_topic
+        self.batch_size = batch_size
+        self.idle_timeout_sec = idle_timeout_sec
+        self.on_revoke = on_revoke
+        self.on_assign = on_assign
+        self.adaptive_batching = adaptive_batching
+        self.n_messages = 0
+        self._consumer = None
+
+    def lag(self) -> Optional[int]:
+        """
+        Messages between the consumer position and the end of the assigned partitions, None without assignment
+        """
+        assignment = self._consumer.assignment() if self._consumer is not None else []
+        if not assignment:
+            return None
+        lag = 0
+        for tp in self._consumer.position(assignment):
+            low, high = self._consumer.get_watermark_offsets(tp, timeout=10)
+            # NOTE: no position before the first fetch of the partition, it starts from its committed offset
+            offset = tp.offset if tp.offset >= 0 else self._consumer.committed([tp], timeout=10)[0].offset
+            lag += high - (offset if offset >= 0 else low)
+        return lag
+
+    def _on_assign(self, consumer, partitions: List[TopicPartition]) -> None:
+        assigned = [tp.partition for tp in partitions]
+        logger.info(f'Partitions {assigned} assigned')
+        if self.on_assign is None or not partitions:
+            return
+
+        # Where every partition would resume (the committed offset, or the start of the partition when nothing is
+        # committed, like auto_offset_reset='earliest') and where it ends right now
+        start_offsets = {}
+        end_offsets = {}
+        for tp in consumer.committed(partitions, timeout=10):
+            low, high = consumer.get_watermark_offsets(tp, timeout=10)
+            start_offsets[tp.partition] = tp.offset if tp.offset >= 0 else low
+            end_offsets[tp.partition] = high
+
+        # NOTE: the partitions are assigned explicitly, from the offsets returned by the callback where it has some
+        seek_offsets = self.on_assign(assigned, start_offsets, end_offsets)
+        for tp in partitions:
+            if tp.partition in seek_offsets:
+                tp.offset = seek_offsets[tp.partition]
+        consumer.assign(partitions)
+
+    def _on_revoke(self, consumer, partitions: List[TopicPartition]) -> None:
+        revoked = [tp.partition for tp in partitions]
+        logger.info(f'Partitions {revoked} revoked')
+        if self.on_revoke is not None:
+            self.on_revoke(revoked, False)
+
+    def _on_lost(self, consumer, partitions: List[TopicPartition]) -> None:
+        lost = [tp.partition for tp in partitions]
+        logger.warning(f'Partitions {lost} lost')
+        if self.on_revoke is not None:
+            self.on_revoke(lost, True)
+
+    def commit(self, offsets: Dict[int, int]) -> None:
+        """
+        Commits the given {partition: next offset to read}
+        """
+        if self._consumer is None or not offsets:
+            return
+        self._consumer.commit(
+            offsets=[TopicPartition(self.kafka_input_topic, partition, offset) for partition, offset in offsets.items()],
+            asynchronous=False,
+        )
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        self._consumer = self.app.get_consumer(auto_commit_enable=False)
+        self._consumer.subscribe(
+            [self.kafka_input_topic], on_assign=self._on_assign, on_revoke=self._on_revoke, on_lost=self._on_lost,
+        )
+
+        last_message_at = time.monotonic()
+        while self.idle_timeout_sec is None or time.monotonic() - last_message_at < self.idle_timeout_sec:
+            if self.adaptive_batching is None:
+                messages = self._consumer.consume(num_messages=self.batch_size, timeout=1.0)
+            else:
+                if self.adaptive_batching.check_due():
+                    self.adaptive_batching.update(self.lag(), self.n_messages)
+                messages = self._consumer.consume(
+                    num_messages=self.adaptive_batching.batch_size, timeout=self.adaptive_batching.poll_timeout_sec,
+                )
+            self.n_messages += len(messages)
+            values = []
+            partitions = []
+            offsets = []
+            for message in messages:
+                if message.error():
+                    logger.error(f'Kafka error: {message.error()}')
+                    continue
+                values.append(loads(message.value()))
+                partitions.append(message.partition())
+                offsets.append(message.offset())
+
+            if values:
+                last_message_at = time.monotonic()
+            yield pd.DataFrame({
+                'product_id': [value['product_id'] for value in values],
+                'price': np.array([value['price'] for value in values], dtype=np.float64),
+                'timestamp_ms': np.array([value['timestamp_ms'] for value in values], dtype=np.int64),
+                'volume': np.array([value['volume'] for value in values], dtype=np.float64),
+                # NOTE: trades produced before `side` existed count in neither buy nor sell volume, as in main.py
+                'side': [value.get('side') for value in values],
+                'partition': np.array(partitions, dtype=np.int64),
+                'offset': np.array(offsets, dtype=np.int64),
+            })
+
+    def close(self) -> None:
+        """
+        Closes the consumer, once the caller has committed what it wanted to
+        """
+        if self._consumer is not None:
+            self._consumer.close()
+            self._consumer = None
+
+
+def read_trades_from_store(store_dir: str) -> Iterator[pd.DataFrame]:
+    """
+    Reads the local trade store of the trade_producer service (<store_dir>/<product>/<YYYY-MM-DD>/*.parquet) one
+    UTC day at a time, every product together, and yields each day as a DataFrame sorted by timestamp.
+    Sorted by time, the store reads like a single partition.
+    """
+    product_dirs = [path for path in Path(store_dir).iterdir() if path.is_dir()]
+    days = sorted({day_dir.name for product_dir in product_dirs for day_dir in product_dir.iterdir() if day_dir.is_dir()})
+
+    for day in days:
+        frames: List[pd.DataFrame] = []
+        for product_dir in product_dirs:
+            for file_path in sorted((product_dir / day).glob('*.parquet')):
+                frame = pd.read_parquet(file_path)
+                # NOTE: files without trade_id or side predate the v3 store, same as TradeStore.read
+                if 'trade_id' in frame and 'side' in frame:
+                    frames.append(frame)
+        if not frames:
+            continue
+
+        # Neighbouring pages of the REST API overlap at their edges
+        data = pd.concat(frames).drop_duplicates(subset=['product_id', 'trade_id'])
+        data = data.sort_values(['timestamp_ms', 'trade_id'], kind='stable').reset_index(drop=True)
+        yield data.assign(partition=0)
+
+
+def batch_trade_to_ohlc(
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_broker_address: str,
+    kafka_consumer_group: str,
+    ohlc_windows_seconds: int,
+    ohlc_rollup_windows_seconds: Optional[List[int]] = None,
+    batch_source: Optional[str] = 'topic',
+    trade_store_dir: Optional[str] = None,
+    batch_size: Optional[int] = 100_000,
+    batch_idle_timeout_sec: Optional[float] = 10,
+    watermark: Optional[PartitionWatermark] = None,
+    forward_fill_empty_candles: Optional[bool] = False,
+    checkpoint_dir: Optional[str] = None,
+    checkpoint_interval_sec: Optional[float] = 5,
+    adaptive_batching: Optional[AdaptiveBatching] = None,
+    log_interval_sec: Optional[float] = 10,
+) -> None:
+    """
+    Historical counterpart of trade_to_ohlc(): reads the trades in large chunks, from the trade topic or from the
+    local trade store, computes the candles with BatchOHLCEngine and writes them to the same output topic, in the
+    same format as the streaming path.
+
+    With a watermark it also runs live (batch_idle_timeout_sec=None): windows are closed as the watermark passes
+    them instead of on the next trade of their product, and the windows without trades can be forward filled.
+
+    With a checkpoint_dir, the open windows are checkpointed every checkpoint_interval_sec, each partition with the
+    offset it was read up to, and that offset is committed right after (checkpoint.py). A restart, or the worker a
+    rebalance hands a partition to, restores the windows and resumes from the checkpoint. Without, the committed
+    offsets stay at the first trade of the open windows, which are rebuilt by re-reading from there.
+
+    Args:
+        kafka_input_topic (str): Kafka topic of the trades, when batch_source is 'topic'
+        kafka_output_topic (str): Kafka topic the candles are written to
+        kafka_broker_address (str): Kafka broker address
+        kafka_consumer_group (str): Consumer group reading the trade topic
+        ohlc_windows_seconds (int): The size of the tumbling windows
+        ohlc_rollup_windows_seconds (Optional(List[int])): Coarser window sizes rolled up from the base candles
+        batch_source (str): 'topic' or 'trade_store'
+        trade_store_dir (Optional(str)): The trade store of trade_producer, when batch_source is 'trade_store'
+        batch_size (int): Maximum number of trade messages consumed per chunk
+        batch_idle_timeout_sec (Optional(float)): Stop once the trade topic has been idle for that long, never if None
+        watermark (Optional(PartitionWatermark)): Close windows on the watermark, not only on later trades
+        forward_fill_empty_candles (bool): Emit forward-filled candles for the windows without trades
+        checkpoint_dir (Optional(str)): Where the open windows are checkpointed, when batch_source is 'topic'
+        checkpoint_interval_sec (float): Seconds between commits and checkpoints, i.e. at most what a restart replays
+        adaptive_batching (Optional(AdaptiveBatching)): Small chunks while live, large ones while the lag is high
+        log_interval_sec (float): Seconds between two progress logs
+
+    Returns:
+        None
+    """
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group,
+        auto_offset_reset='earliest',
+    )
+    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+
+    engine = BatchOHLCEngine(window_seconds=ohlc_windows_seconds, forward_fill=forward_fill_empty_candles)
+    rollup = CandleRollup(ohlc_windows_seconds, ohlc_rollup_windows_seconds) if ohlc_rollup_windows_seconds else None
+    rollup_states: Dict[str, InMemoryState] = {}
+    started_at = time.monotonic()
+
+    # Next offset to read of every partition, as far as the delivered candles go
+    next_offsets: Dict[int, int] = {}
+    checkpoint = None
+    if checkpoint_dir is not None and batch_source == 'topic':
+        checkpoint = PartitionCheckpoint(checkpoint_dir, kafka_consumer_group, kafka_input_topic)
+    recovery = RecoveryMonitor()
+
+    def committable_offsets(partitions: Optional[List[int]] = None) -> Dict[int, int]:
+        offsets = {
+            partition: offset for partition, offset in next_offsets.items()
+            if partitions is None or partition in partitions
+        }
+        if checkpoint is not None:
+            # The whole state goes in the checkpoint, open windows included, so everything read can be committed
+            for partition, offset in offsets.items():
+                engine_state = engine.partition_state(partition)
+                checkpoint.save(partition, {
+                    'next_offset': offset,
+                    'engine': engine_state,
+                    'latest_ms': watermark.partition_latest_ms(partition) if watermark is not None else None,
+                    'rollup': {
+                        product_id: rollup_states[product_id]
+                        for product_id in engine_state['latest_ms'] if product_id in rollup_states
+                    },
+                })
+            return offsets
+
+        # NOTE: never past the first trade of a window still open, a restart or the next owner of the partition
+        # re-reads it. Candles closed after that trade may then come out twice (at-least-once)
+        pending_offsets = engine.pending_offsets()
+        return {partition: min(offset, pending_offsets.get(partition, offset)) for partition, offset in offsets.items()}
+
+    def take_over_partitions(partitions: List[int], start_offsets: Dict[int, int], end_offsets: Dict[int, int]) -> Dict[int, int]:
+        # Called on a rebalance (and at start up) with the partitions assigned to this worker
+        started_at = time.monotonic()
+        seek_offsets = {}
+        for partition in partitions:
+            saved = checkpoint.load(partition) if checkpoint is not None else None
+            if saved is None:
+                continue
+            # NOTE: the checkpoint is saved before the commit, so it can only be behind the committed offset if the
+            # partition was processed without checkpoints since. It would fold those trades in twice
+            if saved['next_offset'] < start_offsets[partition]:
+                logger.warning(f'Checkpoint of partition {partition} is older than its committed offset, ignored')
+                continue
+            if saved['engine']['window_seconds'] != ohlc_windows_seconds:
+                logger.warning(f"Checkpoint of partition {partition} has {saved['engine']['window_seconds']}s windows, ignored")
+                continue
+
+            engine.restore_partition(partition, saved['engine'])
+            for product_id, state in saved['rollup'].items():
+                rollup_states[product_id] = InMemoryState(state)
+            if watermark is not None and saved['latest_ms'] is not None:
+                watermark.restore_partition(partition, saved['latest_ms'])
+            seek_offsets[partition] = next_offsets[partition] = saved['next_offset']
+
+        if seek_offsets:
+            logger.info(f'Restored partitions {sorted(seek_offsets)} from their checkpoint')
+        recovery.start(
+            start_offsets={partition: seek_offsets.get(partition, start_offsets[partition]) for partition in partitions},
+            end_offsets=end_offsets,
+            restore_sec=time.monotonic() - started_at,
+        )
+        return seek_offsets
+
+    def hand_over_partitions(partitions: List[int], lost: bool) -> None:
+        # Called on a rebalance, before the partitions go to another worker of the consumer group
+        if not lost:
+            reader.commit(committable_offsets(partitions))
+        for product_id in engine.drop_partitions(partitions):
+            rollup_states.pop(product_id, None)
+        if watermark is not None:
+            watermark.drop_partitions(partitions)
+        recovery.drop_partitions(partitions)
+        for partition in partitions:
+            next_offsets.pop(partition, None)
+
+    reader = None
+    if batch_source == 'topic':
+        reader = TopicTradeReader(
+            app, kafka_input_topic, batch_size, batch_idle_timeout_sec,
+            on_revoke=hand_over_partitions, on_assign=take_over_partitions, adaptive_batching=adaptive_batching,
+        )
+        chunks = iter(reader)
+    else:
+        chunks = read_trades_from_store(trade_store_dir)
+    last_commit_at = last_log_at = time.monotonic()
+
+    try:
+        with app.get_producer() as producer:
+            for trades in chunks:
+                if watermark is not None:
+                    watermark.update(trades['partition'].to_numpy(), trades['timestamp_ms'].to_numpy())
+                    candles = engine.process(trades, watermark.get())
+                else:
+                    candles = engine.process(trades)
+                # NOTE: rebalances only happen while consuming, i.e. once the candles of this chunk are flushed
+                if reader is not None and len(trades):
+                    for partition, offset in trades.groupby('partition')['offset'].max().items():
+                        next_offsets[int(partition)] = int(offset) + 1
+                recovery.update(next_offsets)
+                if len(trades) == 0 and len(candles) == 0:
+                    continue
+
+                # Same key (product_id) and value as the streaming path's to_topic()
+                for candle in candles.to_dict(orient='records'):
+                    candle['timestamp'] = int(candle['timestamp'])
+                    candle['trade_count'] = int(candle['trade_count'])
+                    candle['is_forward_filled'] = bool(candle['is_forward_filled'])
+                    # NOTE: the base candles are few compared to the trades, the roll-up runs the streaming code as is
+                    if rollup is not None:
+                        state = rollup_states.setdefault(candle['product_id'], InMemoryState())
+                        output_candles = rollup.update(candle, state)
+                    else:
+                        output_candles = [candle]
+                    for output_candle in output_candles:
+                        message = output_topic.serialize(key=output_candle['product_id'], value=output_candle)
+                        producer.produce(topic=output_topic.name, key=message.key, value=message.value)
+                producer.flush()
+
+                # NOTE: live chunks come every few hundred ms, commits and logs go at their own pace
+                if reader is not None and time.monotonic() - last_commit_at >= checkpoint_interval_sec:
+                    reader.commit(committable_offsets())
+                    last_commit_at = time.monotonic()
+
+                if time.monotonic() - last_log_at >= log_interval_sec:
+                    last_log_at = time.monotonic()
+                    elapsed_sec = max(last_log_at - started_at, 1e-9)
+                    lag = f', lag {adaptive_batching.lag} messages' if adaptive_batching is not None else ''
+                    logger.info(
+                        f'{engine.n_trades} trades -> {engine.n_candles} candles '
+                        f'({engine.n_trades / elapsed_sec:.0f} trades/sec), {engine.n_late_trades} late trades dropped, '
+                        f'{engine.n_forward_filled} forward filled{lag}'
+                    )
+
+        # Last commit. With checkpoints, the windows still open are picked up by the next run
+        if reader is not None:
+            reader.commit(committable_offsets())
+    finally:
+        if reader is not None:
+            reader.close()
+
+    # NOTE: like `.final()` in the streaming path, the windows that are still open (after the watermark) are not emitted
+    elapsed_sec = max(time.monotonic() - started_at, 1e-9)
+    logger.info(
+        f'Done, {engine.n_trades} trades -> {engine.n_candles} candles ({engine.n_trades / elapsed_sec:.0f} trades/sec), '
+        f'{engine.n_open_windows()} windows still open'
+    )
@@ -0,0 +1,125 @@
+# Micro-benchmark of the tumbling window reducer: the compact list state (candle_state.py) against the dict reducer it replaced
+#
+# Usage: poetry run python src/benchmark_reducer.py [--n-trades 500000] [--trades-per-window 100]
+import argparse
+import random
+import time
+from typing import Callable, List, Tuple
+
+from loguru import logger
+from quixstreams.utils.json import dumps, loads
+
+from candle_state import candle_state_to_dict, init_candle_state, update_candle_state
+
+
+# %% The dict reducer, as it was in main.py before the compact state
+def init_dict_candle(trade: dict) -> dict:
+    return {
+        "open": trade["price"],
+        "high": trade["price"],
+        "low": trade["price"],
+        "close": trade["price"],
+        "product_id": trade["product_id"],
+        "volume": trade["volume"],
+        "notional": trade["price"] * trade["volume"],
+        "vwap": trade["price"],
+        "trade_count": 1,
+        "buy_volume": trade["volume"] if trade.get("side") == "buy" else 0.0,
+        "sell_volume": trade["volume"] if trade.get("side") == "sell" else 0.0,
+    }
+
+
+def update_dict_candle(ohlc_candle: dict, trade: dict) -> dict:
+    volume = ohlc_candle["volume"] + trade["volume"]
+    notional = ohlc_candle["notional"] + trade["price"] * trade["volume"]
+    return {
+        "open": ohlc_candle["open"],
+        "high": max(ohlc_candle["high"], trade["price"]),
+        "low": min(ohlc_candle["low"], trade["price"]),
+        "close": trade["price"],
+        "product_id": trade["product_id"],
+        "volume": volume,
+        "notional": notional,
+        "vwap": notional / volume if volume > 0 else trade["price"],
+        "trade_count": ohlc_candle["trade_count"] + 1,
+        "buy_volume": ohlc_candle["buy_volume"] + (trade["volume"] if trade.get("side") == "buy" else 0.0),
+        "sell_volume": ohlc_candle["sell_volume"] + (trade["volume"] if trade.get("side") == "sell" else 0.0),
+    }
+
+
+# %% Benchmark
+def make_trades(n_trades: int) -> List[dict]:
+    random.seed(0)
+    price = 63_500.0
+    trades = []
+    for _ in range(n_trades):
+        price += random.gauss(0, 5)
+        trades.append({
+            'product_id': 'BTC/USD',
+            'price': round(price, 2),
+            'volume': round(random.expovariate(10), 8),
+            'side': random.choice(('buy', 'sell')),
+        })
+    return trades
+
+
+def run(
+    trades: List[dict],
+    trades_per_window: int,
+    initializer: Callable,
+    reducer: Callable,
+    with_state_store: bool,
+) -> Tuple[float, float]:
+    """
+    Folds the trades into windows of trades_per_window trades.
+    With with_state_store, the state also goes through a JSON round trip on every trade, like in the Quix state store.
+
+    Returns:
+        Tuple[float, float]: trades/sec, and the average size of the serialised state of a closed window in bytes
+    """
+    n_bytes = 0
+    n_windows = 0
+    started_at = time.perf_counter()
+
+    state = None
+    for i, trade in enumerate(trades):
+        if i % trades_per_window == 0:
+            if state is not None:
+                n_bytes += len(dumps(state))
+                n_windows += 1
+            state = initializer(trade)
+        else:
+            if with_state_store:
+                state = loads(dumps(state))
+            state = reducer(state, trade)
+
+    elapsed_sec = time.perf_counter() - started_at
+    return len(trades) / elapsed_sec, n_bytes / max(n_windows, 1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-trades', type=int, default=500_000)
+    parser.add_argument('--trades-per-window', type=int, default=100)
+    args = parser.parse_args()
+
+    trades = make_trades(args.n_trades)
+
+    # Both reducers must give the same candle
+    dict_candle = init_dict_candle(trades[0])
+    compact_state = init_candle_state(trades[0])
+    for trade in trades[1:args.trades_per_window]:
+        dict_candle = update_dict_candle(dict_candle, trade)
+        compact_state = update_candle_state(compact_state, trade)
+    assert candle_state_to_dict(compact_state) == {key: dict_candle[key] for key in candle_state_to_dict(compact_state)}
+
+    for with_state_store in (False, True):
+        results = {
+            'dict': run(trades, args.trades_per_window, init_dict_candle, update_dict_candle, with_state_store),
+            'compact': run(trades, args.trades_per_window, init_candle_state, update_candle_state, with_state_store),
+        }
+        label = 'reducer + state serialisation' if with_state_store else 'reducer only'
+        for name, (trades_per_sec, bytes_per_window) in results.items():
+            logger.info(f'{label:<30} {name:<8} {trades_per_sec:>12,.0f} trades/sec {bytes_per_window:>8.0f} state bytes/window')
+        logger.info(f"{label:<30} speed-up x{results['compact'][0] / results['dict'][0]:.2f}")
@@ -0,0 +1,116 @@
+# Coarser candles (e.g. 5m, 1h) rolled up from the base candles, so one pass over the trades serves every resolution
+from typing import Dict, List
+
+
+class InMemoryState(dict):
+    """
+    Minimal stand-in for the Quix State (get/set) when the roll-up runs outside a StreamingDataFrame, e.g. in batch mode
+    """
+
+    def set(self, key: str, value) -> None:
+        self[key] = value
+
+
+class CandleRollup:
+    """
+    Maintains a hierarchy of window sizes on top of the base candles of trade_to_ohlc. Every level is rolled up from
+    the closed candles of the level below it, never from the raw trades:
+        open = first open, high = max high, low = min low, close = last close, timestamp = window end
+        volume, notional, trade_count, buy/sell volume = sums, vwap = notional / volume
+
+    A coarse window is closed as soon as the candle ending on its boundary comes in, or, when that sub-window had no
+    trades, when the first candle of a later window comes in. The candles of a product come in order (the Quix
+    windows are per key), so nothing can be late.
+
+    The open candle of every level is kept in the state of the product, which is the Quix State of the message key
+    in the streaming path, so it survives restarts like the tumbling window state does.
+
+    Every candle, the base ones included, gets a `window_seconds` field so the resolutions can share the output topic.
+    """
+
+    def __init__(self, base_window_seconds: int, rollup_windows_seconds: List[int]) -> None:
+        """
+        Args:
+            base_window_seconds (int): The window size of the candles computed from the trades
+            rollup_windows_seconds (List[int]): The coarser window sizes. Each one must be a multiple of the one below
+
+        Returns:
+            None
+        """
+        self.windows_seconds = [int(base_window_seconds)] + sorted(int(w) for w in rollup_windows_seconds)
+        for finer, coarser in zip(self.windows_seconds, self.windows_seconds[1:]):
+            assert coarser > finer and coarser % finer == 0, \
+                f'Roll-up window {coarser}s is not a multiple of {finer}s'
+
+    def update(self, candle: dict, state) -> List[dict]:
+        """
+        Adds a closed base candle and returns it along with every coarser candle it closed, finest first.
+        Made to be used as `sdf.apply(rollup.update, stateful=True, expand=True)`.
+
+        Args:
+            candle (dict): A closed base candle, with its window end as timestamp
+            state: The Quix State of the product (or an InMemoryState)
+
+        Returns:
+            List[dict]: The candles to emit
+        """
+        closed = [{**candle, 'window_seconds': self.windows_seconds[0]}]
+
+        # The candles closed at one level are the input of the next one
+        incoming = closed
+        for window_seconds in self.windows_seconds[1:]:
+            incoming = self._update_level(window_seconds, incoming, state)
+            closed.extend(incoming)
+        return closed
+
+    def _update_level(self, window_seconds: int, candles: List[dict], state) -> List[dict]:
+        window_ms = window_seconds * 1000
+        key = f'rollup_{window_seconds}'
+        current = state.get(key, None)
+        closed = []
+
+        for candle in candles:
+            sub_window_ms = candle['window_seconds'] * 1000
+            window_end = (candle['timestamp'] - sub_window_ms) // window_ms * window_ms + window_ms
+
+            # A candle of a later window closes the current one, its last sub-window(s) had no trades
+            if current is not None and current['timestamp'] < window_end:
+                closed.append(current)
+                current = None
+
+            if current is None:
+                current = {**candle, 'timestamp': window_end, 'window_seconds': window_seconds}
+            else:
+                current = merge_candles(current, candle)
+
+            # The candle ending on the boundary completes the window
+            if candle['timestamp'] == window_end:
+                closed.append(current)
+                current = None
+
+        state.set(key, current)
+        return closed
+
+
+def merge_candles(candle: dict, next_candle: dict) -> Dict:
+    """
+    Merges next_candle, the following candle of the same product, into candle, keeping the timestamp and
+    window_seconds of candle.
+    """
+    volume = candle['volume'] + next_candle['volume']
+    notional = candle['notional'] + next_candle['notional']
+    return {
+        **candle,
+        'high': max(candle['high'], next_candle['high']),
+        'low': min(candle['low'], next_candle['low']),
+        'close': next_candle['close'],
+        'volume': volume,
+        'notional': notional,
+        'vwap': notional / volume if volume > 0 else next_candle['close'],
+        'trade_count': candle['trade_count'] + next_candle['trade_count'],
+        'buy_volume': candle['buy_volume'] + next_candle['buy_volume'],
+        'sell_volume': candle['sell_volume'] + next_candle['sell_volume'],
+        # A coarse candle is only forward filled when all its sub-windows are
+        **({'is_forward_filled': candle['is_forward_filled'] and next_candle['is_forward_filled']}
+           if 'is_forward_filled' in candle else {}),
+    }
@@ -0,0 +1,121 @@
+# Compact, fixed-layout state of an open OHLC window, updated in place by the tumbling window reducer
+from typing import List
+
+# Layout of the state list. NOTE: append new fields at the end, the states already in the state store keep their positions
+OPEN, HIGH, LOW, CLOSE, VOLUME, NOTIONAL, TRADE_COUNT, BUY_VOLUME, SELL_VOLUME, PRODUCT_ID = range(10)
+
+CandleState = List  # [open, high, low, close, volume, notional, trade_count, buy_volume, sell_volume, product_id]
+
+
+def init_candle_state(trade: dict) -> CandleState:
+    """
+    Initialiser of the tumbling window: the state of a new window, from its first trade.
+
+    The Quix state store JSON-serialises the window state on every update, so the state is a flat list instead of a
+    dict: no key names in the serialised bytes, no new dict per trade, and the product_id is only written once per
+    window. vwap is derived when the candle is emitted, see candle_state_to_dict().
+
+    Args:
+        trade (dict): The first trade of the window
+
+    Returns:
+        CandleState: The state of the window
+    """
+    price = trade['price']
+    volume = trade['volume']
+    side = trade.get('side')
+    return [
+        price,
+        price,
+        price,
+        price,
+        volume,
+        price * volume,
+        1,
+        # NOTE: trades produced before `side` existed count in neither buy nor sell volume
+        volume if side == 'buy' else 0.0,
+        volume if side == 'sell' else 0.0,
+        trade['product_id'],
+    ]
+
+
+def candle_state_from_dict(candle: dict) -> CandleState:
+    """
+    Migrates the state of a window opened before the compact state: the dict of the old reducer, with or without the
+    volume fields. Such windows are still in the state store (and its changelog) right after a deploy. The fields the
+    dict did not track count as zero.
+
+    Args:
+        candle (dict): The old window state
+
+    Returns:
+        CandleState: The same window in the list layout
+    """
+    return [
+        candle['open'],
+        candle['high'],
+        candle['low'],
+        candle['close'],
+        candle.get('volume', 0.0),
+        candle.get('notional', 0.0),
+        candle.get('trade_count', 0),
+        candle.get('buy_volume', 0.0),
+        candle.get('sell_volume', 0.0),
+        candle['product_id'],
+    ]
+
+
+def update_candle_state(state: CandleState, trade: dict) -> CandleState:
+    """
+    Reducer of the tumbling window: folds the next trade into the state, in place.
+
+    Args:
+        state (CandleState): The state of the window
+        trade (dict): New incoming trade in the sequence
+
+    Returns:
+        CandleState: The same (updated) state object, a new one for a migrated dict state
+    """
+    # NOTE: a window opened by the dict reducer, before the deploy. It is migrated on its first trade
+    if isinstance(state, dict):
+        state = candle_state_from_dict(state)
+
+    price = trade['price']
+    volume = trade['volume']
+    if price > state[HIGH]:
+        state[HIGH] = price
+    elif price < state[LOW]:
+        state[LOW] = price
+    state[CLOSE] = price
+    state[VOLUME] += volume
+    state[NOTIONAL] += price * volume
+    state[TRADE_COUNT] += 1
+
+    side = trade.get('side')
+    if side == 'buy':
+        state[BUY_VOLUME] += volume
+    elif side == 'sell':
+        state[SELL_VOLUME] += volume
+    return state
+
+
+def candle_state_to_dict(state: CandleState) -> dict:
+    """
+    The candle fields of a closed window, in the output format (timestamp excluded)
+    """
+    if isinstance(state, dict):
+        state = candle_state_from_dict(state)
+    volume = state[VOLUME]
+    return {
+        'product_id': state[PRODUCT_ID],
+        'open': state[OPEN],
+        'high': state[HIGH],
+        'low': state[LOW],
+        'close': state[CLOSE],
+        'volume': volume,
+        'notional': state[NOTIONAL],
+        'vwap': state[NOTIONAL] / volume if volume > 0 else state[CLOSE],
+        'trade_count': state[TRADE_COUNT],
+        'buy_volume': state[BUY_VOLUME],
+        'sell_volume': state[SELL_VOLUME],
+    }
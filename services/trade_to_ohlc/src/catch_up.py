@@ -0,0 +1,110 @@
+# Adaptive micro-batching: small chunks while the consumer keeps up, large vectorized ones while it is behind
+import time
+from typing import Optional
+
+from loguru import logger
+
+
+class AdaptiveBatching:
+    """
+    Chooses how the trade topic is consumed from the consumer lag (messages between the consumer position and the
+    end of its partitions), checked every lag_check_interval_sec:
+
+        - live: up to live_batch_size messages, waiting at most live_poll_timeout_sec for them. A trade is
+          processed within that timeout, and a small burst still comes in as one chunk
+        - catch-up, once the lag passes catch_up_lag_threshold (after an outage, or a burst): chunks of
+          catch_up_batch_size messages, aggregated vectorized and written in bulk, until the lag is back under a
+          tenth of the threshold (hysteresis, so it does not flip on every check)
+
+    While catching up, the lag and the catch-up rate are logged at every check.
+    """
+
+    def __init__(
+        self,
+        catch_up_lag_threshold: int,
+        catch_up_batch_size: int,
+        live_batch_size: Optional[int] = 100,
+        live_poll_timeout_sec: Optional[float] = 0.1,
+        lag_check_interval_sec: Optional[float] = 5,
+    ) -> None:
+        """
+        Args:
+            catch_up_lag_threshold (int): Lag, in messages, from which the consumer catches up
+            catch_up_batch_size (int): Maximum messages per chunk while catching up
+            live_batch_size (int): Maximum messages per chunk while live
+            live_poll_timeout_sec (float): Longest wait for a live chunk
+            lag_check_interval_sec (float): Seconds between two lag checks
+
+        Returns:
+            None
+        """
+        self.catch_up_lag_threshold = catch_up_lag_threshold
+        self.catch_up_batch_size = catch_up_batch_size
+        self.live_batch_size = live_batch_size
+        self.live_poll_timeout_sec = live_poll_timeout_sec
+        self.lag_check_interval_sec = lag_check_interval_sec
+
+        self.catching_up = False
+        self.lag: Optional[int] = None
+        self._last_check_at: Optional[float] = None
+
+        # Progress of the current catch-up: (time, lag, messages consumed) at its start and at the last check
+        self._catch_up_start: Optional[tuple] = None
+        self._last_check: Optional[tuple] = None
+
+    @property
+    def batch_size(self) -> int:
+        return self.catch_up_batch_size if self.catching_up else self.live_batch_size
+
+    @property
+    def poll_timeout_sec(self) -> float:
+        return 1.0 if self.catching_up else self.live_poll_timeout_sec
+
+    def check_due(self) -> bool:
+        return self._last_check_at is None or time.monotonic() - self._last_check_at >= self.lag_check_interval_sec
+
+    def update(self, lag: Optional[int], n_messages: int) -> None:
+        """
+        Args:
+            lag (Optional[int]): The current consumer lag, None while no partition is assigned
+            n_messages (int): Messages consumed so far
+
+        Returns:
+            None
+        """
+        now = time.monotonic()
+        self._last_check_at = now
+        self.lag = lag
+        if lag is None:
+            return
+
+        if not self.catching_up and lag > self.catch_up_lag_threshold:
+            self.catching_up = True
+            self._catch_up_start = self._last_check = (now, lag, n_messages)
+            logger.info(f'Consumer lag {lag} messages, catching up in chunks of {self.catch_up_batch_size}')
+            return
+        if not self.catching_up:
+            return
+
+        started_at, start_lag, start_messages = self._catch_up_start
+        last_at, last_lag, last_messages = self._last_check
+        self._last_check = (now, lag, n_messages)
+
+        if lag < self.catch_up_lag_threshold / 10:
+            self.catching_up = False
+            elapsed_sec = max(now - started_at, 1e-9)
+            logger.info(
+                f'Caught up in {elapsed_sec:.1f} sec: {n_messages - start_messages} messages '
+                f'({(n_messages - start_messages) / elapsed_sec:.0f} messages/sec), lag {start_lag} -> {lag}'
+            )
+            return
+
+        # Catch-up rate: how fast the lag goes down, the consumption rate minus the rate trades come in
+        interval_sec = max(now - last_at, 1e-9)
+        consumed_per_sec = (n_messages - last_messages) / interval_sec
+        lag_drop_per_sec = (last_lag - lag) / interval_sec
+        eta = f'{lag / lag_drop_per_sec:.0f} sec' if lag_drop_per_sec > 0 else 'never at this rate'
+        logger.info(
+            f'Catching up: lag {lag} messages, consuming {consumed_per_sec:.0f} messages/sec, '
+            f'lag down {lag_drop_per_sec:.0f} messages/sec, caught up in {eta}'
+        )
@@ -0,0 +1,133 @@
+# Checkpoints of the open windows of the chunked engine, one file per partition, saved together with the offset to
+# resume from so a restart restores the windows instead of replaying the trade topic
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from loguru import logger
+from quixstreams.utils.json import dumps, loads
+
+
+class PartitionCheckpoint:
+    """
+    Saves and loads the state of one partition of the trade topic:
+
+        {
+            'partition': 0,
+            'saved_at_ms': 1717667931000,
+            'next_offset': 18233,          # the first offset not folded into the state
+            'engine': {...},               # BatchOHLCEngine.partition_state(), open windows included
+            'latest_ms': 1717667928000,    # latest trade timestamp of the partition, for the PartitionWatermark
+            'rollup': {product_id: {...}}, # the roll-up state of every product of the partition
+        }
+
+    The state and the offset are written in the same file, atomically (write to a temporary file, then rename), and
+    the offset is only committed to Kafka after the file is written. The checkpoint can therefore be ahead of the
+    committed offset (a crash between the two), never behind, so on assignment the consumer seeks to the offset of
+    the checkpoint rather than the committed one: no trade is folded in twice, none is skipped.
+
+    The files are per partition, not per worker, so a partition moved by a rebalance, or a worker restarted with a
+    different N_WORKERS, is restored from the same file.
+    """
+
+    def __init__(self, checkpoint_dir: str, consumer_group: str, topic: str) -> None:
+        """
+        Args:
+            checkpoint_dir (str): Root directory of the checkpoints, shared by the workers
+            consumer_group (str): Consumer group of the workers, a checkpoint only belongs to one
+            topic (str): The trade topic
+
+        Returns:
+            None
+        """
+        self.dir = Path(checkpoint_dir) / consumer_group / topic
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, partition: int) -> Path:
+        return self.dir / f'partition-{partition}.json'
+
+    def save(self, partition: int, checkpoint: dict) -> None:
+        path = self._path(partition)
+        tmp_path = path.with_suffix(f'.json.tmp-{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            f.write(dumps({**checkpoint, 'partition': partition, 'saved_at_ms': int(time.time() * 1000)}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load(self, partition: int) -> Optional[dict]:
+        path = self._path(partition)
+        if not path.exists():
+            return None
+        try:
+            return loads(path.read_bytes())
+        except ValueError:
+            logger.error(f'Unreadable checkpoint {path}, partition {partition} resumes from the committed offset')
+            return None
+
+
+class RecoveryMonitor:
+    """
+    Measures how long a restart takes to be back at the head of the topic: from the assignment of restored
+    partitions until every one of them has been read up to the end offset it had when it was assigned.
+
+    Only the trades after the checkpoint are replayed, so on a deploy this should be seconds, not a topic replay.
+    """
+
+    def __init__(self) -> None:
+        self._end_offsets: Dict[int, int] = {}
+        self._started_at: Optional[float] = None
+        self._restore_sec = 0.0
+        self._start_offsets: Dict[int, int] = {}
+
+        # Last completed recovery
+        self.last_recovery_sec: Optional[float] = None
+        self.last_replayed_trades = 0
+
+    def start(self, start_offsets: Dict[int, int], end_offsets: Dict[int, int], restore_sec: float) -> None:
+        """
+        Args:
+            start_offsets (Dict[int, int]): The offset every partition resumes from
+            end_offsets (Dict[int, int]): The end offset of every partition at assignment
+            restore_sec (float): Time spent loading the checkpoints
+
+        Returns:
+            None
+        """
+        if self._started_at is None:
+            self._started_at = time.monotonic() - restore_sec
+            self._restore_sec = 0.0
+        self._restore_sec += restore_sec
+        self._start_offsets.update(start_offsets)
+        self._end_offsets.update(end_offsets)
+
+    def drop_partitions(self, partitions: List[int]) -> None:
+        for partition in partitions:
+            self._end_offsets.pop(partition, None)
+            self._start_offsets.pop(partition, None)
+
+    def update(self, next_offsets: Dict[int, int]) -> None:
+        """
+        Marks the partitions read up to their end offset as caught up, and logs the recovery time once all are
+        """
+        if self._started_at is None:
+            return
+        caught_up = [
+            partition for partition, end_offset in self._end_offsets.items()
+            if next_offsets.get(partition, self._start_offsets[partition]) >= end_offset
+        ]
+        if len(caught_up) < len(self._end_offsets):
+            return
+
+        self.last_recovery_sec = time.monotonic() - self._started_at
+        self.last_replayed_trades = sum(
+            max(self._end_offsets[partition] - self._start_offsets[partition], 0) for partition in self._end_offsets
+        )
+        logger.info(
+            f'Recovered partitions {sorted(self._end_offsets)} in {self.last_recovery_sec:.2f} sec: checkpoints '
+            f'restored in {self._restore_sec * 1000:.0f} ms, {self.last_replayed_trades} trades replayed'
+        )
+        self._started_at = None
+        self._end_offsets = {}
+        self._start_offsets = {}
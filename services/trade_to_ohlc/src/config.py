@@ -1,5 +1,6 @@
 # %% New and simpler config
-from typing import Optional
+from typing import List, Optional
+from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
 class Config(BaseSettings):
@@ -12,6 +13,28 @@ class Config(BaseSettings):
         kafka_output_topic (str): The name of the Kafka topic where the OHLC data is written to.
         ohlc_window_seconds (int): The window size in seconds for OHLC aggregation.
         kafka_consumer_group (str): The group in which the output kafka topic is held
+        ohlc_rollup_windows_seconds (List[int]): Coarser window sizes rolled up from the base candles, e.g. [300, 3600]
+        ohlc_close_windows_on (str): 'next_trade' (Quix `.final()`) or 'watermark' (watermark.py, with empty candles)
+        watermark_lateness_seconds (float): How far the watermark stays behind the event time progress
+        watermark_idle_partition_seconds (float): Seconds without message before a partition stops holding the watermark
+        watermark_wall_clock (bool): The watermark follows the wall clock once the consumer is caught up (live data)
+        forward_fill_empty_candles (bool): In watermark mode, emit forward-filled candles for the windows without trades
+        ohlc_batch_mode (bool): Compute the candles of a historical backfill in vectorized chunks (batch_ohlc.py)
+        batch_source (str): Where batch mode reads the trades from, 'topic' or 'trade_store'
+        trade_store_dir (str): The local trade store of trade_producer (its cache_dir), for batch_source='trade_store'
+        batch_size (int): Maximum number of trade messages consumed per chunk in batch mode
+        batch_idle_timeout_sec (float): Batch mode stops once the trade topic has been idle for that long
+        kafka_num_partitions (int): Partitions of the input and output topics when this service creates them
+        n_workers (int): Worker processes sharing the partitions of the trade topic, in one consumer group
+        state_dir (str): Local state of the streaming windows, one sub-directory per worker
+        checkpoint_dir (str): Checkpoints of the open windows of the chunked engine, shared by the workers. None: off
+        checkpoint_interval_sec (float): Seconds between checkpoints / commits, i.e. at most what a restart replays
+        adaptive_batching (bool): Run live on the chunked engine, per-message chunks that grow into vectorized
+            catch-up chunks while the consumer lags (catch_up.py), instead of the per-message Quix path
+        catch_up_lag_threshold (int): Consumer lag in messages from which the service catches up in batch_size chunks
+        live_batch_size (int): Maximum messages per chunk while live
+        live_poll_timeout_sec (float): Longest wait for a live chunk, i.e. the added latency
+        lag_check_interval_sec (float): Seconds between two consumer lag checks
     """
 # TODO: Hard code in the variables and print statements. Ensure kafka groups also work and are populated. Ensure timestamps work for historical
 
@@ -41,6 +64,49 @@ class Config(BaseSettings):
     kafka_output_topic_name: str = 'ohlc'
     kafka_consumer_group: str = 'trade_to_ohlc_live'
     ohlc_windows_seconds: int = '20'
+    ohlc_rollup_windows_seconds: List[int] = []
+
+# Window closing
+    ohlc_close_windows_on: str = 'next_trade'
+    watermark_lateness_seconds: float = 2
+    watermark_idle_partition_seconds: float = 10
+    watermark_wall_clock: bool = True
+    forward_fill_empty_candles: bool = True
+
+# Batch mode, for historical backfills
+    ohlc_batch_mode: bool = False
+    batch_source: str = 'topic'
+    trade_store_dir: Optional[str] = None
+    batch_size: int = 100_000
+    batch_idle_timeout_sec: float = 10
+
+# Scaling: one worker per partition at most
+    kafka_num_partitions: int = 1
+    n_workers: int = 1
+    state_dir: str = 'state'
+
+# Restarts: checkpoint the open windows with their offsets instead of re-reading the topic
+    checkpoint_dir: Optional[str] = 'state/checkpoints'
+    checkpoint_interval_sec: float = 5
+
+# Adaptive micro-batching: catch up in large chunks when the consumer lags. Off by default, the per-message Quix path
+    adaptive_batching: bool = False
+    catch_up_lag_threshold: int = 50_000
+    live_batch_size: int = 100
+    live_poll_timeout_sec: float = 0.1
+    lag_check_interval_sec: float = 5
+
+    @field_validator('ohlc_close_windows_on')
+    @classmethod
+    def validate_ohlc_close_windows_on(cls, value):
+        assert value in {'next_trade', 'watermark'}, f'Invalid value for ohlc_close_windows_on: {value}'
+        return value
+
+    @field_validator('batch_source')
+    @classmethod
+    def validate_batch_source(cls, value):
+        assert value in {'topic', 'trade_store'}, f'Invalid value for batch_source: {value}'
+        return value
     
 config_trade_to_ohlc = Config()
 print(f"\n--- Final Configuration ---")
@@ -49,6 +115,12 @@ print(f"Kafka Input Topic: {config_trade_to_ohlc.kafka_input_topic_name}")
 print(f"Kafka Output Topic: {config_trade_to_ohlc.kafka_output_topic_name}")
 print(f"Kafka Consumer Group: {config_trade_to_ohlc.kafka_consumer_group}")
 print(f"OHLC Window Seconds: {config_trade_to_ohlc.ohlc_windows_seconds}")
+print(f"OHLC Roll-up Window Seconds: {config_trade_to_ohlc.ohlc_rollup_windows_seconds}")
+print(f"OHLC Close Windows On: {config_trade_to_ohlc.ohlc_close_windows_on}")
+print(f"OHLC Batch Mode: {config_trade_to_ohlc.ohlc_batch_mode} ({config_trade_to_ohlc.batch_source})")
+print(f"Workers: {config_trade_to_ohlc.n_workers} ({config_trade_to_ohlc.kafka_num_partitions} partitions)")
+print(f"Checkpoints: {config_trade_to_ohlc.checkpoint_dir} (every {config_trade_to_ohlc.checkpoint_interval_sec} sec)")
+print(f"Adaptive Batching: {config_trade_to_ohlc.adaptive_batching} (catch up from a lag of {config_trade_to_ohlc.catch_up_lag_threshold})")
 
 
 # %% Old
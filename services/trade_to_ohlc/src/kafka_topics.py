@@ -0,0 +1,51 @@
+# Creates the Kafka topics up front with a configured number of partitions, instead of the broker defaults
+from confluent_kafka import KafkaError, KafkaException
+from confluent_kafka.admin import AdminClient, NewTopic
+from loguru import logger
+
+
+def ensure_topic(
+    broker_address: str,
+    topic_name: str,
+    num_partitions: int,
+    replication_factor: int = 1,
+) -> None:
+    """
+    Creates topic_name with num_partitions partitions if it doesn't exist yet.
+
+    The partitions are the unit of parallelism downstream: trades are keyed by product_id, so every pair lands in
+    one partition, and each trade_to_ohlc worker of the consumer group gets a share of the partitions.
+
+    NOTE: an existing topic is left as it is, even with another number of partitions. Adding partitions moves keys
+    to other partitions, which breaks the per-pair ordering and the partition-local window state.
+
+    Args:
+        broker_address (str): The Kafka broker address
+        topic_name (str): The topic to create
+        num_partitions (int): Number of partitions of a new topic
+        replication_factor (int): Replication factor of a new topic
+
+    Returns:
+        None
+    """
+    admin = AdminClient({'bootstrap.servers': broker_address})
+
+    topic_metadata = admin.list_topics(timeout=10).topics.get(topic_name)
+    if topic_metadata is not None and topic_metadata.error is None:
+        if len(topic_metadata.partitions) != num_partitions:
+            logger.warning(
+                f'Topic {topic_name} already exists with {len(topic_metadata.partitions)} partitions '
+                f'instead of {num_partitions}, leaving it as it is'
+            )
+        return
+
+    futures = admin.create_topics([
+        NewTopic(topic_name, num_partitions=num_partitions, replication_factor=replication_factor)
+    ])
+    try:
+        futures[topic_name].result()
+        logger.info(f'Created topic {topic_name} with {num_partitions} partitions')
+    except KafkaException as e:
+        # Another process (e.g. a worker of the same consumer group) created it in the meantime
+        if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+            raise
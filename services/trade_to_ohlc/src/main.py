@@ -1,9 +1,17 @@
 
+import os
 from quixstreams import Application
 from datetime import timedelta
 from loguru import logger
 from typing import Any, List, Optional, Tuple
 
+from batch_ohlc import batch_trade_to_ohlc
+from catch_up import AdaptiveBatching
+from candle_rollup import CandleRollup
+from candle_state import candle_state_to_dict, init_candle_state, update_candle_state
+from kafka_topics import ensure_topic
+from watermark import PartitionWatermark
+from workers import run_workers
 from config import config_trade_to_ohlc #from src.config import config_trade_to_ohlc doesn't work like it does for main.trade_producer. Root library might be in this service
 
 def custom_ts_extractor(
@@ -40,6 +48,9 @@ def trade_to_ohlc(
         kafka_broker_address: str,
         kafka_consumer_group: str,
         ohlc_windows_seconds: int,
+        ohlc_rollup_windows_seconds: Optional[List[int]] = None,
+        state_dir: Optional[str] = 'state',
+        commit_interval_sec: Optional[float] = 5,
 )-> None:
     """
     Takes the stream of trading information from the input kafka topic address, slices the data into a window measured in seconds, to create candles for open, close, high and low
@@ -58,6 +69,10 @@ def trade_to_ohlc(
         kaka_output_topic: str: Kafka topic where the open,high,low,close data is stored as part of feature pipeline
         kaka_broker_address: str: Kafka broker address..duh
         window_seconds: the time interval over which the data streams is sliced to determine candle sticks
+        ohlc_rollup_windows_seconds: coarser window sizes rolled up from the candles above, e.g. [300, 3600]. All the
+            resolutions share the output topic and carry a `window_seconds` field, see candle_rollup.py
+        state_dir: local state of the windows. Each worker process needs its own, see run_worker()
+        commit_interval_sec: how often the window state is checkpointed along with the committed offsets
     return:
         none
 
@@ -71,6 +86,14 @@ def trade_to_ohlc(
         consumer_group=kafka_consumer_group,
         auto_offset_reset= 'earliest', 
         #could pick 'latest' which tells the application to retrieve the latest messages in the input topic.
+        state_dir=state_dir,
+        # NOTE: the window state of a partition is backed up to a changelog topic, so when a rebalance moves the
+        # partition to another worker, that worker restores the open windows before processing it
+        use_changelog_topics=True,
+        # NOTE: every commit flushes the window state to state_dir atomically with the offsets (a checkpoint), so a
+        # restart resumes from there with the open windows in place, without replaying the topic. Quix logs the
+        # changelog recovery, only needed when the local state is gone or behind
+        commit_interval=commit_interval_sec,
     )
 
 
@@ -89,64 +112,20 @@ def trade_to_ohlc(
     # https://quix.io/docs/quix-streams/windowing.html#updating-window-definitions
 
     
-    # Function that established the logic for transforming data when initialising tumbling window
-    # TODO Make this more readable, could I use 
-    def _init_ohlc_candle(trade:dict): 
-
-        #breakpoint()
-        """
-        Initialise the Open-High-Low-Close candle, assigin values from to each key taken from the first values of the first trade which is the input dict.
-
-        """
-        logger.debug(f"Received value for OHLC initialization: {trade}")
-        
-        # timestamp = value.get("timestamp_ms") or value.get("time")
-        # if not timestamp:
-        #     logger.warning(f"Missing timestamp in value: {value}")
-        #     return None
-        return {
-            # #"timestamp" : value["timestamp_ms"],
-            # "timestamp" : timestamp,
-            "open": trade["price"],
-            "high": trade["price"],
-            "low": trade["price"],
-            "close": trade["price"],
-            "product_id" : trade["product_id"],
-        }
-        
-        
-    
-    # Function to update the ohlc candle with a simple bubble-compare sort to update the max and min for high and low
-    def _update_ohlc_candle(ohlc_candle: dict, trade: dict) -> dict:
-        #breakpoint()
-        """
-        Basically a bubble sort. Compare subsequent trade, i.e. the most recent trade to the one before, and adjust highs and lows.
-
-        Args:
-            ohlc_candle (dict) : The current ohlc candle
-            trade (dict) : New incoming trade in the sequence.
-        Return:
-            dict: the updated OHLC candle
-        """
-        return {
-            "open": ohlc_candle["open"],
-            "high": max(ohlc_candle["high"], trade["price"]),
-            "low": min(ohlc_candle["high"], trade["price"]),
-            "close": trade["price"],
-            "product_id" : trade["product_id"],           
-        }
-   
+    # The window state is a flat list updated in place (candle_state.py) rather than a new dict per trade: the state
+    # store serialises it on every update, so a small fixed layout is much cheaper to write and read back.
+    # Compare both with `python src/benchmark_reducer.py`
     
     # %% Apply transformations and make candles
     
     #For monitoring:
     # sdf = sdf.tumbling_window(duration_ms =timedelta(seconds=ohlc_windows_seconds))
-    # sdf = sdf.reduce(reducer=_update_ohlc_candle, initializer=_init_ohlc_candle).current()
+    # sdf = sdf.reduce(reducer=update_candle_state, initializer=init_candle_state).current()
     
     # For running in normal non debug mode
     sdf = (
         sdf.tumbling_window(duration_ms=timedelta(seconds=ohlc_windows_seconds))
-        .reduce(reducer=_update_ohlc_candle, initializer=_init_ohlc_candle)
+        .reduce(reducer=update_candle_state, initializer=init_candle_state)
         .final()
         )
 
@@ -160,26 +139,31 @@ def trade_to_ohlc(
     #     'low': 63535.98,
     #     'close': 63537.11,
     #     'product_id': 'BTC/USD',
+    #     'volume': 1.25,
+    #     'notional': 79420.06,
+    #     'vwap': 63536.05,
+    #     'trade_count': 7,
+    #     'buy_volume': 1.0,
+    #     'sell_volume': 0.25,
     # }
     #breakpoint()
-    sdf['open'] = sdf['value']['open']
-    sdf['high'] = sdf['value']['high']
-    sdf['low'] = sdf['value']['low']
-    sdf['close'] = sdf['value']['close']
-    sdf['product_id'] = sdf['value']['product_id']
-    sdf['timestamp'] = sdf['end']
-
-    # Final step of the processing data frame after assigning values, is to return a dict as the sdf
-    sdf = sdf [['timestamp',
-                'product_id', 
-                'open', 
-                'high', 
-                'low', 
-                'close',
-                ]]
-
-    
-    sdf = sdf.update(logger.info)
+    # The closed window {'start', 'end', 'value'} becomes the candle, with the end of the window as timestamp.
+    # NOTE: a window closes on a trade only, nothing is forward filled here, but the candles carry the flag of the
+    # batch path all the same so the consumers see one schema
+    sdf = sdf.apply(lambda window: {
+        'timestamp': window['end'],
+        **candle_state_to_dict(window['value']),
+        'is_forward_filled': False,
+    })
+
+    # Coarser candles rolled up from the base ones, without touching the trades again. The open coarse candles
+    # are kept in the state of the product (the message key), like the tumbling window
+    if ohlc_rollup_windows_seconds:
+        rollup = CandleRollup(ohlc_windows_seconds, ohlc_rollup_windows_seconds)
+        sdf = sdf.apply(rollup.update, stateful=True, expand=True)
+
+    # NOTE: debug, not info: a log line per candle slows the service down when it has a backlog to go through
+    sdf = sdf.update(logger.debug)
     #Write sdf to output topic
     sdf = sdf.to_topic(output_topic)
 
@@ -187,9 +171,59 @@ def trade_to_ohlc(
     # kick-off the streaming application
     app.run(sdf)
 
-if __name__ == '__main__':
+def run_worker(worker_id: int) -> None:
+    """
+    One worker process: the streaming path, or the chunked engine for backfills and watermark mode. The workers
+    share the consumer group, so each one processes its own subset of the partitions, and of the products.
 
-    # app.clear_state()  #USE TO CLEAR CACHE IF TOPIC INCASE TOPIC STATE IS GIVING ERRORS
+    Args:
+        worker_id (int): Index of the worker, names its local state directory
+
+    Returns:
+        None
+    """
+    # Historical backfills can skip the per-trade streaming path and compute the candles in large vectorized chunks.
+    # Closing windows on a watermark also runs on the chunked engine: `.final()` only closes a window on the next
+    # trade of its key and never emits windows without trades. Live, the engine consumes small chunks and switches to
+    # large ones while the consumer lags (adaptive batching), where the Quix path goes one message at a time
+    watermark = None
+    if config_trade_to_ohlc.ohlc_close_windows_on == 'watermark':
+        watermark = PartitionWatermark(
+            lateness_seconds=config_trade_to_ohlc.watermark_lateness_seconds,
+            idle_partition_sec=config_trade_to_ohlc.watermark_idle_partition_seconds,
+            wall_clock=config_trade_to_ohlc.watermark_wall_clock,
+        )
+
+    adaptive_batching = None
+    if config_trade_to_ohlc.adaptive_batching and not config_trade_to_ohlc.ohlc_batch_mode:
+        adaptive_batching = AdaptiveBatching(
+            catch_up_lag_threshold=config_trade_to_ohlc.catch_up_lag_threshold,
+            catch_up_batch_size=config_trade_to_ohlc.batch_size,
+            live_batch_size=config_trade_to_ohlc.live_batch_size,
+            live_poll_timeout_sec=config_trade_to_ohlc.live_poll_timeout_sec,
+            lag_check_interval_sec=config_trade_to_ohlc.lag_check_interval_sec,
+        )
+
+    if config_trade_to_ohlc.ohlc_batch_mode or watermark is not None or adaptive_batching is not None:
+        batch_trade_to_ohlc(
+            kafka_input_topic=config_trade_to_ohlc.kafka_input_topic_name,
+            kafka_output_topic=config_trade_to_ohlc.kafka_output_topic_name,
+            kafka_broker_address=config_trade_to_ohlc.kafka_broker_address,
+            kafka_consumer_group=config_trade_to_ohlc.kafka_consumer_group,
+            ohlc_windows_seconds=config_trade_to_ohlc.ohlc_windows_seconds,
+            ohlc_rollup_windows_seconds=config_trade_to_ohlc.ohlc_rollup_windows_seconds,
+            batch_source=config_trade_to_ohlc.batch_source,
+            trade_store_dir=config_trade_to_ohlc.trade_store_dir,
+            batch_size=config_trade_to_ohlc.batch_size,
+            # NOTE: live data never runs out, only backfills stop once the topic is idle
+            batch_idle_timeout_sec=config_trade_to_ohlc.batch_idle_timeout_sec if config_trade_to_ohlc.ohlc_batch_mode else None,
+            watermark=watermark,
+            forward_fill_empty_candles=watermark is not None and config_trade_to_ohlc.forward_fill_empty_candles,
+            checkpoint_dir=config_trade_to_ohlc.checkpoint_dir,
+            checkpoint_interval_sec=config_trade_to_ohlc.checkpoint_interval_sec,
+            adaptive_batching=adaptive_batching,
+        )
+        return
 
     trade_to_ohlc(
 
@@ -198,11 +232,27 @@ if __name__ == '__main__':
         kafka_broker_address = config_trade_to_ohlc.kafka_broker_address ,
         kafka_consumer_group=config_trade_to_ohlc.kafka_consumer_group,
         ohlc_windows_seconds = config_trade_to_ohlc.ohlc_windows_seconds,
+        ohlc_rollup_windows_seconds = config_trade_to_ohlc.ohlc_rollup_windows_seconds,
+        state_dir = os.path.join(config_trade_to_ohlc.state_dir, f'worker-{worker_id}'),
+        commit_interval_sec = config_trade_to_ohlc.checkpoint_interval_sec,
 
     )
-    
 
 
-    
-
+if __name__ == '__main__':
 
+    # NOTE: app.clear_state() throws away the open windows and forces a replay of the topic. Restarts resume from the
+    # checkpointed state and offsets, only clear it when the window settings change
+
+    # The topics are created with enough partitions for the workers. Kafka does not share a partition between the
+    # consumers of a group, so the partition count is the parallelism cap
+    for topic_name in (config_trade_to_ohlc.kafka_input_topic_name, config_trade_to_ohlc.kafka_output_topic_name):
+        ensure_topic(config_trade_to_ohlc.kafka_broker_address, topic_name, num_partitions=config_trade_to_ohlc.kafka_num_partitions)
+
+    if config_trade_to_ohlc.n_workers == 1:
+        run_worker(worker_id=0)
+    else:
+        # NOTE: the trade store is not partitioned, a single worker reads it
+        assert not (config_trade_to_ohlc.ohlc_batch_mode and config_trade_to_ohlc.batch_source == 'trade_store'), \
+            'batch_source=trade_store runs with a single worker'
+        run_workers(run_worker, n_workers=config_trade_to_ohlc.n_workers)
@@ -0,0 +1,104 @@
+# Event-time watermark over the partitions of the trade topic, so windows close without waiting for their own next trade
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class PartitionWatermark:
+    """
+    Tracks how far event time has progressed on every partition of the trade topic, and derives the watermark, the
+    time up to which every window can be closed:
+
+        - while partitions are active, the watermark follows the slowest of them (cross-partition progress): the
+          minimum over the active partitions of their latest trade timestamp, minus the allowed lateness. A pair
+          with no trades is closed by the progress of the other pairs, instead of by its own next trade
+        - a partition with no message for idle_partition_sec is idle and no longer holds the watermark back
+        - when every partition is idle the consumer is caught up, so with wall_clock the watermark follows the
+          wall clock (live data), otherwise it stays at the latest trade timestamp seen (historical data)
+
+    The watermark never goes back.
+    """
+
+    def __init__(
+        self,
+        lateness_seconds: Optional[float] = 2,
+        idle_partition_sec: Optional[float] = 10,
+        wall_clock: Optional[bool] = True,
+    ) -> None:
+        """
+        Args:
+            lateness_seconds (float): How far behind the event time progress the watermark stays, for late trades
+            idle_partition_sec (float): Seconds without message after which a partition stops holding the watermark
+            wall_clock (bool): Follow the wall clock once every partition is idle. Only for live data
+
+        Returns:
+            None
+        """
+        self.lateness_ms = int(lateness_seconds * 1000)
+        self.idle_partition_sec = idle_partition_sec
+        self.wall_clock = wall_clock
+
+        self._latest_ms: Dict[int, int] = {}
+        self._last_seen_at: Dict[int, float] = {}
+        self._watermark_ms: Optional[int] = None
+
+    def update(self, partitions: np.ndarray, timestamps_ms: np.ndarray) -> None:
+        """
+        Records the trades of a chunk
+
+        Args:
+            partitions (np.ndarray): The partition of every trade
+            timestamps_ms (np.ndarray): The timestamp of every trade
+
+        Returns:
+            None
+        """
+        if len(timestamps_ms) == 0:
+            return
+        now = time.monotonic()
+        for partition, latest_ms in pd.Series(timestamps_ms).groupby(np.asarray(partitions)).max().items():
+            self._latest_ms[partition] = max(self._latest_ms.get(partition, latest_ms), int(latest_ms))
+            self._last_seen_at[partition] = now
+
+    def drop_partitions(self, partitions: List[int]) -> None:
+        """
+        Stops tracking partitions assigned to another worker
+        """
+        for partition in partitions:
+            self._latest_ms.pop(partition, None)
+            self._last_seen_at.pop(partition, None)
+
+    def partition_latest_ms(self, partition: int) -> Optional[int]:
+        return self._latest_ms.get(partition)
+
+    def restore_partition(self, partition: int, latest_ms: int) -> None:
+        """
+        Restores the progress of a partition from a checkpoint. The partition counts as active until it idles again
+        """
+        self._latest_ms[partition] = max(self._latest_ms.get(partition, latest_ms), int(latest_ms))
+        self._last_seen_at[partition] = time.monotonic()
+
+    def get(self) -> Optional[int]:
+        """
+        Returns the current watermark in Unix milliseconds, None until a trade or the wall clock gives one
+        """
+        now = time.monotonic()
+        active_latest_ms = [
+            latest_ms for partition, latest_ms in self._latest_ms.items()
+            if now - self._last_seen_at[partition] < self.idle_partition_sec
+        ]
+
+        if active_latest_ms:
+            watermark_ms = min(active_latest_ms) - self.lateness_ms
+        elif self.wall_clock:
+            watermark_ms = int(time.time() * 1000) - self.lateness_ms
+        elif self._latest_ms:
+            watermark_ms = max(self._latest_ms.values()) - self.lateness_ms
+        else:
+            watermark_ms = None
+
+        if watermark_ms is not None and (self._watermark_ms is None or watermark_ms > self._watermark_ms):
+            self._watermark_ms = watermark_ms
+        return self._watermark_ms
@@ -0,0 +1,59 @@
+# Runs N copies of the service in separate processes, one consumer group, so the partitions of the trade topic are
+# processed in parallel
+import multiprocessing
+import time
+from typing import Callable
+
+from loguru import logger
+
+
+def run_workers(target: Callable[[int], None], n_workers: int, restart_delay_sec: float = 5) -> None:
+    """
+    Starts target(worker_id) in n_workers processes and supervises them until they are all done.
+
+    Every worker is a regular consumer of the same consumer group, so Kafka shares the partitions between them and
+    moves them to the other workers when one dies (a rebalance). A worker that crashes is restarted, and gets
+    partitions again on the next rebalance. A worker that exits cleanly (e.g. a backfill that read the topic to the
+    end) is not.
+
+    NOTE: more workers than partitions leaves the extra workers idle, see KAFKA_NUM_PARTITIONS.
+
+    Args:
+        target (Callable[[int], None]): Module-level function running one worker, given its id
+        n_workers (int): Number of worker processes
+        restart_delay_sec (float): Wait before restarting a crashed worker
+
+    Returns:
+        None
+    """
+    # NOTE: spawn, not fork: librdkafka threads and RocksDB handles must not be inherited from the parent
+    context = multiprocessing.get_context('spawn')
+
+    def start(worker_id: int):
+        process = context.Process(target=target, args=(worker_id,), name=f'trade_to_ohlc-worker-{worker_id}')
+        process.start()
+        logger.info(f'Started worker {worker_id} (pid {process.pid})')
+        return process
+
+    processes = {worker_id: start(worker_id) for worker_id in range(n_workers)}
+    try:
+        while processes:
+            time.sleep(1)
+            for worker_id, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                if process.exitcode == 0:
+                    logger.info(f'Worker {worker_id} done')
+                    del processes[worker_id]
+                else:
+                    logger.error(f'Worker {worker_id} exited with code {process.exitcode}, restarting it')
+                    time.sleep(restart_delay_sec)
+                    processes[worker_id] = start(worker_id)
+    except KeyboardInterrupt:
+        logger.info('Stopping the workers')
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join()
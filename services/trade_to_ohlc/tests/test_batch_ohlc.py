@@ -0,0 +1,139 @@
+import random
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch_ohlc import CANDLE_COLUMNS, BatchOHLCEngine
+from candle_state import candle_state_to_dict, init_candle_state, update_candle_state
+
+WINDOW_SECONDS = 60
+WINDOW_MS = WINDOW_SECONDS * 1000
+START_MS = 1_717_632_000_000 # 2024-06-06 00:00:00 UTC, aligned on the windows
+
+
+def make_trades(n_trades: int, product_ids: List[str], seed: int = 0) -> pd.DataFrame:
+    """ Trades in arrival order, interleaved between the products, timestamps increasing per product """
+    rng = random.Random(seed)
+    prices = {product_id: 100.0 * (i + 1) for i, product_id in enumerate(product_ids)}
+    timestamp_ms = START_MS
+    rows = []
+    for _ in range(n_trades):
+        timestamp_ms += rng.randint(0, 7_000)
+        product_id = rng.choice(product_ids)
+        prices[product_id] += rng.gauss(0, 1)
+        rows.append({
+            'product_id': product_id,
+            'price': round(prices[product_id], 2),
+            'volume': round(rng.expovariate(10), 8),
+            'timestamp_ms': timestamp_ms,
+            'side': rng.choice(('buy', 'sell')),
+        })
+    return pd.DataFrame(rows)
+
+
+def stream_candles(trades: pd.DataFrame) -> pd.DataFrame:
+    """
+    The streaming path of main.py, one trade at a time: tumbling windows per product, reduced with the candle state,
+    a window emitted once a later trade of its product reaches its end
+    """
+    open_windows: Dict[str, list] = {}
+    candles = []
+    for trade in trades.to_dict('records'):
+        window_start = trade['timestamp_ms'] // WINDOW_MS * WINDOW_MS
+        current = open_windows.get(trade['product_id'])
+        if current is not None and current[0] == window_start:
+            update_candle_state(current[1], trade)
+            continue
+        if current is not None:
+            candles.append({'timestamp': current[0] + WINDOW_MS, **candle_state_to_dict(current[1])})
+        open_windows[trade['product_id']] = [window_start, init_candle_state(trade)]
+
+    candles = pd.DataFrame(candles, columns=CANDLE_COLUMNS)
+    return candles.sort_values(['timestamp', 'product_id'], kind='stable').reset_index(drop=True)
+
+
+def assert_same_candles(actual: pd.DataFrame, expected: pd.DataFrame) -> None:
+    assert len(actual) == len(expected)
+    for column in ['timestamp', 'product_id', 'trade_count']:
+        assert actual[column].tolist() == expected[column].tolist(), column
+    for column in ['open', 'high', 'low', 'close', 'volume', 'notional', 'vwap', 'buy_volume', 'sell_volume']:
+        np.testing.assert_allclose(actual[column].to_numpy(dtype=float), expected[column].to_numpy(dtype=float), err_msg=column)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 37, 10_000])
+def test_batch_engine_matches_the_streaming_reducer(chunk_size):
+    trades = make_trades(500, ['BTC/USD', 'ETH/USD', 'SOL/USD'])
+    engine = BatchOHLCEngine(window_seconds=WINDOW_SECONDS)
+
+    # NOTE: chunk boundaries must not change the candles, the open windows are carried over
+    candles = pd.concat(
+        [engine.process(trades.iloc[i:i + chunk_size]) for i in range(0, len(trades), chunk_size)],
+        ignore_index=True,
+    )
+    # Every chunk is sorted, the candles of different chunks come in the order their windows closed
+    candles = candles.sort_values(['timestamp', 'product_id'], kind='stable').reset_index(drop=True)
+
+    assert_same_candles(candles, stream_candles(trades))
+    assert engine.n_trades == len(trades)
+    assert engine.n_late_trades == 0
+
+
+def test_trades_of_closed_windows_are_late():
+    engine = BatchOHLCEngine(window_seconds=WINDOW_SECONDS)
+    trades = pd.DataFrame([
+        {'product_id': 'BTC/USD', 'price': 10.0, 'volume': 1.0, 'timestamp_ms': START_MS + 1_000, 'side': 'buy'},
+        {'product_id': 'BTC/USD', 'price': 11.0, 'volume': 1.0, 'timestamp_ms': START_MS + WINDOW_MS, 'side': 'buy'},
+        # The first window was closed by the trade before
+        {'product_id': 'BTC/USD', 'price': 99.0, 'volume': 1.0, 'timestamp_ms': START_MS + 2_000, 'side': 'sell'},
+    ])
+
+    candles = engine.process(trades)
+
+    assert candles['timestamp'].tolist() == [START_MS + WINDOW_MS]
+    assert candles['high'].tolist() == [10.0]
+    assert engine.n_late_trades == 1
+    # Flagged without forward_fill too, like the streaming candles
+    assert candles['is_forward_filled'].tolist() == [False]
+
+
+def test_forward_fill_between_candles_and_up_to_the_watermark():
+    engine = BatchOHLCEngine(window_seconds=WINDOW_SECONDS, forward_fill=True)
+    trades = pd.DataFrame([
+        {'product_id': 'BTC/USD', 'price': 10.0, 'volume': 1.0, 'timestamp_ms': START_MS + 1_000, 'side': 'buy'},
+        {'product_id': 'BTC/USD', 'price': 12.0, 'volume': 2.0, 'timestamp_ms': START_MS + 3 * WINDOW_MS + 1_000, 'side': 'sell'},
+    ])
+
+    # Windows 1 and 2 had no trade, the watermark closes window 3 and the empty windows 4 and 5
+    candles = engine.process(trades, watermark_ms=START_MS + 6 * WINDOW_MS)
+
+    assert candles['timestamp'].tolist() == [START_MS + i * WINDOW_MS for i in range(1, 7)]
+    assert candles['is_forward_filled'].tolist() == [False, True, True, False, True, True]
+    assert candles['close'].tolist() == [10.0, 10.0, 10.0, 12.0, 12.0, 12.0]
+    filled = candles[candles['is_forward_filled']]
+    assert (filled['open'] == filled['close']).all()
+    assert (filled['volume'] == 0.0).all()
+    assert (filled['trade_count'] == 0).all()
+    assert engine.n_forward_filled == 4
+
+
+def test_watermark_closes_windows_without_a_later_trade():
+    engine = BatchOHLCEngine(window_seconds=WINDOW_SECONDS)
+    trades = pd.DataFrame([
+        {'product_id': 'BTC/USD', 'price': 10.0, 'volume': 1.0, 'timestamp_ms': START_MS + 1_000, 'side': 'buy'},
+    ])
+
+    no_candles = engine.process(trades)
+    assert len(no_candles) == 0
+    assert list(no_candles.columns) == engine.columns
+    assert engine.n_open_windows() == 1
+
+    # An empty chunk with a watermark past the window end closes it
+    candles = engine.process(trades.iloc[:0], watermark_ms=START_MS + WINDOW_MS)
+    assert candles['timestamp'].tolist() == [START_MS + WINDOW_MS]
+    assert engine.n_open_windows() == 0
+
+    # And a trade of that window is now late
+    engine.process(trades)
+    assert engine.n_late_trades == 1
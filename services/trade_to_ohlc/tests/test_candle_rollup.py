@@ -0,0 +1,105 @@
+import pytest
+
+from candle_rollup import CandleRollup, InMemoryState
+
+START_MS = 1_717_632_000_000 # 2024-06-06 00:00:00 UTC
+
+
+def base_candle(minute: int, close: float, volume: float = 1.0, **fields) -> dict:
+    """ The 1m candle of the window ending `minute` minutes after START_MS """
+    return {
+        'timestamp': START_MS + minute * 60_000,
+        'product_id': 'BTC/USD',
+        'open': close - 1,
+        'high': close + 1,
+        'low': close - 2,
+        'close': close,
+        'volume': volume,
+        'notional': close * volume,
+        'vwap': close,
+        'trade_count': 2,
+        'buy_volume': volume,
+        'sell_volume': 0.0,
+        **fields,
+    }
+
+
+def test_every_candle_is_tagged_with_its_resolution():
+    rollup = CandleRollup(60, [300])
+    emitted = rollup.update(base_candle(1, 10.0), InMemoryState())
+
+    assert emitted == [{**base_candle(1, 10.0), 'window_seconds': 60}]
+
+
+def test_coarse_candle_closes_on_its_boundary():
+    rollup = CandleRollup(60, [300])
+    state = InMemoryState()
+
+    emitted = [candle for minute in range(1, 6) for candle in rollup.update(base_candle(minute, 10.0 + minute), state)]
+
+    coarse = [candle for candle in emitted if candle['window_seconds'] == 300]
+    assert len(emitted) == 6
+    assert coarse == [{
+        'timestamp': START_MS + 5 * 60_000,
+        'product_id': 'BTC/USD',
+        'open': 10.0,
+        'high': 16.0,
+        'low': 9.0,
+        'close': 15.0,
+        'volume': 5.0,
+        'notional': 65.0,
+        'vwap': 13.0,
+        'trade_count': 10,
+        'buy_volume': 5.0,
+        'sell_volume': 0.0,
+        'window_seconds': 300,
+    }]
+    assert state['rollup_300'] is None
+
+
+def test_coarse_candle_closes_on_a_later_window_when_its_last_minutes_had_no_trades():
+    rollup = CandleRollup(60, [300])
+    state = InMemoryState()
+
+    rollup.update(base_candle(1, 10.0), state)
+    rollup.update(base_candle(2, 11.0), state)
+    emitted = rollup.update(base_candle(7, 12.0), state)
+
+    assert [(candle['window_seconds'], candle['timestamp']) for candle in emitted] == [
+        (60, START_MS + 7 * 60_000),
+        (300, START_MS + 5 * 60_000),
+    ]
+    assert emitted[1]['close'] == 11.0
+    # The 7th minute opened the next 5m window
+    assert state['rollup_300']['timestamp'] == START_MS + 10 * 60_000
+
+
+def test_levels_roll_up_from_the_level_below():
+    rollup = CandleRollup(60, [900, 300])
+    state = InMemoryState()
+
+    emitted = [candle for minute in range(1, 16) for candle in rollup.update(base_candle(minute, 10.0), state)]
+
+    assert [candle['window_seconds'] for candle in emitted if candle['window_seconds'] > 60] == [300, 300, 300, 900]
+    quarter = emitted[-1]
+    assert quarter['window_seconds'] == 900
+    assert quarter['trade_count'] == 30
+    assert quarter['volume'] == 15.0
+
+
+def test_forward_filled_only_when_every_sub_window_is():
+    rollup = CandleRollup(60, [120])
+    state = InMemoryState()
+
+    rollup.update(base_candle(1, 10.0, is_forward_filled=True), state)
+    filled = rollup.update(base_candle(2, 10.0, is_forward_filled=True), state)[-1]
+    rollup.update(base_candle(3, 10.0, is_forward_filled=True), state)
+    traded = rollup.update(base_candle(4, 11.0, is_forward_filled=False), state)[-1]
+
+    assert filled['is_forward_filled'] is True
+    assert traded['is_forward_filled'] is False
+
+
+def test_rollup_windows_must_be_multiples():
+    with pytest.raises(AssertionError):
+        CandleRollup(60, [90])
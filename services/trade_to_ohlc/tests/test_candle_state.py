@@ -0,0 +1,72 @@
+from quixstreams.utils.json import dumps, loads
+
+from candle_state import candle_state_to_dict, init_candle_state, update_candle_state
+
+
+def trade(price: float, volume: float, side: str = 'buy') -> dict:
+    return {'product_id': 'BTC/USD', 'price': price, 'volume': volume, 'timestamp_ms': 1_717_632_001_000, 'side': side}
+
+
+def test_reducer():
+    state = init_candle_state(trade(10.0, 1.0))
+    for t in [trade(12.0, 2.0, 'sell'), trade(9.0, 1.0), trade(11.0, 1.0, 'sell')]:
+        state = update_candle_state(state, t)
+
+    assert candle_state_to_dict(state) == {
+        'product_id': 'BTC/USD',
+        'open': 10.0,
+        'high': 12.0,
+        'low': 9.0,
+        'close': 11.0,
+        'volume': 5.0,
+        'notional': 54.0,
+        'vwap': 54.0 / 5.0,
+        'trade_count': 4,
+        'buy_volume': 2.0,
+        'sell_volume': 3.0,
+    }
+
+
+def test_state_survives_the_state_store_serialisation():
+    state = loads(dumps(init_candle_state(trade(10.0, 1.0))))
+    state = update_candle_state(state, trade(11.0, 1.0))
+
+    assert candle_state_to_dict(state)['trade_count'] == 2
+
+
+def test_dict_state_of_the_volume_reducer_is_migrated():
+    # A window opened before the deploy, with the dict reducer of the volume candles
+    old_state = {
+        'open': 10.0, 'high': 12.0, 'low': 10.0, 'close': 12.0, 'product_id': 'BTC/USD',
+        'volume': 2.0, 'notional': 22.0, 'vwap': 11.0, 'trade_count': 2, 'buy_volume': 2.0, 'sell_volume': 0.0,
+    }
+
+    state = update_candle_state(old_state, trade(8.0, 1.0, 'sell'))
+
+    assert isinstance(state, list)
+    assert candle_state_to_dict(state) == {
+        'product_id': 'BTC/USD',
+        'open': 10.0,
+        'high': 12.0,
+        'low': 8.0,
+        'close': 8.0,
+        'volume': 3.0,
+        'notional': 30.0,
+        'vwap': 10.0,
+        'trade_count': 3,
+        'buy_volume': 2.0,
+        'sell_volume': 1.0,
+    }
+
+
+def test_dict_state_of_the_ohlc_reducer_is_migrated():
+    old_state = {'open': 10.0, 'high': 12.0, 'low': 10.0, 'close': 12.0, 'product_id': 'BTC/USD'}
+
+    # A window closed without another trade after the deploy
+    candle = candle_state_to_dict(old_state)
+    assert (candle['open'], candle['high'], candle['close'], candle['volume']) == (10.0, 12.0, 12.0, 0.0)
+    assert candle['vwap'] == 12.0
+
+    state = update_candle_state(old_state, trade(13.0, 1.0))
+    assert candle_state_to_dict(state)['high'] == 13.0
+    assert candle_state_to_dict(state)['volume'] == 1.0
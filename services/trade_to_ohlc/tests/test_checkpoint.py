@@ -0,0 +1,81 @@
+import pandas as pd
+
+from batch_ohlc import BatchOHLCEngine
+from checkpoint import PartitionCheckpoint
+
+WINDOW_SECONDS = 60
+WINDOW_MS = WINDOW_SECONDS * 1000
+START_MS = 1_717_632_000_000 # 2024-06-06 00:00:00 UTC
+
+
+def make_trades() -> pd.DataFrame:
+    rows = []
+    for offset, (product_id, partition, seconds, price) in enumerate([
+        ('BTC/USD', 0, 1, 10.0),
+        ('ETH/USD', 1, 2, 20.0),
+        ('BTC/USD', 0, 30, 11.0),
+        ('ETH/USD', 1, 65, 21.0),
+        ('BTC/USD', 0, 70, 12.0),
+        ('BTC/USD', 0, 80, 13.0),
+        ('ETH/USD', 1, 130, 22.0),
+        ('BTC/USD', 0, 140, 14.0),
+    ]):
+        rows.append({
+            'product_id': product_id,
+            'price': price,
+            'volume': 1.0,
+            'timestamp_ms': START_MS + seconds * 1000,
+            'side': 'buy' if offset % 2 else 'sell',
+            'partition': partition,
+            'offset': offset,
+        })
+    return pd.DataFrame(rows)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoints = PartitionCheckpoint(str(tmp_path), 'trade_to_ohlc', 'trade')
+    assert checkpoints.load(0) is None
+
+    checkpoint = {'next_offset': 18233, 'engine': {'pending': {'price': [1.5]}}, 'latest_ms': START_MS, 'rollup': {}}
+    checkpoints.save(0, checkpoint)
+
+    loaded = checkpoints.load(0)
+    assert {key: loaded[key] for key in checkpoint} == checkpoint
+    assert loaded['partition'] == 0
+    assert 'saved_at_ms' in loaded
+    # Written atomically, no temporary file is left behind
+    assert [path.name for path in checkpoints.dir.iterdir()] == ['partition-0.json']
+
+
+def test_unreadable_checkpoint_is_ignored(tmp_path):
+    checkpoints = PartitionCheckpoint(str(tmp_path), 'trade_to_ohlc', 'trade')
+    (checkpoints.dir / 'partition-3.json').write_text('{not json')
+
+    assert checkpoints.load(3) is None
+
+
+def test_engine_restored_from_a_checkpoint_emits_the_same_candles(tmp_path):
+    trades = make_trades()
+    first, rest = trades.iloc[:5], trades.iloc[5:]
+
+    # Reference: a single engine over all the trades
+    expected = BatchOHLCEngine(window_seconds=WINDOW_SECONDS, forward_fill=True)
+    expected_candles = pd.concat([expected.process(first), expected.process(rest)], ignore_index=True)
+
+    # Restart after the first chunk: the state of every partition goes through a checkpoint file
+    engine = BatchOHLCEngine(window_seconds=WINDOW_SECONDS, forward_fill=True)
+    candles = [engine.process(first)]
+    assert engine.pending_offsets() == {0: 4, 1: 3}
+
+    checkpoints = PartitionCheckpoint(str(tmp_path), 'trade_to_ohlc', 'trade')
+    for partition in (0, 1):
+        checkpoints.save(partition, {'engine': engine.partition_state(partition)})
+
+    restored = BatchOHLCEngine(window_seconds=WINDOW_SECONDS, forward_fill=True)
+    for partition in (0, 1):
+        restored.restore_partition(partition, checkpoints.load(partition)['engine'])
+    assert restored.pending_offsets() == {0: 4, 1: 3}
+    assert restored.n_open_windows() == engine.n_open_windows()
+
+    candles.append(restored.process(rest))
+    pd.testing.assert_frame_equal(pd.concat(candles, ignore_index=True), expected_candles)
@@ -0,0 +1,54 @@
+import time
+
+import numpy as np
+
+from watermark import PartitionWatermark
+
+
+def test_watermark_follows_the_slowest_active_partition():
+    watermark = PartitionWatermark(lateness_seconds=2, idle_partition_sec=60, wall_clock=False)
+    assert watermark.get() is None
+
+    watermark.update(np.array([0, 0, 1]), np.array([10_000, 20_000, 15_000]))
+    assert watermark.get() == 15_000 - 2_000
+
+    watermark.update(np.array([1]), np.array([30_000]))
+    assert watermark.get() == 20_000 - 2_000
+
+
+def test_watermark_never_goes_back():
+    watermark = PartitionWatermark(lateness_seconds=0, idle_partition_sec=60, wall_clock=False)
+    watermark.update(np.array([0]), np.array([50_000]))
+    assert watermark.get() == 50_000
+
+    # A new partition behind the others does not move the watermark back
+    watermark.update(np.array([1]), np.array([10_000]))
+    assert watermark.get() == 50_000
+
+
+def test_idle_partitions_no_longer_hold_the_watermark():
+    watermark = PartitionWatermark(lateness_seconds=1, idle_partition_sec=0, wall_clock=False)
+    watermark.update(np.array([0, 1]), np.array([10_000, 40_000]))
+
+    # Every partition is idle: caught up on historical data, the latest trade seen
+    assert watermark.get() == 40_000 - 1_000
+
+
+def test_wall_clock_once_every_partition_is_idle():
+    watermark = PartitionWatermark(lateness_seconds=1, idle_partition_sec=0, wall_clock=True)
+    watermark.update(np.array([0]), np.array([10_000]))
+
+    now_ms = int(time.time() * 1000)
+    assert watermark.get() >= now_ms - 1_000
+
+
+def test_dropped_partitions_are_forgotten():
+    watermark = PartitionWatermark(lateness_seconds=0, idle_partition_sec=60, wall_clock=False)
+    watermark.update(np.array([0, 1]), np.array([10_000, 40_000]))
+    watermark.drop_partitions([0])
+
+    assert watermark.partition_latest_ms(0) is None
+    assert watermark.get() == 40_000
+
+    watermark.restore_partition(0, 60_000)
+    assert watermark.partition_latest_ms(0) == 60_000
@@ -1,67 +1,60 @@
-import hopsworks
-from hsfs.feature_group import FeatureGroup
+from typing import Optional
+
 from loguru import logger
 import pandas as pd
 
+# NOTE: the feature group interface of kafka_to_feature_store, services/kafka_to_feature_store/src must be on the PYTHONPATH
+from sinks import FeatureGroupSink, get_feature_group_sink
+
 class OhlcDataWriter:
     """
-    A class to help us read our OHLC data from the feature store.
-    
-    The Hopsworks credentials are read from the environment variables.
-    - HOPSWORKS_PROJECT_NAME
-    - HOPSWORKS_API_KEY
+    A class to help us write our OHLC data to the feature store.
+
+    The data is written through the FeatureGroupSink of kafka_to_feature_store, so the same code writes to Hopsworks
+    or to the local stores (feature_store_backend='local', no network or credentials needed).
     """
     def __init__(
         self,
-        hopsworks_project_name: str,
-        hopsworks_api_key: str,
-        feature_group_name: str,
-        feature_group_version: int,
+        hopsworks_project_name: Optional[str] = None,
+        hopsworks_api_key: Optional[str] = None,
+        feature_group_name: Optional[str] = None,
+        feature_group_version: Optional[int] = None,
+        feature_store_backend: Optional[str] = 'hopsworks',
+        local_store_dir: Optional[str] = 'state/local_feature_store',
     ):
+        """
+        Args:
+            hopsworks_project_name (str): Hopsworks project, HOPSWORKS_PROJECT_NAME by default
+            hopsworks_api_key (str): Hopsworks API key, HOPSWORKS_API_KEY by default
+            feature_group_name (str): Name of the feature group
+            feature_group_version (int): The version of the feature group
+            feature_store_backend (str): 'hopsworks', 'local' or 'hopsworks+local', as in kafka_to_feature_store
+            local_store_dir (str): Root directory of the local stores
+        """
+        # NOTE: the arguments keep the order they had before the local backend, the credentials are optional now
+        if feature_group_name is None or feature_group_version is None:
+            raise ValueError('The feature group name and version must be provided.')
         self.feature_group_name = feature_group_name
         self.feature_group_version = feature_group_version
-        self.hopsworks_project_name = hopsworks_project_name
-        self.hopsworks_api_key = hopsworks_api_key
+
+        self._sink: FeatureGroupSink = get_feature_group_sink(
+            backend=feature_store_backend,
+            feature_group_name=feature_group_name,
+            feature_group_version=feature_group_version,
+            local_store_dir=local_store_dir,
+            hopsworks_project_name=hopsworks_project_name,
+            hopsworks_api_key=hopsworks_api_key,
+        )
 
     def write_from_csv(self, csv_file_path: str):
         """
         Writes the OHLC data from a CSV file to the feature store.
         """
-        feature_group = self._get_feature_group()
-
         # Read the data from the CSV file
         data = pd.read_csv(csv_file_path)
 
-        feature_group.insert(
-            data,
-            write_options={
-                'start_offline_materialization': True
-            },
-        )
-
-    def _get_feature_group(self) -> FeatureGroup:
-        """
-        Returns (and possibly creates) the feature group we will be writing to.
-        """
-        # Authenticate with Hopsworks API
-        project = hopsworks.login(
-            project=self.hopsworks_project_name,
-            api_key_value=self.hopsworks_api_key,
-        )
-
-        # Get the feature store
-        feature_store = project.get_feature_store()
-
-        feature_group = feature_store.get_or_create_feature_group(
-            name=self.feature_group_name,
-            version=self.feature_group_version,
-            description='OHLC data coming from Kraken',
-            primary_key=['product_id', 'timestamp'],
-            event_time='timestamp',
-            online_enabled=True,
-        )
-
-        return feature_group
+        # NOTE: 'offline' starts the offline materialization of the insert, as the write_options here used to
+        self._sink.push(data=data, online_or_offline='offline')
 
 def main(
     hopsworks_project_name: str,
@@ -69,12 +62,14 @@ def main(
     feature_group_name: str,
     feature_group_version: int,
     csv_file: str,
+    feature_store_backend: Optional[str] = 'hopsworks',
 ):
     writer = OhlcDataWriter(
         hopsworks_project_name=hopsworks_project_name,
         hopsworks_api_key=hopsworks_api_key,
         feature_group_name=feature_group_name,
         feature_group_version=feature_group_version,
+        feature_store_backend=feature_store_backend,
     )
     writer.write_from_csv(csv_file)
     logger.debug(f'OHLC data from file {csv_file} was saved to {feature_group_name}-{feature_group_version}')
@@ -85,7 +80,3 @@ if __name__ == '__main__':
 
 #     from fire import Fire
 #     Fire(main)
-
-
-
-        
\ No newline at end of file